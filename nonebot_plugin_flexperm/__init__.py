@@ -8,5 +8,6 @@ from . import plugin as _
 from . import cmds as _
 
 from .plugin import register, PluginHandler
+from .core import PermissionHandle
 
 del PluginLoader
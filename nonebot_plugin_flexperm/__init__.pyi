@@ -1,12 +1,22 @@
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Union, overload
+from typing import Optional, Union, overload
 
 from nonebot.adapters import Bot, Event
 from nonebot.permission import Permission
 
+from .explain import Explanation
+from .listing import GroupInfo, GroupPage
+
 Designator = Union[Event, str, None]
 
 
+class PermissionHandle(str):
+    """
+    预先处理过的权限名，与同名字符串相等。通过 PluginHandler.perm 创建。
+    """
+
+
 def register(plugin_name: str) -> "PluginHandler":
     """
     注册插件，并获取交互对象。
@@ -32,6 +42,16 @@ class PluginHandler:
         :return: self
         """
 
+    def perm(self, perm: str) -> PermissionHandle:
+        """
+        创建权限句柄。会修饰权限名，详见 __call__ 。
+
+        句柄可以代替权限名传给 __call__ 、 has 等接口，不会被再次修饰。在频繁调用的地方使用句柄可以省去每次修饰和拆分权限名的开销。
+
+        :param perm: 权限名。
+        :return: 权限句柄。
+        """
+
     def __call__(self, *perm: str, check_root: bool = ...) -> Permission:
         """
         创建权限检查器。若设置了 check_root ，则除了传入的权限外，还会检查本插件的根权限。
@@ -43,7 +63,9 @@ class PluginHandler:
         - 以"."开头的，在开头添加前一个权限名的修饰结果。若指定的第一个权限名就以"."开头，则添加插件名。
         - 否则，在开头添加 插件名+"." 。
 
-        :param perm: 权限名，若传入多个权限则须同时满足。
+        传入的权限句柄不会被修饰。
+
+        :param perm: 权限名或权限句柄，若传入多个权限则须同时满足。
         :param check_root: 如果传入布尔值，则替代之前 self.check_root() 的设定。
         :return: 权限检查器，可以直接传递给 nonebot 事件响应器。
         """
@@ -52,19 +74,31 @@ class PluginHandler:
         """
         检查事件是否具有指定权限。会修饰权限名，详见 __call__ 。不会自动检查根权限，无论是否设置 check_root 。
 
-        :param perm: 权限名，若传入多个权限则须同时满足。
+        :param perm: 权限名或权限句柄，若传入多个权限则须同时满足。
         :param bot: 机器人，默认为当前正在处理事件的机器人。
         :param event: 事件，默认为当前正在处理的事件。
         :return: 检查结果。
         """
 
+    def explain(self, perm: str, bot: Bot = None, event: Event = None) -> Explanation:
+        """
+        检查事件是否具有指定权限，并返回检查过程。会修饰权限名，详见 __call__ 。不使用缓存，仅用于诊断。
+
+        :param perm: 权限名或权限句柄。
+        :param bot: 机器人，默认为当前正在处理事件的机器人。
+        :param event: 事件，默认为当前正在处理的事件。
+        :return: 检查过程，转换为字符串即可得到便于阅读的说明。
+        """
+
     @overload
     def add_permission(self, perm: str, *,
-                       comment: str = None, create_group: bool = True) -> bool: ...
+                       comment: str = None, create_group: bool = True,
+                       expires: Union[datetime, timedelta, float, None] = None) -> bool: ...
 
     @overload
     def add_permission(self, designator: Designator, perm: str, *,
-                       comment: str = None, create_group: bool = True) -> bool:
+                       comment: str = None, create_group: bool = True,
+                       expires: Union[datetime, timedelta, float, None] = None) -> bool:
         """
         向权限组添加一项权限。会修饰权限名。
 
@@ -74,7 +108,8 @@ class PluginHandler:
         :param perm: 权限名。
         :param comment: 注释。
         :param create_group: 如果权限组不存在，是否自动创建。
-        :return: 是否确实更改了，如果权限组中已有指定"授予"权限描述则返回 False 。
+        :param expires: 到期时间，或从现在起的有效时长（timedelta 或秒数）。为 None 表示长期有效。
+        :return: 是否确实更改了，如果权限组中已有期限相同的"授予"权限描述则返回 False 。已有该描述但期限不同时改为新的期限。
         :raise KeyError: 权限组不存在，并且指定为不自动创建。
         :raise TypeError: 权限组不可修改。
         """
@@ -95,7 +130,8 @@ class PluginHandler:
         :param perm: 权限名。
         :param comment: 注释。
         :param create_group: 如果权限组不存在，是否自动创建。
-        :return: 是否确实更改了，如果权限组中已有指定"撤销"权限描述则返回 False 。
+        :param expires: 到期时间，或从现在起的有效时长（timedelta 或秒数）。为 None 表示长期有效。
+        :return: 是否确实更改了，如果权限组中已有长期有效的"撤销"权限描述则返回 False 。已有的"撤销"描述有期限时改为长期有效。
         :raise KeyError: 权限组不存在，并且指定为不自动创建。
         :raise TypeError: 权限组不可修改。
         """
@@ -120,11 +156,13 @@ class PluginHandler:
 
     @overload
     def add_item(self, item: str, *,
-                 comment: str = None, create_group: bool = True) -> bool: ...
+                 comment: str = None, create_group: bool = True,
+                 expires: Union[datetime, timedelta, float, None] = None) -> bool: ...
 
     @overload
     def add_item(self, designator: Designator, item: str, *,
-                 comment: str = None, create_group: bool = True) -> bool:
+                 comment: str = None, create_group: bool = True,
+                 expires: Union[datetime, timedelta, float, None] = None) -> bool:
         """
         向权限组添加权限描述。会修饰权限名。
 
@@ -132,7 +170,8 @@ class PluginHandler:
         :param item: 权限描述。
         :param comment: 注释。
         :param create_group: 如果权限组不存在，是否自动创建。
-        :return: 是否确实添加了，如果权限组中已有指定描述则返回 False 。
+        :param expires: 到期时间，或从现在起的有效时长（timedelta 或秒数）。为 None 表示长期有效。
+        :return: 是否确实更改了，如果权限组中已有期限相同的指定描述则返回 False 。已有该描述但期限不同时改为新的期限。
         :raise KeyError: 权限组不存在，并且指定为不自动创建。
         :raise TypeError: 权限组不可修改。
         """
@@ -153,6 +192,37 @@ class PluginHandler:
         :raise TypeError: 权限组不可修改。
         """
 
+    @overload
+    def add_overlay(self, item: str, *, expires: Union[datetime, timedelta, float, None] = None) -> bool: ...
+
+    @overload
+    def add_overlay(self, designator: Designator, item: str, *,
+                    expires: Union[datetime, timedelta, float, None] = None) -> bool:
+        """
+        向权限组的临时覆盖层添加权限描述，同时移除相反的描述。会修饰权限名。
+
+        覆盖层只保存在内存中，不修改配置文件，重启后丢失。检查时覆盖层优先于对应权限组，权限组不存在时也可以使用。
+
+        :param designator: 权限组指示符。
+        :param item: 权限描述。
+        :param expires: 到期时间，或从现在起的有效时长（timedelta 或秒数）。为 None 表示一直有效。
+        :return: 是否确实更改了，如果覆盖层中已有相同期限的同一描述则返回 False 。
+        :raise ValueError: 权限组不是用户、群组或 global 名称空间的默认权限组，其覆盖层不会生效。
+        """
+
+    @overload
+    def remove_overlay(self, item: str) -> bool: ...
+
+    @overload
+    def remove_overlay(self, designator: Designator, item: str) -> bool:
+        """
+        从权限组的临时覆盖层移除权限描述。会修饰权限名。
+
+        :param designator: 权限组指示符。
+        :param item: 权限描述。
+        :return: 是否确实移除了，如果覆盖层中没有指定描述则返回 False 。
+        """
+
     @overload
     def add_inheritance(self, target: Designator, *,
                         comment: str = None, create_group: bool = True) -> bool: ...
@@ -210,3 +280,22 @@ class PluginHandler:
         :raise ValueError: 因权限组非空而没有移除。
         :raise TypeError: 名称空间不可修改。
         """
+
+    def list_groups(self, namespace: str = 'global', page: int = 1, page_size: int = 20) -> GroupPage:
+        """
+        分页列出名称空间中的权限组。只遍历配置中的组名，不加载权限组。
+
+        :param namespace: 名称空间。
+        :param page: 页码，从 1 开始。
+        :param page_size: 每页数量。
+        :return: 一页权限组，转换为字符串即可得到便于阅读的列表。
+        :raise ValueError: 页码或每页数量小于 1 。
+        """
+
+    def show_group(self, designator: Designator = None) -> Optional[GroupInfo]:
+        """
+        获取权限组的内容，包括直接包含的权限描述、继承关系、临时覆盖层和实际生效的权限描述。
+
+        :param designator: 权限组指示符。
+        :return: 权限组内容，转换为字符串即可得到便于阅读的说明。若权限组不存在则返回 None 。
+        """
@@ -0,0 +1,206 @@
+import json
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import nonebot
+from nonebot.log import logger
+from nonebot.matcher import current_bot, current_event
+
+from .config import c
+from .pattern import PatternTrie
+
+BUFFER_SIZE = 65536
+"""
+检查未通过记录的缓冲区容量。写入跟不上时丢弃最旧的记录，并在写入时报告丢弃的数量。修改记录不受此限制。
+"""
+
+enabled: bool = c.flexperm_audit
+"""
+是否记录修改。
+"""
+
+watching: bool = c.flexperm_audit and bool(c.flexperm_audit_perms)
+"""
+是否记录检查未通过的情况。为 False 时检查权限不做任何额外的事。
+"""
+
+denials: Deque[Tuple[Any, ...]] = deque(maxlen=BUFFER_SIZE)
+"""
+尚未写入的检查未通过记录，只包含 flexperm_audit_perms 中的权限。检查权限时只追加一个元组，格式化在后台写入时进行。
+deque 的追加和弹出是原子操作，无需加锁。
+"""
+
+edits: Deque[Tuple[Any, ...]] = deque()
+"""
+尚未写入的修改记录。不限容量，不会因检查未通过的记录过多而被挤掉。
+"""
+
+dropped: int = 0
+"""
+上次写入以来因缓冲区已满而丢弃的检查未通过记录数。
+"""
+
+
+def record_denial(perm: str, bot, event):
+    """
+    记录一次未通过的检查。不在 flexperm_audit_perms 中的权限直接忽略。调用方应先判断 watching 。
+
+    :param perm: 权限。
+    :param bot: 机器人。
+    :param event: 事件。
+    """
+    global dropped
+    if not _filter(perm):
+        return
+    if len(denials) >= BUFFER_SIZE:
+        dropped += 1
+    denials.append(('deny', time.time(), perm, bot, event))
+
+
+def record_edit(namespace: str, record: List[Any]):
+    """
+    记录一次修改，同时记下正在处理的事件作为修改者。调用方应先判断 enabled 。
+
+    :param namespace: 名称空间。
+    :param record: 修改记录，格式同修改日志。
+    """
+    edits.append(('edit', time.time(), namespace, list(record), current_bot.get(None), current_event.get(None)))
+
+
+def _audit_path() -> Path:
+    return c.flexperm_audit_path or c.flexperm_base / 'audit.jsonl'
+
+
+def _subject(bot, event) -> Tuple[Optional[str], Optional[str]]:
+    """
+    :return: (适配器名:用户ID, 会话ID) ，无法获取时为 None 。
+    """
+    if bot is None or event is None:
+        return None, None
+    adapter = bot.adapter.get_name().split(maxsplit=1)[0].lower()
+    try:
+        user = f'{adapter}:{event.get_user_id()}'
+    except Exception as e:
+        _ = e
+        user = None
+    try:
+        session = event.get_session_id()
+    except Exception as e:
+        _ = e
+        session = None
+    return user, session
+
+
+class _Filter:
+    """
+    按 flexperm_audit_perms 筛选权限，写法同权限描述（不含"-"前缀），结果按权限缓存。
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.items = set(patterns)
+        self.trie = PatternTrie.compile(self.items)
+        self.cache: Dict[str, bool] = {}
+
+    def __call__(self, perm: str) -> bool:
+        from .core import check_wildcard
+
+        result = self.cache.get(perm)
+        if result is None:
+            if len(self.cache) > 4096:
+                self.cache.clear()
+            result = self.cache[perm] = check_wildcard(perm, self.items, self.trie)
+        return result
+
+
+_filter = _Filter(c.flexperm_audit_perms)
+
+
+def _format(entry: Tuple[Any, ...]) -> dict:
+    kind, stamp = entry[:2]
+    result = {'time': datetime.fromtimestamp(stamp).isoformat(timespec='milliseconds'), 'type': kind}
+    if kind == 'deny':
+        _, _, perm, bot, event = entry
+        result['perm'] = perm
+        result['user'], result['session'] = _subject(bot, event)
+    else:
+        _, _, namespace, record, bot, event = entry
+        result['namespace'] = namespace
+        result['op'], result['group'], *result['args'] = record
+        result['actor'], result['session'] = _subject(bot, event)
+    return result
+
+
+def flush() -> int:
+    """
+    把缓冲区中的记录写入审计日志，文件超过大小上限时轮换。由后台定时任务调用，也可以手动调用。
+
+    :return: 写入的记录数。
+    """
+    global dropped
+    if dropped:
+        count, dropped = dropped, 0
+        logger.warning('Audit buffer full, dropped {} denial records', count)
+    batch = []
+    for queue in (edits, denials):
+        while True:
+            try:
+                batch.append(queue.popleft())
+            except IndexError:
+                break
+    if not batch:
+        return 0
+    # 两个缓冲区各自有序，合并后按时间排列
+    batch.sort(key=lambda x: x[1])
+    lines = []
+    for entry in batch:
+        try:
+            lines.append(json.dumps(_format(entry), ensure_ascii=False, default=str) + '\n')
+        except Exception as e:
+            _ = e
+            logger.exception('Failed to format audit record')
+    if not lines:
+        return 0
+    path = _audit_path()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _rotate(path)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+    except OSError:
+        logger.exception('Failed to write audit log')
+        return 0
+    return len(lines)
+
+
+def _rotate(path: Path):
+    if c.flexperm_audit_max_size <= 0 or not path.is_file() or path.stat().st_size < c.flexperm_audit_max_size:
+        return
+    backups = max(c.flexperm_audit_backups, 0)
+    for i in range(backups, 0, -1):
+        source = path.with_name(f'{path.name}.{i - 1}') if i > 1 else path
+        if source.is_file():
+            source.replace(path.with_name(f'{path.name}.{i}'))
+    if path.is_file():
+        path.unlink()
+
+
+driver = nonebot.get_driver()
+
+
+@driver.on_startup
+def _():
+    if not enabled:
+        return
+    from .core import scheduler
+    # 同步任务由 apscheduler 在线程池中执行，不占用事件循环
+    scheduler.add_job(flush, 'interval', seconds=c.flexperm_audit_interval, coalesce=True, max_instances=1,
+                      id='flexperm.audit', replace_existing=True)
+
+
+@driver.on_shutdown
+def _():
+    if enabled:
+        flush()
@@ -0,0 +1,223 @@
+import json
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Union
+
+from nonebot.log import logger
+from nonebot.utils import run_sync
+
+from . import core
+from .config import c
+
+
+class Change(NamedTuple):
+    """
+    一条修改通知。
+    """
+
+    origin: str
+    """
+    发出通知的实例。
+    """
+
+    namespace: Optional[str]
+    """
+    被修改的名称空间，为 None 表示所有权限配置都已重新加载。
+    """
+
+    group: Optional[Union[str, int]]
+    """
+    被修改的权限组，为 None 表示整个名称空间。
+    """
+
+
+class Bus(ABC):
+    """
+    在共享同一份权限配置的多个实例之间传递修改通知。
+
+    通知只在修改已写入硬盘（修改日志或配置文件）之后发出，收到通知的实例从硬盘重新读取受影响的权限组。
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        """
+        本实例的标识，用于忽略自己发出的通知。
+        """
+
+    @abstractmethod
+    def publish(self, changes: Iterable[Change]):
+        """
+        发出通知。
+
+        :param changes: 修改通知。
+        """
+
+    @abstractmethod
+    def poll(self) -> List[Change]:
+        """
+        :return: 上次调用之后其他实例发出的通知，按发出顺序排列。
+        """
+
+    def close(self):
+        """
+        释放资源。
+        """
+
+
+class SqliteBus(Bus):
+    """
+    基于 SQLite 数据库文件的实现，适用于同一台机器上的多个实例。
+    """
+
+    retention = 3600
+    """
+    通知保留的时长（秒）。
+    """
+
+    def __init__(self, path: Path):
+        super().__init__()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False, timeout=5)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS changes ('
+                          'id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL, origin TEXT, namespace TEXT, grp TEXT)')
+        # 只关心启动之后的通知
+        self.last_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM changes').fetchone()[0]
+
+    def publish(self, changes: Iterable[Change]):
+        now = time.time()
+        rows = [(now, x.origin, x.namespace, json.dumps(x.group)) for x in changes]
+        with self.conn:
+            self.conn.executemany('INSERT INTO changes (time, origin, namespace, grp) VALUES (?, ?, ?, ?)', rows)
+            self.conn.execute('DELETE FROM changes WHERE time < ?', (now - self.retention,))
+
+    def poll(self) -> List[Change]:
+        rows = self.conn.execute('SELECT id, origin, namespace, grp FROM changes WHERE id > ? ORDER BY id',
+                                 (self.last_id,)).fetchall()
+        if rows:
+            self.last_id = rows[-1][0]
+        return [Change(origin, namespace, json.loads(grp)) for _, origin, namespace, grp in rows
+                if origin != self.origin]
+
+    def close(self):
+        self.conn.close()
+
+
+bus: Optional[Bus] = None
+"""
+当前使用的通知渠道，未启用时为 None 。
+"""
+
+
+def set_bus(new: Optional[Bus]):
+    """
+    更换通知渠道。可以传入自定义的 Bus 实现。
+
+    :param new: 通知渠道，为 None 则停用。
+    """
+    global bus
+    if bus is not None:
+        bus.close()
+    bus = new
+
+
+def notify(namespace: Optional[str], groups: Iterable[Union[str, int, None]]):
+    """
+    发出修改通知。未启用通知渠道时不做任何事。
+
+    :param namespace: 名称空间，为 None 表示所有权限配置都已重新加载。
+    :param groups: 被修改的权限组，None 表示整个名称空间。
+    """
+    if bus is None:
+        return
+    try:
+        bus.publish(Change(bus.origin, namespace, group) for group in groups)
+    except Exception as e:
+        _ = e
+        logger.exception('Failed to publish permission changes')
+
+
+def apply_changes():
+    """
+    应用其他实例发出的通知，只重新读取受影响的权限组。会在当前线程中读取配置文件，定时任务使用的是不阻塞事件循环的版本。
+    """
+    affected = _affected(_poll_changes())
+    if affected is None:
+        _reload()
+        return
+    for namespace, names in affected.items():
+        ns = core.registry.loaded.get(namespace)
+        if ns is not None:
+            ns.refresh(names)
+
+
+def _poll_changes() -> List[Change]:
+    if bus is None:
+        return []
+    try:
+        return bus.poll()
+    except Exception as e:
+        _ = e
+        logger.exception('Failed to poll permission changes')
+        return []
+
+
+def _affected(changes: List[Change]) -> Optional[Dict[str, Optional[Set[Union[str, int]]]]]:
+    """
+    :return: 各名称空间中受影响的组名，整个名称空间受影响时为 None ；需要重新加载所有权限配置时返回 None 。
+    """
+    if any(x.namespace is None for x in changes):
+        return None
+    affected: Dict[str, Optional[Set[Union[str, int]]]] = {}
+    for x in changes:
+        if x.group is None:
+            affected[x.namespace] = None
+        elif affected.get(x.namespace, ()) is not None:
+            affected.setdefault(x.namespace, set()).add(x.group)
+    if changes:
+        logger.debug('Applying {} permission changes from other instances', len(changes))
+    return affected
+
+
+def _reload() -> bool:
+    if not core.reload():
+        logger.warning('Another instance reloaded permissions, but there are unsaved changes here')
+        return False
+    return True
+
+
+READ_ATTEMPTS = 3
+"""
+在线程中读取配置后，若读取期间本实例又修改了该名称空间，重新读取的次数。仍不成功则在事件循环中直接读取。
+"""
+
+
+async def _poll():
+    # 查询通知和读取配置文件都在线程中进行，只有应用读取结果在事件循环中进行
+    affected = _affected(await run_sync(_poll_changes)())
+    if affected is None:
+        await run_sync(_reload)()
+        return
+    for namespace, names in affected.items():
+        ns = core.registry.loaded.get(namespace)
+        if ns is None or not ns.path:
+            continue
+        for _ in range(READ_ATTEMPTS):
+            if ns.apply_fresh(await run_sync(ns.read_fresh)(names)):
+                break
+        else:
+            ns.refresh(names)
+
+
+def start():
+    """
+    启动时由 core 调用，按配置创建通知渠道，并定期检查通知。
+    """
+    if c.flexperm_bus == 'sqlite' and c.flexperm_snapshot != 'reader':
+        set_bus(SqliteBus(c.flexperm_bus_path or c.flexperm_base / '.bus.sqlite'))
+    if bus is not None:
+        core.scheduler.add_job(_poll, 'interval', seconds=c.flexperm_bus_interval, coalesce=True,
+                               id='flexperm.bus', replace_existing=True)
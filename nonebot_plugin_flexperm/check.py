@@ -1,81 +1,189 @@
+import contextlib
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Iterable, Tuple, Optional, Union
 
 from nonebot import logger
 from nonebot.adapters import Bot, Event
 
+from . import audit, expiry, overlay, profiling, warmup
 from .adapters import handler_for
 from .config import c
-from .core import get, CheckResult, PermissionGroup
+from .core import get, get_namespace, get_subject, CheckResult, PermissionGroup, GroupState
+from .explain import Explanation, explain_chain
 from .util import try_int
 
 
+# 以 (权限组链的签名, 权限) 为键的检查结果缓存。签名是链上各权限组的当前版本，任一组或其继承的组被修改都会改变签名。
+chain_cache: "OrderedDict[Tuple[Tuple[Optional[GroupState], ...], str], bool]" = OrderedDict()
+
+
 def check(bot: Bot, event: Event, perm: str) -> bool:
+    if expiry.next_deadline <= time.time():
+        expiry.expire_due()
+    if not profiling.hooks:
+        chain = tuple(iterate_groups(bot, event))
+        if c.flexperm_warmup_recent:
+            warmup.touch(chain)
+        result = _check_cached(chain, perm)[0]
+        if c.flexperm_usage:
+            from . import usage
+            usage.record(chain, perm)
+    else:
+        start = time.perf_counter()
+        chain = tuple(iterate_groups(bot, event))
+        if c.flexperm_warmup_recent:
+            warmup.touch(chain)
+        group_hits = [group.state is not None and perm in group.state.cache for group in chain]
+        result, chain_hit = _check_cached(chain, perm)
+        elapsed = time.perf_counter() - start
+        if c.flexperm_usage:
+            from . import usage
+            usage.record(chain, perm)
+        for hook in profiling.hooks:
+            hook.on_check(elapsed, perm, chain, chain_hit, group_hits, result)
     if c.flexperm_debug_check:
-        logger.debug('Checking {}', perm)
-    for group in iterate_groups(bot, event):
+        # 检查过程只用于日志，结果仍以缓存为准
+        logger.debug('Checked {}', explain_chain(chain, perm))
+
+    if not result and audit.watching:
+        audit.record_denial(perm, bot, event)
+    return result
+
+
+def _check_cached(chain: Tuple[PermissionGroup, ...], perm: str) -> Tuple[bool, bool]:
+    """
+    :return:
+        [0] 检查结果。 <br>
+        [1] 是否命中了检查结果缓存。
+    """
+    key = tuple(group.state for group in chain), perm
+    try:
+        result = chain_cache[key]
+    except KeyError:
+        pass
+    else:
+        with contextlib.suppress(KeyError):
+            chain_cache.move_to_end(key)
+        if c.flexperm_shadow_rate:
+            from . import shadow
+            shadow.sample(chain, perm, result)
+        return result, True
+
+    result = check_chain(chain, perm)
+    if c.flexperm_chain_cache_size > 0:
+        if len(chain_cache) >= c.flexperm_chain_cache_size:
+            with contextlib.suppress(KeyError):
+                chain_cache.popitem(last=False)
+        chain_cache[key] = result
+    if c.flexperm_shadow_rate:
+        from . import shadow
+        shadow.sample(chain, perm, result)
+    return result, False
+
+
+def explain(bot: Bot, event: Event, perm: str) -> Explanation:
+    """
+    检查事件是否具有指定权限，并记录检查过程。不使用缓存，仅用于诊断。
+
+    :param bot: 机器人。
+    :param event: 事件。
+    :param perm: 权限。
+    :return: 检查过程。
+    """
+    if expiry.next_deadline <= time.time():
+        expiry.expire_due()
+    return explain_chain(iterate_groups(bot, event), perm)
+
+
+def check_chain(chain: Iterable[PermissionGroup], perm: str) -> bool:
+    """
+    依次检查权限组链，以第一个有结果的为准。
+
+    :param chain: 权限组链。
+    :param perm: 权限。
+    :return: 检查结果。
+    """
+    for group in chain:
         r = group.check(perm)
-        if c.flexperm_debug_check:
-            logger.debug('Got {} from {}', r, group)
         if r is not None:
             return r == CheckResult.ALLOW
-
     return False
 
 
+@lru_cache(maxsize=None)
+def adapter_key(adapter_name: str) -> str:
+    """
+    :param adapter_name: 适配器的完整名称，如"OneBot V11"。
+    :return: 组名中使用的适配器名，如"onebot"。
+    """
+    return adapter_name.split(maxsplit=1)[0].lower()
+
+
 def get_permission_group_by_event(bot: Bot, event: Event) -> Optional[Tuple[str, Union[str, int]]]:
     h = handler_for(bot.adapter.get_name())
-    adapter = bot.adapter.get_name().split(maxsplit=1)[0].lower()
-    is_default_adapter = (adapter == c.flexperm_default_adapter.lower())
+    adapter = adapter_key(bot.adapter.get_name())
 
     if (group_id := h.get_group_id(event)) is not None:
-        gn = group_id if is_default_adapter else f'{adapter}:{group_id}'
-        return 'group', gn
+        return 'group', _subject_name('group', adapter, str(group_id))
     if h.is_private_chat(event):
-        uid = event.get_user_id()
-        un = try_int(uid) if is_default_adapter else f'{adapter}:{uid}'
-        return 'user', un
+        return 'user', _subject_name('user', adapter, event.get_user_id())
+
+
+def _subject_name(namespace: str, adapter: str, native_id: str) -> Union[str, int]:
+    key = get_namespace(namespace, False).subject_key(adapter, native_id)
+    if key is not None:
+        return key
+    if adapter == c.flexperm_default_adapter.lower():
+        return try_int(native_id)
+    return f'{adapter}:{native_id}'
 
 
 def iterate_groups(bot: Bot, event: Event) -> Iterable[PermissionGroup]:
+    overlays = overlay.overlays
+    for key, group in _iterate_groups(bot, event):
+        # 覆盖层排在对应权限组之前
+        if overlays and (layer := overlays.get(key)) is not None:
+            yield layer
+        yield group
+
+
+def _iterate_groups(bot: Bot, event: Event) -> Iterable[Tuple[overlay.OverlayKey, PermissionGroup]]:
     h = handler_for(bot.adapter.get_name())
-    adapter = bot.adapter.get_name().split(maxsplit=1)[0].lower()
-    is_default_adapter = (adapter == c.flexperm_default_adapter.lower())
+    adapter = adapter_key(bot.adapter.get_name())
 
     # 特定用户
     user_id = event.get_user_id()
-    group = get('user', try_int(user_id)) if is_default_adapter else None
-    if not (is_default_adapter and group.is_valid):
-        group = get('user', f'{adapter}:{user_id}')
-    yield group
+    group = get_subject('user', adapter, user_id)
+    yield ('user', (adapter, user_id)), group
 
     # Bot超级用户
     if is_superuser(bot, event):
-        yield get('global', 'superuser')
+        yield ('global', 'superuser'), get('global', 'superuser')
 
     # 所有用户
-    yield get('global', 'anyone')
+    yield ('global', 'anyone'), get('global', 'anyone')
 
     # 群组
     if (group_id := h.get_group_id(event)) is not None:
         # 用户在群组内的身份
         role = h.get_group_role(event)
         if role == 'admin':
-            yield get('global', 'group_admin')
+            yield ('global', 'group_admin'), get('global', 'group_admin')
         elif role == 'owner':
-            yield get('global', 'group_owner')
+            yield ('global', 'group_owner'), get('global', 'group_owner')
 
         # 特定群组
-        group = get('group', try_int(group_id)) if is_default_adapter else None
-        if not (is_default_adapter and group.is_valid):
-            group = get('group', f'{adapter}:{group_id}')
-        yield group
+        group = get_subject('group', adapter, group_id)
+        yield ('group', (adapter, str(group_id))), group
 
         # 所有群组
-        yield get('global', 'group')
+        yield ('global', 'group'), get('global', 'group')
 
     # 私聊
     if h.is_private_chat(event):
-        yield get('global', 'private')
+        yield ('global', 'private'), get('global', 'private')
 
 
 def is_superuser(bot: Bot, event: Event):
@@ -84,6 +192,6 @@ def is_superuser(bot: Bot, event: Event):
     except Exception:
         return False
     return (
-        f"{bot.adapter.get_name().split(maxsplit=1)[0].lower()}:{user_id}" in bot.config.superusers
+        f"{adapter_key(bot.adapter.get_name())}:{user_id}" in bot.config.superusers
         or user_id in bot.config.superusers
     )
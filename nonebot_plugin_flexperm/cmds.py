@@ -2,7 +2,9 @@ from nonebot import CommandGroup
 from nonebot.adapters import Bot, Event, Message
 from nonebot.params import CommandArg, RawCommand
 from nonebot.typing import T_State
-from . import core
+from nonebot.utils import run_sync
+from . import core, profiling, warmup
+from .config import c
 from .plugin import register
 
 P = register('flexperm')
@@ -19,6 +21,9 @@ async def _(bot: Bot, event: Event, arg: Message = CommandArg()):
     force = str(arg).strip() == 'force'
     reloaded = core.reload(force)
     if reloaded:
+        from .bus import notify
+        notify(None, [None])
+        warmup.start()
         await bot.send(event, '重新加载权限配置')
     else:
         await bot.send(event, '有未保存的修改，如放弃修改请添加force参数')
@@ -33,6 +38,82 @@ async def _(bot: Bot, event: Event):
         await bot.send(event, '部分配置保存失败，请检查控制台输出')
 
 
+@h(cg.command('explain', permission=P('explain')))
+async def _(bot: Bot, event: Event, raw_command: str = RawCommand(), arg: Message = CommandArg()):
+    perm = str(arg).strip()
+    if not perm or any(x.isspace() for x in perm):
+        return await bot.send(event, f'用法：{raw_command} 权限名')
+    await bot.send(event, str(P.explain('/' + perm)))
+
+
+@h(cg.command('slow', permission=P('slow')))
+async def _(bot: Bot, event: Event, arg: Message = CommandArg()):
+    clear = str(arg).strip() == 'clear'
+    samples = profiling.sampler.dump(clear)
+    if profiling.sampler not in profiling.hooks:
+        await bot.send(event, '未启用慢操作记录')
+    elif not samples:
+        await bot.send(event, '没有慢操作记录')
+    else:
+        await bot.send(event, '\n'.join(str(x) for x in samples[-20:]))
+
+
+@h(cg.command('usage', permission=P('usage')))
+async def _(bot: Bot, event: Event, arg: Message = CommandArg()):
+    if not c.flexperm_usage:
+        return await bot.send(event, '未启用使用情况统计')
+    from . import usage
+    report = await run_sync(usage.report)()
+    if str(arg).strip() != 'prune':
+        return await bot.send(event, str(report))
+    count = await run_sync(usage.prune)(report)
+    await bot.send(event, f'已清理 {count} 项')
+
+
+@h(cg.command('compact', permission=P('compact')))
+async def _(bot: Bot, event: Event):
+    from .compaction import compact
+    await bot.send(event, str(await run_sync(compact)()))
+
+
+@h(cg.command('list', permission=P('list')))
+async def _(bot: Bot, event: Event, raw_command: str = RawCommand(), arg: Message = CommandArg()):
+    args = str(arg).split()
+    namespace, page = 'global', '1'
+    # 只有页码
+    if len(args) == 1 and args[0].isdigit():
+        page = args[0]
+    elif len(args) == 1:
+        namespace = args[0]
+    elif len(args) == 2:
+        namespace, page = args
+
+    if len(args) > 2 or not page.isdigit() or int(page) < 1:
+        return await bot.send(event, f'用法：{raw_command} [名称空间] [页码]')
+    await bot.send(event, str(P.list_groups(namespace, int(page))))
+
+
+@h(cg.command('show', permission=P('show')))
+async def _(bot: Bot, event: Event, raw_command: str = RawCommand(), arg: Message = CommandArg()):
+    arg = str(arg).strip()
+
+    # 无参数，查看当前会话权限组
+    if not arg:
+        designator = event
+    # 一个参数，查看指定权限组
+    elif not any(x.isspace() for x in arg):
+        designator = arg
+    # 参数数量错误
+    else:
+        return await bot.send(event, f'用法：{raw_command} [[名称空间:]权限组名]')
+
+    info = P.show_group(designator)
+    if info is None:
+        await bot.send(event, '权限组不存在')
+    else:
+        await bot.send(event, str(info))
+
+
 @h(cg.command('add', permission=P('edit.perm'), state={'add': True}))
 @h(cg.command('remove', permission=P('edit.perm'), state={'add': False}))
 async def _(bot: Bot, event: Event, state: T_State,
@@ -0,0 +1,426 @@
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+from nonebot.log import logger
+
+from . import core
+from .config import c
+from .core import get_yaml, scheduler, GroupDesc, Namespace, Registry, parse_group_desc, \
+    parse_group_descs, parse_qualified_group_name, parse_subject_name
+from .journal import Record
+from .pattern import is_extended_pattern
+from .usage import covers, desc_rules, find_shadowed, modifiable_namespaces
+from .util import try_int
+
+GroupKey = Tuple[str, Union[str, int]]
+Rule = Tuple[bool, str]
+
+
+class CompactionReport(NamedTuple):
+    """
+    一次整理的结果。
+    """
+
+    empty_groups: int
+    """
+    移除的空权限组数。
+    """
+
+    duplicates: int
+    """
+    整理了重复项或空列表的权限组数。
+    """
+
+    shadowed_rules: int
+    """
+    移除的被覆盖的权限描述数。
+    """
+
+    redundant_inherits: int
+    """
+    移除的多余继承关系数。
+    """
+
+    size: Tuple[int, int]
+    """
+    有修改的名称空间的配置文件在整理前后的总大小（字节）。
+    """
+
+    load_time: Optional[Tuple[float, float]] = None
+    """
+    有修改的名称空间的配置文件在整理前后的读取和校验耗时（秒）。未设置 flexperm_compact_measure 时为 None 。
+    """
+
+    def __str__(self):
+        if not any(self[:4]):
+            return '没有需要整理的内容'
+        size0, size1 = self.size
+        footprint = f'配置文件 {size0} -> {size1} 字节'
+        if self.load_time is not None:
+            time0, time1 = self.load_time
+            footprint += f'，读取耗时 {time0 * 1000:.1f} -> {time1 * 1000:.1f} ms'
+        return '\n'.join([
+            f'移除空权限组 {self.empty_groups} 个',
+            f'整理重复项 {self.duplicates} 组',
+            f'移除被覆盖的权限描述 {self.shadowed_rules} 项',
+            f'移除多余的继承关系 {self.redundant_inherits} 项',
+            footprint,
+        ])
+
+
+def compact() -> CompactionReport:
+    """
+    整理所有可修改的名称空间并保存。只做不改变任何检查结果的修改：
+
+    - 移除 user 和 group 名称空间中没有内容、也没有被继承的权限组。
+    - 去掉重复的权限描述和继承关系。
+    - 移除被同组中另一项长期有效的描述完全覆盖的权限描述。
+    - 移除可以经由另一个继承的组间接得到、且途中不会被其他描述改变结果的继承关系。
+
+    直接分析配置，不构建权限组，只在修改时持有名称空间的配置锁，因此可以在线程中运行。
+
+    :return: 整理结果。
+    """
+    namespaces = modifiable_namespaces()
+    for ns in namespaces:
+        # 先应用其他实例追加到共享修改日志中的修改，否则整理结果可能覆盖它们
+        ns.sync()
+    registry = core.registry
+    revisions = _revisions(registry)
+    graph = _Graph(registry, time.time())
+    referenced = _referenced(registry)
+    counts = [0, 0, 0, 0]
+    changed = []
+    for ns in namespaces:
+        plan = _plan(ns, graph, referenced)
+        if not plan:
+            continue
+        applied = 0
+        with ns.lock:
+            if _revisions(registry) != revisions:
+                # 分析期间配置被修改过，按当前的配置重新分析
+                graph = _Graph(registry, time.time())
+                referenced = _referenced(registry)
+                plan = _plan(ns, graph, referenced)
+            for kind, record in plan:
+                if _apply(ns, record):
+                    counts[kind] += 1
+                    applied += 1
+            revisions = _revisions(registry)
+        if applied:
+            # 保存前硬盘上还是整理前的内容
+            before = _footprint(ns.path)
+            ns.save()
+            changed.append((before, _footprint(ns.path)))
+
+    load_time = None
+    if c.flexperm_compact_measure:
+        load_time = sum(b[1] for b, _ in changed), sum(a[1] for _, a in changed)
+    report = CompactionReport(*counts, (sum(b[0] for b, _ in changed), sum(a[0] for _, a in changed)), load_time)
+    if changed:
+        logger.info('Compacted permissions: {}', str(report).replace('\n', '; '))
+    return report
+
+
+def _revisions(registry: Registry) -> Tuple[Tuple[str, int], ...]:
+    return tuple((name, ns.revision) for name, ns in list(registry.loaded.items()))
+
+
+def _plan(ns: Namespace, graph: "_Graph", referenced: Set[GroupKey]) -> List[Tuple[int, Record]]:
+    """
+    :return: 需要应用的修改记录及其在 CompactionReport 中的类别。
+    """
+    plan = []
+    # 在线程中运行时，事件循环中的修改可能同时增删配置中的组
+    with ns.lock:
+        items = list(ns.config.items())
+    for name, obj in items:
+        if _duplicated(obj):
+            plan.append((1, ['compact', name]))
+        try:
+            desc = parse_group_desc(obj)
+        except ValueError:
+            continue
+        key = ns.name, name
+        allows, denies, timed = desc_rules(ns, desc, graph.now)
+        for item, by in find_shadowed(allows, denies):
+            if by not in timed:
+                graph.drop_rule(key, item)
+                plan.append((2, ['remove', name, item]))
+        if not graph.tangled(key):
+            while (decl := _redundant_inherit(graph, key)) is not None:
+                graph.drop_inherit(key, decl)
+                plan.append((3, ['remove_inherit', name, [decl]]))
+    if ns.name in ('user', 'group'):
+        spellings = Counter(_subject_of(name) for name, _ in items)
+        for name, obj in items:
+            # 同一用户或群组有多种写法时，空组可能遮蔽着另一种写法，移除后会改变查找结果
+            if (ns.name, name) not in referenced and not _has_content(obj) and spellings[_subject_of(name)] == 1:
+                plan.append((0, ['remove_group', name]))
+    return plan
+
+
+def _apply(ns: Namespace, record: Record) -> bool:
+    """
+    应用一条修改记录。已加载的权限组通过其方法修改，同时更新其版本；未加载的只需修改配置。
+
+    :return: 是否成功。
+    """
+    op, name = record[:2]
+    group = ns.groups.get(name)
+    try:
+        if op == 'remove_group':
+            ns.remove_group(name, False)
+        elif group is not None and group.is_valid and op == 'remove':
+            group.remove(record[2])
+        elif group is not None and group.is_valid and op == 'remove_inherit':
+            group.remove_inheritance(ns.registry.get(*parse_qualified_group_name(record[2][0], ns.name)))
+        else:
+            with ns.modifying(record):
+                pass
+    except (KeyError, ValueError):
+        return False
+    return True
+
+
+def _subject_of(name: Union[str, int]) -> Any:
+    """
+    :return: 组名对应的用户或群组，同一用户或群组的不同写法（如 123 、 "onebot:123" 和 "onebot:0123"）结果相同。
+    """
+    subject = parse_subject_name(name)
+    if subject is None:
+        return name
+    adapter, native_id = subject
+    if adapter == c.flexperm_default_adapter.lower():
+        return adapter, try_int(native_id)
+    return subject
+
+
+def _has_content(desc) -> bool:
+    return not isinstance(desc, dict) or any(desc.values())
+
+
+def _referenced(registry: Registry) -> Set[GroupKey]:
+    # 被任一权限组继承的组，移除后会使继承者加载时报错，即使它是空的
+    result = set()
+    for ns in list(registry.loaded.values()):
+        with ns.lock:
+            descs = list(ns.config.values())
+        for desc in descs:
+            inherits = desc.get('inherits') if isinstance(desc, dict) else None
+            if isinstance(inherits, list):
+                result.update(parse_qualified_group_name(x, ns.name) for x in inherits if isinstance(x, str))
+    return result
+
+
+def _duplicated(desc) -> bool:
+    """
+    :return: 描述中是否有重复项，或在另一项非空时有空列表。
+    """
+    if not isinstance(desc, dict):
+        return False
+    lists = [desc.get(k) for k in ('permissions', 'inherits') if k in desc]
+    lists = [x for x in lists if isinstance(x, list)]
+    duplicated = any(len(set(x)) != len(x) for x in lists)
+    empty = any(not x for x in lists) and any(lists)
+    return duplicated or empty
+
+
+def _rules(allows: Set[str], denies: Set[str]) -> List[Rule]:
+    return [(True, x) for x in allows] + [(False, x) for x in denies]
+
+
+class _Node(NamedTuple):
+    rules: List[Rule]
+    """
+    自身及合并进来的插件预设中生效的描述，元素为 (是否授予, 描述) 。
+    """
+
+    parents: List[GroupKey]
+    """
+    继承的组，包括声明的继承关系和自动继承的、自身有继承关系的插件预设组。
+    """
+
+    declared: List[Tuple[str, GroupKey]]
+    """
+    配置中声明的继承关系，元素为 (声明, 被继承的组) 。
+    """
+
+
+class _Graph:
+    """
+    直接从各名称空间的配置读出的继承关系，整理时用于分析，不构建也不保留权限组。
+    """
+
+    def __init__(self, registry: Registry, now: float):
+        self.registry = registry
+        self.now = now
+        self._nodes: Dict[GroupKey, Optional[_Node]] = {}
+        self._tangled: Dict[GroupKey, bool] = {}
+
+    def node(self, key: GroupKey) -> Optional[_Node]:
+        """
+        :return: 权限组，不存在或描述不合法（加载为空组）时返回 None 。
+        """
+        try:
+            return self._nodes[key]
+        except KeyError:
+            pass
+        namespace, name = key
+        node = None
+        desc = self._parse(namespace, name)
+        if desc is not None:
+            rules = _rules(*desc_rules(self.registry.get_namespace(namespace, False), desc, self.now)[:2])
+            declared = [(x, parse_qualified_group_name(x, namespace)) for x in desc.inherits]
+            parents = [k for _, k in declared]
+            if namespace == 'global' and name in self.registry.default_groups:
+                # 与 PermissionGroup.populate 相同，没有继承关系的插件预设合并进来，其余的照常继承
+                for pn in self.registry.plugin_namespaces:
+                    preset = self._parse(pn.name, name)
+                    if preset is None:
+                        continue
+                    if preset.inherits:
+                        parents.append((pn.name, name))
+                    else:
+                        rules.extend(_rules(*desc_rules(pn, preset, self.now)[:2]))
+            node = _Node(rules, parents, declared)
+        self._nodes[key] = node
+        return node
+
+    def _parse(self, namespace: str, name: Union[str, int]) -> Optional[GroupDesc]:
+        obj = self.registry.get_namespace(namespace, False).config.get(name)
+        if obj is None:
+            return None
+        try:
+            return parse_group_desc(obj)
+        except ValueError:
+            return None
+
+    def tangled(self, key: GroupKey) -> bool:
+        """
+        :return: 从该组出发是否会走到继承环。加载时环上被忽略的是哪条继承关系取决于加载顺序，因此不分析这样的组。
+        """
+        result = self._tangled.get(key)
+        if result is not None:
+            return result
+        # 搜索过程中再次遇到即为成环
+        self._tangled[key] = True
+        node = self.node(key)
+        result = node is not None and any(self.tangled(k) for k in node.parents)
+        self._tangled[key] = result
+        return result
+
+    def closure(self, key: GroupKey) -> List[_Node]:
+        """
+        :return: 该组及其直接或间接继承的所有组。
+        """
+        result = []
+        seen = set()
+        pending = [key]
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            node = self.node(current)
+            if node is not None:
+                result.append(node)
+                pending.extend(node.parents)
+        return result
+
+    def drop_rule(self, key: GroupKey, item: str):
+        """
+        记下已计划移除的权限描述，使之后的分析基于移除后的配置。
+        """
+        node = self.node(key)
+        rules = list(node.rules)
+        rules.remove((not item.startswith('-'), item.lstrip('-')))
+        self._nodes[key] = node._replace(rules=rules)
+
+    def drop_inherit(self, key: GroupKey, decl: str):
+        """
+        记下已计划移除的继承关系，使之后的分析基于移除后的配置。
+        """
+        node = self._nodes[key]
+        i = [d for d, _ in node.declared].index(decl)
+        target = node.declared[i][1]
+        parents = list(node.parents)
+        parents.remove(target)
+        self._nodes[key] = node._replace(parents=parents, declared=node.declared[:i] + node.declared[i + 1:])
+
+
+def _overlap(a: str, b: str) -> bool:
+    if is_extended_pattern(a) or is_extended_pattern(b):
+        return True
+    return covers(a, b) or covers(b, a)
+
+
+def _consistent(own: List[Rule], rules: List[Rule]) -> bool:
+    """
+    :return: own 中的描述是否不会与 rules 中的任何描述给出相反的结果。
+    """
+    return all(allow == other_allow or not _overlap(item, other)
+               for allow, item in own for other_allow, other in rules)
+
+
+def _redundant_inherit(graph: _Graph, key: GroupKey) -> Optional[str]:
+    """
+    找出一个可以移除的继承关系。
+
+    若 B 能经由该组继承的另一个组 A 间接继承到，且这条路径上（不含 B ）每个组自身的描述都不与 B 及其祖先的描述冲突，
+    则对任何权限，A 的结果要么与 B 相同，要么是 B 未给出结果时 A 自己的结果，要么是撤销；三种情况下直接继承 B 都不改变结果。
+
+    :return: 可以移除的继承关系的声明。
+    """
+    node = graph.node(key)
+    if node is None:
+        return None
+    parents = [x for x in node.parents if graph.node(x) is not None]
+    for decl, target in node.declared:
+        if graph.node(target) is None or parents.count(target) > 1:
+            continue
+        rules = [rule for n in graph.closure(target) for rule in n.rules]
+        pending = [x for x in parents if x != target]
+        seen = set()
+        while pending:
+            current = pending.pop()
+            if current in seen or current == key or current == target:
+                continue
+            seen.add(current)
+            current_node = graph.node(current)
+            if not _consistent(current_node.rules, rules):
+                continue
+            if target in current_node.parents:
+                return decl
+            pending.extend(x for x in current_node.parents if graph.node(x) is not None)
+    return None
+
+
+def _footprint(path: Optional[Path]) -> Tuple[int, float]:
+    """
+    :return: 配置文件（分片目录则为其中所有分片）的总大小，及读取并校验一遍的耗时。只在设置了 flexperm_compact_measure 时读取，
+        否则耗时为 0 。
+    """
+    if path is None:
+        return 0, 0
+    files = sorted(path.glob('*.yml')) if path.is_dir() else [path] if path.is_file() else []
+    size = sum(file.stat().st_size for file in files)
+    if not c.flexperm_compact_measure:
+        return size, 0
+    start = time.perf_counter()
+    for file in files:
+        doc = get_yaml().load(file)
+        if isinstance(doc, dict):
+            parse_group_descs(doc.items())
+    return size, time.perf_counter() - start
+
+
+def start():
+    """
+    启动时由 core 调用（仅启用定期整理时），定期整理权限配置。
+    """
+    # 同步的任务由定时器在线程池中运行，不阻塞事件循环
+    scheduler.add_job(compact, 'interval', hours=c.flexperm_compact_interval, coalesce=True,
+                      id='flexperm.compact', replace_existing=True)
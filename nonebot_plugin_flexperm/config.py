@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import List, Optional
 
 import nonebot
 from pydantic import BaseModel
@@ -8,6 +9,33 @@ class Config(BaseModel):
     flexperm_base: Path = Path('permissions')
     flexperm_debug_check: bool = False
     flexperm_default_adapter: str = 'onebot'
+    flexperm_journal: bool = False
+    flexperm_journal_fsync: bool = False
+    flexperm_journal_compact_size: int = 65536
+    flexperm_warmup: bool = False
+    flexperm_warmup_timeout: float = 10
+    flexperm_warmup_recent: int = 0
+    flexperm_snapshot: str = ''
+    flexperm_snapshot_path: Optional[Path] = None
+    flexperm_snapshot_interval: float = 5
+    flexperm_chain_cache_size: int = 4096
+    flexperm_shadow_rate: float = 0
+    flexperm_write_examples: bool = False
+    flexperm_sharded: List[str] = []
+    flexperm_slow_threshold: float = 0
+    flexperm_slow_capacity: int = 100
+    flexperm_bus: str = ''
+    flexperm_bus_path: Optional[Path] = None
+    flexperm_bus_interval: float = 1
+    flexperm_usage: bool = False
+    flexperm_compact_interval: float = 0
+    flexperm_compact_measure: bool = False
+    flexperm_audit: bool = False
+    flexperm_audit_perms: List[str] = []
+    flexperm_audit_path: Optional[Path] = None
+    flexperm_audit_interval: float = 1
+    flexperm_audit_max_size: int = 1048576
+    flexperm_audit_backups: int = 5
 
 
 c = Config(**nonebot.get_driver().config.dict())
@@ -1,28 +1,99 @@
 import contextlib
+import sys
+import threading
+import time
+import weakref
 from collections import OrderedDict
 from contextlib import contextmanager
+from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import TYPE_CHECKING, Optional, Union, Tuple, List, Set, Dict, Iterable
+from typing import TYPE_CHECKING, Any, Optional, Union, Tuple, List, Set, Dict, Iterable, TypeVar, FrozenSet, \
+    Mapping, MutableMapping, NamedTuple
 
 import nonebot
 from nonebot.log import logger
+from nonebot.utils import run_sync
 from pydantic import BaseModel, parse_obj_as
-from ruamel.yaml import YAML, YAMLError, CommentedMap, CommentedSeq
 
+from . import audit, profiling
 from .config import c
+from .expiry import schedule_expiry
+from .pattern import PatternTrie
+from .journal import Journal, Record, apply_record
 from .util import try_int
 
 nonebot.require('nonebot_plugin_apscheduler')
 from nonebot_plugin_apscheduler import scheduler
 
-yaml = YAML()
 nonebot_driver = nonebot.get_driver()
 
-loaded: Dict[str, "Namespace"] = {}
-loaded_by_path: Dict[Path, "Namespace"] = {}
-plugin_namespaces: List["Namespace"] = []
-default_groups: Set[str] = set()
+if TYPE_CHECKING:
+    from ruamel.yaml import YAML
+
+_yaml: Optional["YAML"] = None
+
+
+def get_yaml() -> "YAML":
+    """
+    :return: 读写配置文件用的 YAML 实例。首次调用时才导入 ruamel.yaml ，只用到快照的进程不需要它。
+    """
+    global _yaml
+    if _yaml is None:
+        from ruamel.yaml import YAML
+        _yaml = YAML()
+    return _yaml
+
+
+class Registry:
+    """
+    已加载的名称空间及相关状态。
+
+    重新加载时会构建一个新的实例，完成后整体替换模块级的 registry ，读取方只会看到加载前或加载后的完整状态。
+    """
+
+    def __init__(self):
+        self.loaded: Dict[str, Namespace] = {}
+        self.loaded_by_path: Dict[Path, Namespace] = {}
+        self.plugin_namespaces: List[Namespace] = []
+        self.default_groups: Set[str] = set()
+
+    def get(self, namespace: str, group: Union[str, int], referer: "PermissionGroup" = None,
+            required: bool = False) -> "PermissionGroup":
+        """
+        获取权限组。参见模块级的 get 。
+        """
+        return self.get_namespace(namespace, required).get_group(group, referer, required)
+
+    def get_namespace(self, namespace: str, required: bool, path_override: Path = None) -> "Namespace":
+        ns = self.loaded.get(namespace)
+        if ns is None:
+            if c.flexperm_snapshot == 'reader':
+                # 读取方只使用快照，不读取配置文件
+                ns = Namespace(namespace, None, required=False, modifiable=False)
+                ns.registry = self
+                self.loaded[namespace] = ns
+                return ns
+            sharded = path_override is None and namespace in c.flexperm_sharded
+            if sharded:
+                path = c.flexperm_base / namespace
+            else:
+                path = path_override or c.flexperm_base / f'{namespace}.yml'
+            path = path.resolve()
+            ns = self.loaded_by_path.get(path)
+            if ns is None:
+                if sharded:
+                    from .sharding import ShardedNamespace
+                    ns = ShardedNamespace.open(namespace, path)
+                else:
+                    ns = Namespace(namespace, path, required=required, modifiable=path_override is None)
+                ns.registry = self
+                self.loaded_by_path[path] = ns
+            self.loaded[namespace] = ns
+        return ns
+
+
+registry = Registry()
 
 
 def get(namespace: str, group: Union[str, int], referer: "PermissionGroup" = None, required: bool = False
@@ -36,23 +107,63 @@ def get(namespace: str, group: Union[str, int], referer: "PermissionGroup" = Non
     :param required: 权限组不存在时是否报错。若存在但有其他问题，则无论该参数设置，都会报错。
     :return: 权限组，若失败则返回一个空组。
     """
-    return get_namespace(namespace, required).get_group(group, referer, required)
+    return registry.get(namespace, group, referer, required)
 
 
 def get_namespace(namespace: str, required: bool, path_override: Path = None) -> "Namespace":
-    ns = loaded.get(namespace)
-    if ns is None:
-        path = path_override or c.flexperm_base / f'{namespace}.yml'
-        path = path.resolve()
-        ns = loaded_by_path.get(path)
-        if ns is None:
-            ns = Namespace(namespace, path, required=required, modifiable=path_override is None)
-            loaded_by_path[path] = ns
-        loaded[namespace] = ns
-    return ns
+    return registry.get_namespace(namespace, required, path_override)
+
+
+def get_subject(namespace: str, adapter: str, native_id: Union[str, int]) -> "PermissionGroup":
+    """
+    获取用户或群组对应的权限组。
+
+    :param namespace: 名称空间，"user" 或 "group" 。
+    :param adapter: 适配器名，小写。
+    :param native_id: 适配器中的用户ID或群号。
+    :return: 权限组，若没有配置则返回一个空组。
+    """
+    ns = get_namespace(namespace, False)
+    key = ns.subject_key(adapter, str(native_id))
+    if key is None:
+        return NullPermissionGroup()
+    return ns.get_group(key, None, False)
+
+
+@nonebot_driver.on_startup
+async def _():
+    # 读取配置文件较慢，放到线程中进行，不阻塞事件循环
+    await run_sync(reload)()
 
 
 @nonebot_driver.on_startup
+def _():
+    # 可选功能的模块只在启用时导入，以加快插件导入
+    if c.flexperm_snapshot == 'reader':
+        from . import snapshot
+        snapshot.start()
+    # 也可能在启动前通过 bus.set_bus 设置了自定义的通知渠道
+    if c.flexperm_bus or f'{__package__}.bus' in sys.modules:
+        from . import bus
+        bus.start()
+    if c.flexperm_usage:
+        from . import usage
+        usage.start()
+    if c.flexperm_compact_interval > 0 and c.flexperm_snapshot != 'reader':
+        from . import compaction
+        compaction.start()
+
+
+@nonebot_driver.on_shutdown
+def _():
+    if c.flexperm_usage:
+        from . import usage
+        usage.save()
+    bus = sys.modules.get(f'{__package__}.bus')
+    if bus is not None:
+        bus.set_bus(None)
+
+
 def reload(force: bool = False) -> bool:
     """
     使所有权限组在下一次使用时重新从配置加载。
@@ -60,68 +171,119 @@ def reload(force: bool = False) -> bool:
     :param force: 强制重新加载，忽略未保存的修改。
     :return: 因有未保存的修改而没有重新加载时返回 False ，否则返回 True 。
     """
-    if not force and any(x.dirty for x in loaded.values()):
+    global registry
+    if not force and any(x.has_unsaved_changes for x in registry.loaded.values()):
         return False
 
-    loaded.clear()
-    loaded_by_path.clear()
-    plugin_namespaces.clear()
-    default_groups.clear()
+    new = Registry()
+
+    if c.flexperm_snapshot == 'reader':
+        from .snapshot import restore
+        restore(new)
+        registry = new
+        return True
 
     # 默认权限组
-    global_ = get_namespace('global', False)
+    global_ = new.get_namespace('global', False)
     defaults = Namespace('global', Path(__file__).parent / 'defaults.yml', required=True, modifiable=False)
     for k, v in defaults.config.items():
         global_.config.setdefault(k, v)
-    default_groups.update(defaults.config)
+    new.default_groups.update(defaults.config)
 
     # 加载插件预设
     from .plugin import plugins
     for name, handler in plugins.items():
         if handler.preset_:
-            namespace = get_namespace(name, True, handler.preset_)
+            namespace = new.get_namespace(name, True, handler.preset_)
             namespace.auto_decorate = handler.decorate_
-            plugin_namespaces.append(namespace)
-
-    # 生成全局组默认配置
-    if not global_.path.is_file():
-        global_.dirty = True
-        global_.save()
-    for name in ['group', 'user']:
-        namespace = get_namespace(name, False)
-        if not namespace.path.is_file():
-            namespace.add_group(42, 'Example')
-            namespace.save()
+            new.plugin_namespaces.append(namespace)
+
+    # 生成示例配置文件
+    if c.flexperm_write_examples:
+        if not global_.path.is_file():
+            global_.dirty = True
+            global_.save()
+        for name in ['group', 'user']:
+            namespace = new.get_namespace(name, False)
+            if not namespace.path.is_file():
+                namespace.add_group(42, 'Example')
+                namespace.save()
+
+    registry = new
+
+    if c.flexperm_snapshot == 'writer':
+        from .snapshot import publish
+        publish()
 
     return True
 
 
 @nonebot_driver.on_shutdown
-@scheduler.scheduled_job('interval', minutes=5, coalesce=True, id='flexperm.save')
-def save_all() -> bool:
+def save_all(compact: bool = True) -> bool:
     """
     保存所有权限配置。
 
+    :param compact: 是否把修改日志全部合并进配置文件。为 False 时，日志未超过大小阈值的名称空间不会重写配置文件。
     :return: 是否全部保存成功。
     """
     logger.debug('Saving permissions')
     failed = False
-    for k, v in loaded.items():
+    for k, v in registry.loaded.items():
         try:
-            v.save()
+            v.save(compact)
         except Exception as e:
             _ = e
             failed = True
             logger.exception('Failed to save namespace {}', k)
+    if c.flexperm_snapshot == 'writer':
+        from .snapshot import publish_if_changed
+        try:
+            publish_if_changed()
+        except Exception as e:
+            _ = e
+            failed = True
+            logger.exception('Failed to publish permission snapshot')
     return not failed
 
 
+@scheduler.scheduled_job('interval', minutes=5, coalesce=True, id='flexperm.save')
+def save_periodically():
+    save_all(compact=False)
+
+
+class FreshConfig(NamedTuple):
+    """
+    从硬盘读取的名称空间配置，见 Namespace.read_fresh 。
+    """
+
+    names: Optional[Set[Union[str, int]]]
+    """
+    读取的组名，为 None 表示整个名称空间。
+    """
+
+    config: Dict[Union[str, int], Any]
+    """
+    读取的权限组描述，已删除的组为 None 。
+    """
+
+    signature: Any
+    """
+    读取前配置文件的标识。
+    """
+
+    revision: int
+    """
+    读取前名称空间的版本。
+    """
+
+
 class Namespace:
     """
     权限组名称空间。每个名称空间对应一个配置文件。
     """
 
     auto_decorate: bool = False
+    registry: Optional[Registry] = None
 
     def __init__(self, namespace: str, path: Optional[Path], required: bool, modifiable: bool):
         self.name = namespace
@@ -129,33 +291,124 @@ class Namespace:
         self.groups: Dict[Union[str, int], PermissionGroup] = {}
         self.dirty = False
         self.modifiable = modifiable
+        self.journal: Optional[Journal] = None
+        self.revision = 0
+        self._subjects: Optional[Dict[Tuple[str, str], Union[str, int]]] = None
+        self._unnotified: Set[Union[str, int]] = set()
+        self._config_seen: Any = None
+        self.lock = threading.RLock()
+        """
+        配置锁。修改、保存和同步配置时持有，使在线程中进行的保存和整理不会与事件循环中的修改交错。先于修改日志的锁获取。
+        """
 
         if not path:
             self.config = {}
             self.modifiable = False
-        elif not required and not path.is_file():
-            self.config = CommentedMap()
-        else:
-            try:
-                doc = yaml.load(path)
-            except (OSError, YAMLError):
-                logger.exception('Failed to load namespace {} ({})', namespace, path)
-                doc = CommentedMap()
+            return
+
+        # 先记下再读取，读取期间被其他实例改写时只会多重新读取一次
+        self._config_seen = self._config_signature()
+        self.config: "MutableMapping[Union[str, int], dict]" = self._load_config(path, required)
+
+        if self.modifiable and c.flexperm_journal:
+            self.journal = Journal(path.with_suffix('.journal'), c.flexperm_journal_fsync)
+            with self.journal.lock():
+                self.journal.replay(self.config, self._mark_dirty)
+                self.journal.mark_seen()
+
+    def _load_config(self, path: Path, required: bool) -> "MutableMapping[Union[str, int], dict]":
+        from ruamel.yaml import YAMLError, CommentedMap
+        if not required and not path.is_file():
+            return CommentedMap()
+        try:
+            doc = get_yaml().load(path)
+        except (OSError, YAMLError):
+            logger.exception('Failed to load namespace {} ({})', self.name, path)
+            return CommentedMap()
+        if not isinstance(doc, CommentedMap):
+            logger.error('Expect a dict: {} ({})', self.name, path)
+            return CommentedMap()
+        return doc
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        get_yaml().dump(self.config, self.path)
+
+    def _config_signature(self) -> Any:
+        """
+        :return: 配置文件的标识，配置文件被改写后会改变。
+        """
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _mark_dirty(self, record: Record):
+        """
+        记录一项修改已应用到配置上，但尚未写入配置文件。
+        """
+        self.dirty = True
+
+    def _load_group_config(self, name: Union[str, int], desc: Any):
+        """
+        用从硬盘读取的内容替换一个权限组的配置。内容与硬盘一致，不算作修改。
 
-            if not isinstance(doc, CommentedMap):
-                logger.error('Expect a dict: {} ({})', namespace, path)
-                doc = CommentedMap()
+        :param name: 组名。
+        :param desc: 权限组描述，为 None 表示已删除。
+        """
+        if desc is None:
+            self.config.pop(name, None)
+        else:
+            self.config[name] = desc
 
-            self.config: CommentedMap[Union[str, int], dict] = doc
+    @property
+    def has_unsaved_changes(self) -> bool:
+        """
+        是否有尚未持久化的修改。已写入修改日志的修改视为已持久化。
+        """
+        return self.dirty and self.journal is None
 
-    def save(self):
+    def save(self, compact: bool = True):
         """
         把本名称空间保存到硬盘上。若没有修改过则不做任何事。
+
+        :param compact: 是否把修改日志合并进配置文件。为 False 时，仅在日志超过大小阈值时重写配置文件。
         """
+        if not profiling.hooks:
+            return self._save(compact)
+        start = time.perf_counter()
+        dirty = self.dirty
+        self._save(compact)
+        elapsed = time.perf_counter() - start
+        for hook in profiling.hooks:
+            hook.on_save(elapsed, self, dirty)
+
+    def _save(self, compact: bool):
         if self.modifiable and self.dirty:
-            self.path.parent.mkdir(parents=True, exist_ok=True)
-            yaml.dump(self.config, self.path)
-            self.dirty = False
+            if self.journal and not compact and self.journal.size() < c.flexperm_journal_compact_size:
+                return
+            # 保存可能在线程中进行，清除修改标记和取出待通知的组都要在锁内，否则期间的修改会被当作已保存
+            if self.journal:
+                # 其他实例可能追加了本实例尚未应用的记录，先重放再合并，清空日志时才不会丢失
+                with self.lock, self.journal.lock():
+                    self.sync()
+                    self._write()
+                    self._config_seen = self._config_signature()
+                    self.journal.clear()
+                    self.dirty = False
+                    unnotified, self._unnotified = self._unnotified, set()
+            else:
+                with self.lock:
+                    self._write()
+                    self.dirty = False
+                    unnotified, self._unnotified = self._unnotified, set()
+            if unnotified:
+                self._notify(unnotified)
+
+    def _notify(self, names: Iterable[Union[str, int]]):
+        from .bus import notify
+        notify(self.name, names)
 
     def get_group(self, name: Union[str, int], referer: Optional["PermissionGroup"], required: bool
                   ) -> "PermissionGroup":
@@ -169,6 +422,18 @@ class Namespace:
             [0] 权限组，若失败则返回一个空组。 <br>
             [1] 是否成功。
         """
+        if not profiling.hooks:
+            return self._get_group(name, referer, required)
+        start = time.perf_counter()
+        loaded = name not in self.groups
+        group = self._get_group(name, referer, required)
+        elapsed = time.perf_counter() - start
+        for hook in profiling.hooks:
+            hook.on_get_group(elapsed, self, name, loaded)
+        return group
+
+    def _get_group(self, name: Union[str, int], referer: Optional["PermissionGroup"], required: bool
+                   ) -> "PermissionGroup":
         group = self.groups.get(name)
         if group is not None:
             if not group.referer:
@@ -187,40 +452,243 @@ class Namespace:
         self.groups[name] = group
         return group
 
-    def _get_group_uncached(self, name: Union[str, int], referer: Optional["PermissionGroup"], required: bool
-                            ) -> "PermissionGroup":
-        group_desc = self.config.get(name)
-        if group_desc is None:
-            if required:
-                if referer:
-                    logger.error('Permission group {}:{} not found (required from {})',
-                                 self.name, name, referer.qualified_name())
-                else:
-                    logger.error('Permission group {}:{} not found', self.name, name)
-            return NullPermissionGroup()
+    def subject_key(self, adapter: str, native_id: str) -> Optional[Union[str, int]]:
+        """
+        查找用户或群组在本名称空间中的组名。
 
-        try:
-            desc = parse_obj_as(GroupDesc, group_desc)
-        except ValueError:
-            logger.exception('Failed to parse {}:{} ({})', self.name, name, self.path)
-            return NullPermissionGroup()
+        组名可以写为"<适配器名>:<ID>"，默认适配器还可以直接写ID（整数ID写为整数），两种写法都存在时以后者为准。
+        默认适配器的ID能转换为整数时（如"0123"），与转换后的整数组名对应，与 try_int 一致。
 
-        # 注入插件预设
-        if self.name == 'global' and name in default_groups:
-            for pn in plugin_namespaces:
-                if name in pn.config:
-                    desc.inherits.append(f'{pn.name}:{name}')
+        :param adapter: 适配器名，小写。
+        :param native_id: 适配器中的用户ID或群号。
+        :return: 组名，若没有配置则返回 None 。
+        """
+        subject = adapter, native_id
+        index = self._subject_index(subject)
+        # 规范的十进制数字ID直接查索引，其他写法才需要尝试转换
+        if (native_id[:1] == '0' or not native_id.isdigit()) and adapter == c.flexperm_default_adapter.lower():
+            number = try_int(native_id)
+            if isinstance(number, int) and str(number) != native_id and number in self.config:
+                return number
+        return index.get(subject)
+
+    def _subject_index(self, subject: Tuple[str, str]) -> Dict[Tuple[str, str], Union[str, int]]:
+        """
+        :return: 包含指定用户或群组的组名索引，首次使用时建立。
+        """
+        if self._subjects is None:
+            self._subjects = {}
+            for name in self.config:
+                self._index_subject(name)
+        return self._subjects
+
+    def _index_subject(self, name: Union[str, int]):
+        subject = parse_subject_name(name)
+        if subject is None:
+            return
+        index = self._subject_index(subject)
+        # 不带适配器名的写法优先
+        current = index.get(subject)
+        if current is None or isinstance(current, str) and ':' in current:
+            index[subject] = name
+
+    def _unindex_subject(self, name: Union[str, int]):
+        subject = parse_subject_name(name)
+        if subject is None:
+            return
+        index = self._subject_index(subject)
+        if index.get(subject) != name:
+            return
+        del index[subject]
+        adapter, native_id = subject
+        for alt in (f'{adapter}:{native_id}', try_int(native_id)):
+            if alt in self.config:
+                index[subject] = alt
+
+    def load_groups(self, names: Iterable[Union[str, int]] = None) -> List["PermissionGroup"]:
+        """
+        批量加载权限组。先集中校验所有尚未加载的权限组描述，再逐个构建。
+
+        :param names: 组名，默认为本名称空间下的所有权限组。
+        :return: 成功加载的权限组。
+        """
+        # 下面遍历两次，传入的可能是生成器
+        names = list(self.config) if names is None else list(names)
+        pending = [(name, self.config.get(name)) for name in names if name not in self.groups]
+        descs, errors = parse_group_descs((name, desc) for name, desc in pending if desc is not None)
+        for name, e in errors.items():
+            logger.opt(exception=e).error('Failed to parse {}:{} ({})', self.name, name, self.path)
+            self.groups[name] = NullPermissionGroup()
+        for name, desc in descs.items():
+            if name not in self.groups:
+                self.groups[name] = self._get_group_uncached(name, None, False, desc)
+
+        result = []
+        for name in names:
+            group = self.groups.get(name)
+            if group is not None and group.is_valid:
+                result.append(group)
+        return result
+
+    def _get_group_uncached(self, name: Union[str, int], referer: Optional["PermissionGroup"], required: bool,
+                            desc: "GroupDesc" = None) -> "PermissionGroup":
+        if desc is None:
+            group_desc = self.config.get(name)
+            if group_desc is None:
+                if required:
+                    if referer:
+                        logger.error('Permission group {}:{} not found (required from {})',
+                                     self.name, name, referer.qualified_name())
+                    else:
+                        logger.error('Permission group {}:{} not found', self.name, name)
+                return NullPermissionGroup()
+
+            try:
+                desc = parse_group_desc(group_desc)
+            except ValueError:
+                logger.exception('Failed to parse {}:{} ({})', self.name, name, self.path)
+                return NullPermissionGroup()
 
         self.groups[name] = group = PermissionGroup(self, name)
-        group.populate(desc, referer, self.name if self.auto_decorate else None)
+        group.populate(desc, referer, self.name if self.auto_decorate else None, self._presets(name))
         return group
 
+    def _presets(self, name: Union[str, int]) -> List["Namespace"]:
+        """
+        :return: 需要注入到指定权限组的插件预设名称空间。
+        """
+        if self.name == 'global' and name in self.registry.default_groups:
+            return [pn for pn in self.registry.plugin_namespaces if name in pn.config]
+        return []
+
     @contextmanager
-    def modifying(self, name: Union[str, int] = None):
+    def modifying(self, record: Record):
+        """
+        修改本名称空间。进入时检查是否可修改，正常退出时把修改记录应用到配置上，并写入修改日志。
+
+        :param record: 修改记录。
+        :raise TypeError: 名称空间不可修改。
+        :raise KeyError: 修改记录针对的权限组不在配置中。
+        """
         if not self.modifiable:
             raise TypeError('Unmodifiable')
-        yield self.config[name] if name is not None else None
-        self.dirty = True
+        op, name = record[:2]
+        with self.lock:
+            if op not in ('add_group', 'remove_group') and name not in self.config:
+                raise KeyError(name)
+            yield
+            apply_record(self.config, record)
+            self._mark_dirty(record)
+            self.revision += 1
+            if op == 'add_group':
+                self._index_subject(name)
+            elif op == 'remove_group':
+                self._unindex_subject(name)
+            if audit.enabled:
+                audit.record_edit(self.name, record)
+            # 修改写入硬盘之后才通知其他实例
+            if self.journal:
+                self.journal.append(record)
+                self._notify([name])
+            else:
+                self._unnotified.add(name)
+
+    def sync(self):
+        """
+        应用其他实例追加到修改日志、但本实例尚未应用的修改。日志已被其他实例合并进配置文件时重新读取所有权限组。
+        未启用修改日志时不做任何事。
+        """
+        if not self.journal:
+            return
+        with self.lock, self.journal.lock():
+            if self._config_signature() != self._config_seen:
+                records = None
+            elif self.journal.changed:
+                records = self.journal.unseen()
+            else:
+                return
+            self.refresh(None if records is None else {x[1] for x in records if isinstance(x, list) and len(x) > 1})
+            self.journal.mark_seen()
+
+    def refresh(self, names: Iterable[Union[str, int]] = None):
+        """
+        从硬盘重新读取指定权限组的配置，并就地更新已加载的权限组，只有这些组及继承它们的组的缓存会失效。用于应用其他实例的修改。
+        本实例有尚未保存的修改的组保留本实例的版本。
+
+        读取期间持有配置锁。在事件循环中应分别调用 read_fresh 和 apply_fresh ，把读取放到线程中。
+
+        :param names: 组名，为 None 表示整个名称空间。
+        """
+        if not self.path:
+            return
+        with self.lock:
+            self.apply_fresh(self.read_fresh(names))
+
+    def read_fresh(self, names: Iterable[Union[str, int]] = None) -> "FreshConfig":
+        """
+        从硬盘读取指定权限组的配置（包括修改日志中的修改），不修改本名称空间，可以在线程中调用。分片目录只读取用到的分片。
+
+        :param names: 组名，为 None 表示整个名称空间。
+        :return: 读取结果，交给 apply_fresh 应用。
+        """
+        revision = self.revision
+        signature = self._config_signature()
+        fresh = self._load_config(self.path, False)
+        if self.journal:
+            self.journal.replay(fresh)
+        if names is None:
+            config = dict(fresh.items())
+        else:
+            names = set(names)
+            config = {name: fresh.get(name) for name in names}
+        return FreshConfig(names, config, signature, revision)
+
+    def apply_fresh(self, fresh: "FreshConfig") -> bool:
+        """
+        应用 read_fresh 的读取结果。
+
+        :param fresh: 读取结果。
+        :return: 是否应用了。读取之后本名称空间又被修改过时不应用，应重新读取。
+        """
+        with self.lock:
+            if self.revision != fresh.revision:
+                return False
+            names = fresh.names
+            full = names is None
+            if full:
+                names = set(self.groups) | set(self.config) | set(fresh.config)
+
+            for name in names:
+                if name in self._unnotified:
+                    # 没有修改日志时，本实例尚未保存的修改只在内存中，保留下来，保存时写入
+                    logger.warning('Keeping unsaved local changes to {}:{} over changes from another instance',
+                                   self.name, name)
+                    continue
+                desc = fresh.config.get(name)
+                self._load_group_config(name, desc)
+                if desc is None:
+                    self._unindex_subject(name)
+                else:
+                    self._index_subject(name)
+
+                group = self.groups.get(name)
+                if group is None:
+                    continue
+                if desc is not None and group.is_valid:
+                    try:
+                        group.populate(parse_group_desc(desc), None, self.name if self.auto_decorate else None,
+                                       self._presets(name))
+                        continue
+                    except ValueError:
+                        logger.exception('Failed to parse {}:{} ({})', self.name, name, self.path)
+                # 已删除、解析失败，或之前没有成功加载，下次使用时重新加载
+                del self.groups[name]
+                if group.is_valid:
+                    group._publish(GroupState())
+            if full:
+                self._config_seen = fresh.signature
+            self.revision += 1
+            return True
 
     def add_group(self, name: Union[str, int], comment: str = None):
         """
@@ -231,12 +699,9 @@ class Namespace:
         :raise KeyError: 权限组已存在。
         :raise TypeError: 名称空间不可修改。
         """
-        with self.modifying():
+        with self.modifying(['add_group', name, comment]):
             if name in self.config:
                 raise KeyError('Duplicate group')
-            self.config[name] = CommentedMap(permissions=CommentedSeq())
-            if comment is not None:
-                self.config.yaml_add_eol_comment(comment, name)
             self.groups.pop(name, None)
 
     def remove_group(self, name: Union[str, int], force: bool):
@@ -249,13 +714,70 @@ class Namespace:
         :raise ValueError: 因权限组非空而没有移除。
         :raise TypeError: 名称空间不可修改。
         """
-        with self.modifying():
+        with self.modifying(['remove_group', name]):
             if not force and any(self.config[name].values()):
                 raise ValueError('Not empty')
-            del self.config[name]
             self.groups.pop(name, None)
 
 
+class GroupState:
+    """
+    权限组的一个版本，包含检查所需的全部内容。
+
+    除 cache 外创建后不再修改。修改权限组时构建新版本并整体替换，检查时只需读取一次 PermissionGroup.state ，无需加锁。
+    """
+
+    __slots__ = ('allows', 'denies', 'inherits', 'expiry', 'cache', '_patterns')
+
+    def __init__(self, allows: FrozenSet[str] = frozenset(), denies: FrozenSet[str] = frozenset(),
+                 inherits: Tuple["PermissionGroup", ...] = (), expiry: Mapping[str, float] = None):
+        self.allows = allows
+        self.denies = denies
+        self.inherits = inherits
+        self.expiry: Mapping[str, float] = expiry or {}
+        """
+        有期限的权限描述及其到期时间戳。加载时已过期的描述只出现在这里，不出现在 allows 和 denies 中。
+        """
+        self.cache: OrderedDict[str, Optional[CheckResult]] = OrderedDict()
+        self._patterns: Optional[Tuple[Optional[PatternTrie], Optional[PatternTrie]]] = None
+
+    def patterns(self) -> Tuple[Optional["PatternTrie"], Optional["PatternTrie"]]:
+        """
+        :return: 撤销描述和授予描述中的扩展通配描述分别编译成的前缀树，没有则为 None 。首次调用时编译。
+        """
+        if self._patterns is None:
+            self._patterns = PatternTrie.compile(self.denies), PatternTrie.compile(self.allows)
+        return self._patterns
+
+    def renew(self) -> "GroupState":
+        """
+        :return: 内容相同、缓存为空的新版本。
+        """
+        state = GroupState(self.allows, self.denies, self.inherits, self.expiry)
+        state._patterns = self._patterns
+        return state
+
+    def with_item(self, item: str, deadline: Optional[float] = None) -> "GroupState":
+        """
+        :return: 添加了一项权限描述的新版本。
+        """
+        expiry = {k: v for k, v in self.expiry.items() if k != item}
+        if deadline is not None:
+            expiry[item] = deadline
+        if item.startswith('-'):
+            return GroupState(self.allows, self.denies | {item[1:]}, self.inherits, expiry)
+        return GroupState(self.allows | {item}, self.denies, self.inherits, expiry)
+
+    def without_item(self, item: str) -> "GroupState":
+        """
+        :return: 去掉了一项权限描述的新版本。
+        """
+        expiry = {k: v for k, v in self.expiry.items() if k != item}
+        if item.startswith('-'):
+            return GroupState(self.allows, self.denies - {item[1:]}, self.inherits, expiry)
+        return GroupState(self.allows - {item}, self.denies, self.inherits, expiry)
+
+
 class PermissionGroup:
     """
     权限组。
@@ -268,14 +790,28 @@ class PermissionGroup:
     def __init__(self, namespace: Namespace, name: Union[str, int]):
         self.namespace = namespace
         self.name = name
-        self.denies: Set[str] = set()
-        self.allows: Set[str] = set()
-        self.inherits: List[PermissionGroup] = []
-        self.cache: OrderedDict[str, CheckResult] = OrderedDict()
+        self.state = GroupState()
+        self.dependents: "weakref.WeakSet[PermissionGroup]" = weakref.WeakSet()
 
     def __repr__(self):
         return f'<PermissionGroup {self.qualified_name()}>'
 
+    @property
+    def allows(self) -> FrozenSet[str]:
+        return self.state.allows
+
+    @property
+    def denies(self) -> FrozenSet[str]:
+        return self.state.denies
+
+    @property
+    def inherits(self) -> Tuple["PermissionGroup", ...]:
+        return self.state.inherits
+
+    @property
+    def cache(self) -> "OrderedDict[str, Optional[CheckResult]]":
+        return self.state.cache
+
     def qualified_name(self):
         return f'{self.namespace.name}:{self.name}'
 
@@ -286,23 +822,34 @@ class PermissionGroup:
         :param perm: 权限。
         :return: 查找结果，若不包含则返回 None 。
         """
-        if perm in self.cache:
-            self.cache.move_to_end(perm)
-            return self.cache[perm]
-        result = self._check_uncached(perm)
-        if len(self.cache) > 127:
-            self.cache.popitem(last=False)
-        self.cache[perm] = result
+        state = self.state
+        cache = state.cache
+        try:
+            result = cache[perm]
+        except KeyError:
+            pass
+        else:
+            with contextlib.suppress(KeyError):
+                cache.move_to_end(perm)
+            return result
+        result = self._check_uncached(perm, state)
+        if len(cache) > 127:
+            with contextlib.suppress(KeyError):
+                cache.popitem(last=False)
+        cache[perm] = result
         return result
 
-    def _check_uncached(self, perm: str) -> Optional["CheckResult"]:
-        if check_wildcard(perm, self.denies):
+    def _check_uncached(self, perm: str, state: GroupState = None) -> Optional["CheckResult"]:
+        if state is None:
+            state = self.state
+        deny_patterns, allow_patterns = state.patterns()
+        if check_wildcard(perm, state.denies, deny_patterns):
             return CheckResult.DENY
-        if check_wildcard(perm, self.allows):
+        if check_wildcard(perm, state.allows, allow_patterns):
             return CheckResult.ALLOW
 
         allowed = False
-        for inherit in self.inherits:
+        for inherit in state.inherits:
             r = inherit.check(perm)
             if r == CheckResult.DENY:
                 return r
@@ -311,58 +858,103 @@ class PermissionGroup:
         if allowed:
             return CheckResult.ALLOW
 
-    def populate(self, desc: "GroupDesc", referer: Optional["PermissionGroup"], decorate_base: Optional[str]):
+    def _publish(self, state: GroupState):
+        """
+        发布新版本，并使所有直接或间接继承本组的权限组换用缓存为空的新版本。
+        """
+        self.state = state
+        pending = list(self.dependents)
+        seen = set()
+        while pending:
+            group = pending.pop()
+            if group in seen:
+                continue
+            seen.add(group)
+            group.state = group.state.renew()
+            pending.extend(group.dependents)
+
+    def populate(self, desc: "GroupDesc", referer: Optional["PermissionGroup"], decorate_base: Optional[str],
+                 presets: Iterable[Namespace] = ()):
         """
         从描述中读取权限组内容，同时会加载依赖的组。
 
         :param desc: 权限组描述。
         :param referer: 引用者。
         :param decorate_base: 如果需要修饰，插件名。
+        :param presets: 需要自动继承其中同名权限组的插件预设名称空间。
         """
         self.referer = referer or self
 
+        inherits = []
         for parent in desc.inherits:
             namespace, group = parse_qualified_group_name(parent, self.namespace.name)
-            res = get(namespace, group, self, True)
+            res = self.namespace.registry.get(namespace, group, self, True)
             if res.is_valid:
-                self.inherits.append(res)
+                inherits.append(res)
+
+        # 没有继承关系的预设组合并为一个组，其余的照常继承
+        merged = PresetGroup(self.namespace, self.name)
+        for pn in presets:
+            res = pn.get_group(self.name, self, True)
+            if not res.is_valid:
+                continue
+            if res.inherits:
+                inherits.append(res)
+            else:
+                merged.merge(pn.name, res)
+        if merged.sources:
+            inherits.append(merged)
+
+        for res in inherits:
+            res.dependents.add(self)
 
+        now = time.time()
+        allows, denies, expiry = set(), set(), {}
         for item in desc.permissions:
+            expires = desc.expires.get(item)
             if item.startswith('-'):
-                target = self.denies
+                target, prefix = denies, '-'
                 item = item[1:]
             else:
-                target = self.allows
+                target, prefix = allows, ''
             if decorate_base is not None:
                 [item] = decorate_permission(decorate_base, [item])
+            if expires is not None:
+                expiry[prefix + item] = expires.timestamp()
+                if expiry[prefix + item] <= now:
+                    continue  # 已过期，不参与检查，稍后由到期处理从配置中移除
             target.add(item)
 
+        self._publish(GroupState(frozenset(allows), frozenset(denies), tuple(inherits), expiry))
+        for item, deadline in expiry.items():
+            schedule_expiry(self, item, deadline)
         del self.referer
 
-    def add(self, item: str, comment: str = None):
+    def add(self, item: str, comment: str = None, expires: datetime = None):
         """
-        添加权限描述。
+        添加权限描述。若已有该描述但期限不同，则改为新的期限。
 
         :param item: 权限描述。
         :param comment: 注释。
-        :raise ValueError: 权限组中已有指定描述。
+        :param expires: 到期时间，不带时区的本地时间。为 None 表示长期有效。
+        :raise ValueError: 权限组中已有期限相同的指定描述。
         :raise TypeError: 权限组不可修改。
         """
-        with self.namespace.modifying(self.name) as desc:
+        record = ['add', self.name, item, comment]
+        if expires is not None:
+            record.append(expires)
+        deadline = expires and expires.timestamp()
+        with self.namespace.modifying(record):
+            state = self.state
             if item.startswith('-'):
-                target = self.denies
-                perm = item[1:]
+                present = item[1:] in state.denies
             else:
-                target = self.allows
-                perm = item
-            if perm in target:
+                present = item in state.allows
+            if present and state.expiry.get(item) == deadline:
                 raise ValueError('Duplicate item')
-            target.add(perm)
-            self.cache.clear()
-            permissions: CommentedSeq = desc.setdefault('permissions', CommentedSeq())
-            permissions.append(item)
-            if comment is not None:
-                permissions.yaml_add_eol_comment(comment, len(permissions) - 1)  # yaml_add_eol_comment 不支持负数下标
+            self._publish(state.with_item(item, deadline))
+        if deadline is not None:
+            schedule_expiry(self, item, deadline)
 
     def remove(self, item: str):
         """
@@ -372,19 +964,26 @@ class PermissionGroup:
         :raise ValueError: 权限组中没有指定描述。
         :raise TypeError: 权限组不可修改。
         """
-        with self.namespace.modifying(self.name) as desc:
+        with self.namespace.modifying(['remove', self.name, item]):
+            state = self.state
             if item.startswith('-'):
-                target = self.denies
-                perm = item[1:]
-            else:
-                target = self.allows
-                perm = item
-            if perm not in target:
+                if item[1:] not in state.denies:
+                    raise ValueError('No such item')
+            elif item not in state.allows:
                 raise ValueError('No such item')
-            target.remove(perm)
-            self.cache.clear()
-            permissions = desc['permissions']
-            permissions.remove(item)
+            self._publish(state.without_item(item))
+
+    def expire(self, item: str):
+        """
+        移除到期的权限描述。由到期处理调用，权限组不可修改时只从内存中移除。
+
+        :param item: 权限描述。
+        """
+        try:
+            with self.namespace.modifying(['remove', self.name, item]):
+                self._publish(self.state.without_item(item))
+        except (TypeError, KeyError):
+            self._publish(self.state.without_item(item))
 
     def add_inheritance(self, target: "PermissionGroup", comment: str = None):
         """
@@ -395,15 +994,12 @@ class PermissionGroup:
         :raise ValueError: 权限组中已有指定继承关系。
         :raise TypeError: 权限组不可修改。
         """
-        with self.namespace.modifying(self.name) as desc:
-            if target in self.inherits:
+        with self.namespace.modifying(['add_inherit', self.name, target.qualified_name(), comment]):
+            state = self.state
+            if target in state.inherits:
                 raise ValueError('Duplicate inheritance')
-            self.inherits.append(target)
-            self.cache.clear()
-            inherits: CommentedSeq = desc.setdefault('inherits', CommentedSeq())
-            inherits.append(target.qualified_name())
-            if comment is not None:
-                inherits.yaml_add_eol_comment(comment, len(inherits) - 1)  # yaml_add_eol_comment 不支持负数下标
+            target.dependents.add(self)
+            self._publish(GroupState(state.allows, state.denies, state.inherits + (target,), state.expiry))
 
     def remove_inheritance(self, target: "PermissionGroup"):
         """
@@ -413,20 +1009,61 @@ class PermissionGroup:
         :raise ValueError: 权限组中没有指定继承关系。
         :raise TypeError: 权限组不可修改。
         """
-        with self.namespace.modifying(self.name) as desc:
-            if target not in self.inherits:
+        possible_decls = [target.qualified_name()]
+        if target.namespace is self.namespace:
+            possible_decls.append(target.name)
+        with self.namespace.modifying(['remove_inherit', self.name, possible_decls]):
+            state = self.state
+            if target not in state.inherits:
                 raise ValueError('No such inheritance')
-            self.inherits.remove(target)
-            self.cache.clear()
+            target.dependents.discard(self)
+            inherits = tuple(x for x in state.inherits if x is not target)
+            self._publish(GroupState(state.allows, state.denies, inherits, state.expiry))
 
-            inherits: CommentedSeq = desc.setdefault('inherits', CommentedSeq())
-            possible_decls = [target.qualified_name()]
-            if target.namespace is self.namespace:
-                possible_decls.append(target.name)
-            for decl in possible_decls:
-                with contextlib.suppress(ValueError):
-                    inherits.remove(decl)
-                    break
+
+class PresetGroup(PermissionGroup):
+    """
+    合并后的插件预设组。
+
+    默认权限组会继承各插件预设中的同名权限组。这些预设组通常只包含权限描述，把它们的描述合并到一起检查，结果与逐个继承相同。
+    """
+
+    def __init__(self, namespace: Namespace, name: Union[str, int]):
+        super().__init__(namespace, name)
+        self.sources: Dict[str, List[str]] = {}
+        """
+        每项权限描述由哪些插件提供。
+        """
+
+    def qualified_name(self):
+        return f'{super().qualified_name()}[presets]'
+
+    def merge(self, plugin: str, group: PermissionGroup):
+        """
+        合并一个没有继承关系的预设组。
+
+        :param plugin: 插件名。
+        :param group: 预设组。
+        """
+        state = self.state
+        expiry = dict(state.expiry)
+        for item in [*group.allows, *('-' + perm for perm in group.denies)]:
+            deadline = group.state.expiry.get(item)
+            if item not in self.sources:
+                if deadline is not None:
+                    expiry[item] = deadline
+            elif deadline is None or item not in expiry:
+                expiry.pop(item, None)  # 有长期有效的来源
+            else:
+                expiry[item] = max(expiry[item], deadline)
+            self.sources.setdefault(item, []).append(plugin)
+        self._publish(GroupState(state.allows | group.allows, state.denies | group.denies, state.inherits, expiry))
+        for item, deadline in expiry.items():
+            schedule_expiry(self, item, deadline)
+
+    def expire(self, item: str):
+        # 合并组的内容不来自配置文件，只在内存中移除
+        self._publish(self.state.without_item(item))
 
 
 class GroupDesc(BaseModel):
@@ -444,19 +1081,136 @@ class GroupDesc(BaseModel):
     继承的权限组，每个元素为一个权限组名，可以表示为限定名（名称空间:组名），也可以不包含冒号，表示当前名称空间。
     """
 
+    expires: Dict[str, datetime] = {}
+    """
+    有期限的权限描述，键为 permissions 中的描述，值为到期时间。到期后该描述会被自动移除。
+    """
+
     class Config:
         extra = 'forbid'
 
 
+_group_desc_fields = frozenset(GroupDesc.__fields__)
+K = TypeVar('K')
+
+
+def _is_str_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(x, str) for x in value)
+
+
+def _is_expiry_map(value: Any) -> bool:
+    return isinstance(value, dict) and all(isinstance(k, str) and isinstance(v, datetime) for k, v in value.items())
+
+
+def parse_group_desc(obj: Any) -> GroupDesc:
+    """
+    解析权限组描述。
+
+    常见的合法描述直接构造，跳过 pydantic 的校验；其他情况仍交给 pydantic 处理，因此校验规则和错误信息保持不变。
+
+    :param obj: 配置文件中的权限组描述。
+    :return: 权限组描述，其中的列表均为副本。
+    :raise ValueError: 描述不合法。
+    """
+    if isinstance(obj, dict) and _group_desc_fields.issuperset(obj):
+        permissions = obj.get('permissions', [])
+        inherits = obj.get('inherits', [])
+        expires = obj.get('expires', {})
+        if _is_str_list(permissions) and _is_str_list(inherits) and _is_expiry_map(expires):
+            return GroupDesc.construct(permissions=list(permissions), inherits=list(inherits), expires=dict(expires))
+    return parse_obj_as(GroupDesc, obj)
+
+
+def parse_group_descs(items: Iterable[Tuple[K, Any]]) -> Tuple[Dict[K, GroupDesc], Dict[K, ValueError]]:
+    """
+    批量解析权限组描述。
+
+    :param items: (组名, 描述) 序列。
+    :return:
+        [0] 解析成功的描述。 <br>
+        [1] 解析失败的错误。
+    """
+    descs = {}
+    errors = {}
+    for name, obj in items:
+        try:
+            descs[name] = parse_group_desc(obj)
+        except ValueError as e:
+            errors[name] = e
+    return descs, errors
+
+
 class CheckResult(Enum):
     ALLOW = 1
     DENY = 2
 
 
-def check_wildcard(item: str, set_: Set[str]) -> bool:
+class PermissionHandle(str):
+    """
+    预先处理过的权限名，与同名字符串相等。
+
+    创建时完成修饰和拆分，之后可以反复传给检查权限的接口，不必每次重新修饰、拆分。
+    """
+
+    segments: Tuple[str, ...]
+    """
+    按"."拆分后的各段。
+    """
+
+    wildcards: FrozenSet[str]
+    """
+    可以匹配本权限的所有末尾通配描述。
+    """
+
+    def __new__(cls, name: str):
+        self = super().__new__(cls, sys.intern(name))
+        segments = name.split('.')
+        self.segments = tuple(segments)
+        self.wildcards = frozenset('.'.join(segments[:i] + ['*']) for i in range(len(segments) + 1))
+        return self
+
+    def __repr__(self):
+        return f'<PermissionHandle {str.__repr__(self)}>'
+
+
+def match_wildcard(item: str, set_: Set[str], patterns: Optional[PatternTrie] = None) -> Optional[str]:
+    """
+    查找匹配指定权限的权限描述。比 check_wildcard 慢，仅用于诊断。
+
+    :param item: 权限。
+    :param set_: 权限描述集合（不含"-"前缀）。
+    :param patterns: 其中的扩展通配描述编译成的前缀树。
+    :return: 匹配的描述，优先返回精确匹配，其次是最具体的末尾通配描述，最后是扩展通配描述；没有则返回 None 。
+    """
+    if item in set_:
+        return item
+    segments = item.split('.')
+    for i in range(len(segments), -1, -1):
+        wildcard = '.'.join(segments[:i] + ['*'])
+        if wildcard in set_:
+            return wildcard
+    if patterns is not None:
+        return patterns.match(segments)
+    return None
+
+
+def check_wildcard(item: str, set_: Set[str], patterns: Optional[PatternTrie] = None) -> bool:
+    """
+    检查权限是否被描述集合中的某项匹配。
+
+    :param item: 权限。
+    :param set_: 权限描述集合（不含"-"前缀）。
+    :param patterns: 其中的扩展通配描述编译成的前缀树。
+    """
     if item in set_:
         return True
+    if isinstance(item, PermissionHandle):
+        if not set_.isdisjoint(item.wildcards):
+            return True
+        return patterns is not None and patterns.match(item.segments) is not None
     segments = item.split('.')
+    if patterns is not None and patterns.match(segments) is not None:
+        return True
     segments.append('*')
     while segments:
         segments[-1] = '*'
@@ -477,10 +1231,33 @@ def parse_qualified_group_name(qn: str, default_namespace: str = 'global') -> Tu
     return namespace, group
 
 
+def parse_subject_name(name: Union[str, int]) -> Optional[Tuple[str, str]]:
+    """
+    解析 user 或 group 名称空间中的组名。
+
+    :param name: 组名。
+    :return: (适配器名, ID) ，若不是合法的用户或群组名则返回 None 。
+    """
+    default_adapter = c.flexperm_default_adapter.lower()
+    if isinstance(name, int):
+        return default_adapter, str(name)
+    if not isinstance(name, str):
+        return None
+    if ':' in name:
+        adapter, native_id = name.split(':', maxsplit=1)
+        return adapter, native_id
+    if isinstance(try_int(name), int):
+        # 整数ID须写为整数
+        return None
+    return default_adapter, name
+
+
 def decorate_permission(base: str, perm: Iterable[str]) -> List[str]:
     result = []
     for p in perm:
-        if not p:
+        if isinstance(p, PermissionHandle):
+            result.append(p)
+        elif not p:
             result.append(base)
         elif p.startswith('/'):
             result.append(p[1:])
@@ -501,6 +1278,7 @@ else:
     class NullPermissionGroup:
         referer = None
         namespace = None
+        state = None
         is_valid = False
 
         def __init__(self):
@@ -0,0 +1,94 @@
+import heapq
+import itertools
+import math
+import time
+import weakref
+from datetime import datetime, timedelta
+from typing import List, Tuple, Union, Optional
+
+from nonebot.log import logger
+
+_heap: List[Tuple[float, int, weakref.ref, str]] = []
+_counter = itertools.count()
+
+next_deadline = math.inf
+"""
+最早的到期时间戳，没有待到期的权限描述时为 inf 。检查权限前与当前时间比较一次即可知道是否需要处理到期。
+"""
+
+
+def normalize_expires(expires: Union[datetime, timedelta, float, None]) -> Optional[datetime]:
+    """
+    把有效期统一为不带时区的本地时间，精确到秒。
+
+    :param expires: 到期时间，或从现在起的有效时长（timedelta 或秒数）。
+    :return: 到期时间，expires 为 None 时返回 None 。
+    """
+    if expires is None:
+        return None
+    if isinstance(expires, (int, float)):
+        expires = timedelta(seconds=expires)
+    if isinstance(expires, timedelta):
+        expires = datetime.now() + expires
+    if expires.tzinfo is not None:
+        expires = expires.astimezone().replace(tzinfo=None)
+    return expires.replace(microsecond=0)
+
+
+def schedule_expiry(group, item: str, deadline: float):
+    """
+    登记一项有期限的权限描述。
+
+    :param group: 权限组。
+    :param item: 权限描述。
+    :param deadline: 到期时间戳。
+    """
+    global next_deadline
+    heapq.heappush(_heap, (deadline, next(_counter), weakref.ref(group), item))
+    if deadline < next_deadline:
+        next_deadline = deadline
+        _arm()
+
+
+def expire_due(now: float = None) -> int:
+    """
+    移除所有已到期的权限描述。只影响相关权限组及继承它们的组的缓存。
+
+    :param now: 当前时间戳，默认为 time.time() 。
+    :return: 移除的描述数量。
+    """
+    from . import core
+
+    global next_deadline
+    if now is None:
+        now = time.time()
+    count = 0
+    while _heap and _heap[0][0] <= now:
+        deadline, _, ref, item = heapq.heappop(_heap)
+        group = ref()
+        # 权限组已被回收、已重新加载，或该描述已被移除、改为其他期限。不属于任何 Registry 的覆盖层不受重新加载影响
+        if group is None or group.namespace.registry not in (None, core.registry) \
+                or group.state.expiry.get(item) != deadline:
+            continue
+        group.expire(item)
+        count += 1
+    next_deadline = _heap[0][0] if _heap else math.inf
+    _arm()
+    if count:
+        logger.debug('Expired {} permission items', count)
+    return count
+
+
+async def _fire():
+    expire_due()
+
+
+def _arm():
+    from .core import scheduler
+
+    if next_deadline == math.inf:
+        if scheduler.get_job('flexperm.expire') is not None:
+            scheduler.remove_job('flexperm.expire')
+        return
+    scheduler.add_job(_fire, 'date', run_date=datetime.fromtimestamp(next_deadline), id='flexperm.expire',
+                      replace_existing=True, misfire_grace_time=None)
@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from .core import CheckResult, PermissionGroup, PresetGroup, match_wildcard
+
+
+class Decision(NamedTuple):
+    """
+    一个权限组对指定权限的说明及其来源。
+    """
+
+    result: CheckResult
+    rule: str
+    """
+    起决定作用的权限描述，撤销描述带有"-"前缀。
+    """
+
+    path: Tuple[PermissionGroup, ...]
+    """
+    继承路径，从被检查的权限组开始，到包含该描述的权限组为止。
+    """
+
+
+class Explanation(NamedTuple):
+    """
+    一次权限检查的过程。
+    """
+
+    perm: str
+    result: bool
+    steps: List[Tuple[PermissionGroup, Optional[CheckResult]]]
+    """
+    依次检查过的权限组及各自的结果，到第一个有结果的为止。
+    """
+
+    decision: Optional[Decision]
+    """
+    起决定作用的说明，所有权限组都无结果时为 None 。
+    """
+
+    def __str__(self):
+        lines = ['权限 {}：{}'.format(self.perm, '授予' if self.result else '未授予')]
+        lines.append('检查顺序：' + ' -> '.join(f'{_name(g)}({_result(r)})' for g, r in self.steps))
+        if self.decision is None:
+            lines.append('所有权限组均无结果')
+            return '\n'.join(lines)
+        rule = self.decision.rule
+        kind = '精确' if rule.lstrip('-') == self.perm else '通配'
+        lines.append(f'匹配描述：{rule}（{kind}）')
+        lines.append('继承路径：' + ' -> '.join(_name(g) for g in self.decision.path))
+        holder = self.decision.path[-1]
+        if (deadline := holder.state.expiry.get(rule)) is not None:
+            lines.append('有效期至：' + datetime.fromtimestamp(deadline).strftime('%Y-%m-%d %H:%M:%S'))
+        if isinstance(holder, PresetGroup):
+            lines.append('来源插件：' + ', '.join(holder.sources.get(rule, [])))
+        return '\n'.join(lines)
+
+
+def _name(group: PermissionGroup) -> str:
+    return group.qualified_name() if group.is_valid else '(空)'
+
+
+def _result(result: Optional[CheckResult]) -> str:
+    return {CheckResult.ALLOW: '授予', CheckResult.DENY: '撤销'}.get(result, '无结果')
+
+
+def explain_group(group: PermissionGroup, perm: str) -> Optional[Decision]:
+    """
+    检查权限组对指定权限的说明，并找出起决定作用的描述。不使用也不更新缓存。
+
+    :param group: 权限组。
+    :param perm: 权限。
+    :return: 说明及其来源，若不包含则返回 None 。
+    """
+    state = group.state
+    if state is None:
+        return None
+    deny_patterns, allow_patterns = state.patterns()
+    if (rule := match_wildcard(perm, state.denies, deny_patterns)) is not None:
+        return Decision(CheckResult.DENY, '-' + rule, (group,))
+    if (rule := match_wildcard(perm, state.allows, allow_patterns)) is not None:
+        return Decision(CheckResult.ALLOW, rule, (group,))
+
+    allowed = None
+    for inherit in state.inherits:
+        r = explain_group(inherit, perm)
+        if r is None:
+            continue
+        if r.result == CheckResult.DENY:
+            return r._replace(path=(group,) + r.path)
+        if allowed is None:
+            allowed = r._replace(path=(group,) + r.path)
+    return allowed
+
+
+def explain_chain(chain: Iterable[PermissionGroup], perm: str) -> Explanation:
+    """
+    依次检查权限组链，并记录检查过程。
+
+    :param chain: 权限组链。
+    :param perm: 权限。
+    :return: 检查过程。
+    """
+    steps = []
+    for group in chain:
+        decision = explain_group(group, perm)
+        steps.append((group, decision and decision.result))
+        if decision is not None:
+            return Explanation(perm, decision.result == CheckResult.ALLOW, steps, decision)
+    return Explanation(perm, False, steps, None)
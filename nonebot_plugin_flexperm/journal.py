@@ -0,0 +1,252 @@
+import contextlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, List, MutableMapping, Optional, Tuple
+
+from nonebot.log import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+if TYPE_CHECKING:
+    from ruamel.yaml import CommentedSeq
+
+Record = List[Any]
+"""
+修改记录，形如 [操作, 组名, 参数...] 。
+"""
+
+
+class Journal:
+    """
+    名称空间的修改日志。每次修改立即追加一条记录，加载名称空间时重放，保存配置文件时清空。
+    """
+
+    def __init__(self, path: Path, fsync: bool):
+        self.path = path
+        self.fsync = fsync
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._seen: Optional[Tuple[int, int, int]] = None
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    @property
+    def changed(self) -> bool:
+        """
+        日志文件在本实例上次同步之后是否被其他实例改动过。
+        """
+        return self._stat() != self._seen
+
+    def mark_seen(self):
+        """
+        记录本实例已同步到日志文件的当前内容。应在持有 lock 时调用。
+        """
+        self._seen = self._stat()
+
+    def unseen(self) -> Optional[List[Record]]:
+        """
+        读取本实例上次同步之后其他实例追加的记录。应在持有 lock 时调用。
+
+        :return: 追加的记录；日志在此期间被清空或替换过（其他实例已合并进配置文件）时返回 None 。
+        """
+        current, seen = self._stat(), self._seen
+        if current is None or seen is None or current[0] != seen[0] or current[1] < seen[1]:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(seen[1])
+            lines = f.read().decode('utf-8').splitlines()
+        records = []
+        for line in lines:
+            with contextlib.suppress(ValueError):
+                records.append(json.loads(line))
+        return records
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        在多个实例（及本实例的多个线程）之间互斥地操作日志文件，可重入。追加记录和合并进配置文件时持有，
+        使其他实例追加的记录要么在合并前被重放，要么在清空之后才写入，不会丢失。
+        """
+        with self._thread_lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+            path = self.path.with_name(self.path.name + '.lock')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'a+b') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                self._depth = 1
+                try:
+                    yield
+                finally:
+                    self._depth = 0
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+                    else:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def size(self) -> int:
+        """
+        :return: 日志文件大小（字节），不存在时为 0 。
+        """
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, record: Record):
+        """
+        追加一条修改记录。
+
+        :param record: 修改记录。
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock():
+            # 之前已有其他实例的记录时，保持未同步的状态
+            synced = not self.changed
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            if synced:
+                self.mark_seen()
+
+    def replay(self, config: MutableMapping, on_applied: Callable[[Record], Any] = None) -> int:
+        """
+        把日志中的修改应用到配置上。
+
+        :param config: 从配置文件读取的配置。
+        :param on_applied: 每应用一条记录后调用。
+        :return: 应用的记录数。
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+
+        count = 0
+        for lineno, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+                apply_record(config, record)
+            except (ValueError, TypeError, KeyError):
+                logger.warning('Skipping malformed journal record {}:{}', self.path, lineno)
+                continue
+            if on_applied is not None:
+                on_applied(record)
+            count += 1
+        return count
+
+    def clear(self):
+        """
+        清空日志。应在修改已写入配置文件之后、持有 lock 时调用。
+        """
+        with contextlib.suppress(FileNotFoundError):
+            self.path.unlink()
+        self._seen = None
+
+
+def apply_record(config: MutableMapping, record: Record):
+    """
+    把一条修改记录应用到配置上。重复应用同一条记录不会产生额外影响。
+
+    :param config: 名称空间配置。
+    :param record: 修改记录。
+    :raise ValueError: 未知的操作。
+    """
+    from ruamel.yaml import CommentedMap, CommentedSeq
+
+    op, name, *args = record
+    if op == 'add_group':
+        [comment] = args
+        if name not in config:
+            config[name] = CommentedMap(permissions=CommentedSeq())
+            if comment is not None:
+                config.yaml_add_eol_comment(comment, name)
+    elif op == 'remove_group':
+        config.pop(name, None)
+    elif op in ('add', 'add_inherit'):
+        item, comment, *rest = args
+        desc = config.get(name)
+        if desc is None:
+            return
+        seq: "CommentedSeq" = desc.setdefault('permissions' if op == 'add' else 'inherits', CommentedSeq())
+        if item not in seq:
+            seq.append(item)
+            if comment is not None:
+                seq.yaml_add_eol_comment(comment, len(seq) - 1)  # yaml_add_eol_comment 不支持负数下标
+        if op == 'add':
+            # 记录中的到期时间是可选的第五项，重放日志时为字符串
+            expires = rest[0] if rest else None
+            if isinstance(expires, str):
+                expires = datetime.fromisoformat(expires)
+            _set_expires(desc, item, expires)
+    elif op == 'remove':
+        [item] = args
+        with contextlib.suppress(KeyError, ValueError, AttributeError):
+            config[name]['permissions'].remove(item)
+        with contextlib.suppress(KeyError, AttributeError):
+            _set_expires(config[name], item, None)
+    elif op == 'compact':
+        # 去掉重复项，另一项非空时去掉空列表
+        desc = config.get(name)
+        if desc is None:
+            return
+        for key in ('permissions', 'inherits'):
+            seq = desc.get(key)
+            if not isinstance(seq, list):
+                continue
+            seen = set()
+            duplicates = [i for i, x in enumerate(seq) if x in seen or seen.add(x)]
+            for i in reversed(duplicates):
+                del seq[i]
+            if not seq and any(desc.get(k) for k in ('permissions', 'inherits')):
+                del desc[key]
+    elif op == 'remove_inherit':
+        [decls] = args
+        inherits = config.get(name, {}).get('inherits')
+        if not inherits:
+            return
+        for decl in decls:
+            with contextlib.suppress(ValueError):
+                inherits.remove(decl)
+                break
+    else:
+        raise ValueError(f'Unknown journal operation: {op}')
+
+
+def _set_expires(desc: MutableMapping, item: str, expires: Optional[datetime]):
+    from ruamel.yaml import CommentedMap
+
+    expiry = desc.get('expires')
+    if expires is not None:
+        if expiry is None:
+            expiry = desc['expires'] = CommentedMap()
+        expiry[item] = expires
+    elif expiry is not None:
+        expiry.pop(item, None)
+        if not expiry:
+            del desc['expires']
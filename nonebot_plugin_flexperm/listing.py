@@ -0,0 +1,168 @@
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from . import overlay
+from .core import get, get_namespace, PermissionGroup
+from .explain import explain_group
+
+SHOWN_ITEMS = 20
+"""
+字符串形式中每类最多列出的项数。
+"""
+
+
+class GroupPage(NamedTuple):
+    """
+    名称空间中权限组的一页。
+    """
+
+    namespace: str
+    page: int
+    """
+    页码，从 1 开始。
+    """
+
+    groups: List[Tuple[Union[str, int], int, int]]
+    """
+    本页的权限组，元素为 (组名, 权限描述数, 继承的组数) ，按配置中的顺序排列。
+    """
+
+    has_more: bool
+    """
+    是否还有下一页。
+    """
+
+    def __str__(self):
+        if not self.groups:
+            return f'名称空间 {self.namespace} 第 {self.page} 页没有权限组'
+        lines = [f'名称空间 {self.namespace} 第 {self.page} 页：']
+        lines.extend(f'  {name}（{rules} 项描述，继承 {inherits} 个组）' for name, rules, inherits in self.groups)
+        if self.has_more:
+            lines.append('还有下一页')
+        return '\n'.join(lines)
+
+
+class GroupInfo(NamedTuple):
+    """
+    一个权限组的内容。
+    """
+
+    name: str
+    """
+    限定名。
+    """
+
+    permissions: List[str]
+    """
+    直接包含的权限描述，撤销描述带有"-"前缀。
+    """
+
+    inherits: List[str]
+    """
+    直接继承的权限组的限定名，包括合并后的插件预设组。
+    """
+
+    expires: Dict[str, float]
+    """
+    有期限的权限描述及其到期时间戳。
+    """
+
+    overlay: List[str]
+    """
+    临时覆盖层中的权限描述。
+    """
+
+    effective: List[Tuple[str, str]]
+    """
+    本组及其直接或间接继承的组中实际生效的权限描述，元素为 (权限描述, 所在权限组的限定名) 。被撤销描述覆盖的授予描述不会列出。
+    """
+
+    def __str__(self):
+        lines = [f'权限组 {self.name}']
+        for title, items in (('权限描述', [self._with_expiry(x) for x in self.permissions]),
+                             ('继承', self.inherits),
+                             ('临时覆盖层', self.overlay),
+                             ('生效的描述', [x if src == self.name else f'{x}（来自 {src}）'
+                                        for x, src in self.effective])):
+            if not items:
+                continue
+            lines.append(f'{title}：{len(items)} 项')
+            lines.extend('  ' + x for x in items[:SHOWN_ITEMS])
+            if len(items) > SHOWN_ITEMS:
+                lines.append('  ……')
+        return '\n'.join(lines)
+
+    def _with_expiry(self, item: str) -> str:
+        deadline = self.expires.get(item)
+        if deadline is None:
+            return item
+        return f'{item}（至 {datetime.fromtimestamp(deadline):%Y-%m-%d %H:%M:%S}）'
+
+
+def list_groups(namespace: str, page: int = 1, page_size: int = SHOWN_ITEMS) -> GroupPage:
+    """
+    分页列出名称空间中的权限组。只遍历配置中的组名，不加载权限组，耗时只与页码和每页数量有关。
+
+    :param namespace: 名称空间。
+    :param page: 页码，从 1 开始。
+    :param page_size: 每页数量。
+    :return: 一页权限组。
+    :raise ValueError: 页码或每页数量小于 1 。
+    """
+    if page < 1 or page_size < 1:
+        raise ValueError('Page and page size must be positive')
+    config = get_namespace(namespace, False).config
+    start = (page - 1) * page_size
+    names = list(islice(iter(config), start, start + page_size + 1))
+    groups = []
+    for name in names[:page_size]:
+        desc = config.get(name)
+        if not isinstance(desc, dict):
+            desc = {}
+        groups.append((name, _count(desc.get('permissions')), _count(desc.get('inherits'))))
+    return GroupPage(namespace, page, groups, len(names) > page_size)
+
+
+def _count(value) -> int:
+    return len(value) if isinstance(value, list) else 0
+
+
+def show_group(namespace: str, name: Union[str, int]) -> Optional[GroupInfo]:
+    """
+    获取权限组的内容及实际生效的权限描述。只加载该组及其继承的组。
+
+    :param namespace: 名称空间。
+    :param name: 组名。
+    :return: 权限组内容，若权限组不存在则返回 None 。
+    """
+    group = get(namespace, name)
+    if not group.is_valid:
+        return None
+    state = group.state
+    permissions = sorted(state.allows) + sorted('-' + x for x in state.denies)
+    layer = overlay.get_overlay(namespace, name)
+    overlay_items = [] if layer is None else sorted(layer.allows) + sorted('-' + x for x in layer.denies)
+    return GroupInfo(group.qualified_name(), permissions, [x.qualified_name() for x in state.inherits],
+                     dict(state.expiry), overlay_items, _effective(group))
+
+
+def _effective(group: PermissionGroup) -> List[Tuple[str, str]]:
+    # 收集本组及所有祖先的描述，逐项检查它是否就是决定同名权限的那一项
+    items = set()
+    visited = set()
+    pending = [group]
+    while pending:
+        current = pending.pop()
+        if current in visited:
+            continue
+        visited.add(current)
+        items.update(current.allows)
+        items.update('-' + x for x in current.denies)
+        pending.extend(current.inherits)
+    effective = []
+    for item in sorted(items):
+        decision = explain_group(group, item.lstrip('-'))
+        if decision is not None and decision.rule == item:
+            effective.append((item, decision.path[-1].qualified_name()))
+    return effective
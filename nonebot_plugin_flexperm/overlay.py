@@ -0,0 +1,153 @@
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple, Union
+
+from . import audit
+from .core import Namespace, PermissionGroup, parse_subject_name
+from .expiry import schedule_expiry
+
+OverlayKey = Tuple[str, Union[str, int, Tuple[str, str]]]
+
+# 检查时直接用到的 global 名称空间中的权限组，与 check.iterate_groups 一致
+CHAIN_GROUPS = frozenset({'superuser', 'anyone', 'group_admin', 'group_owner', 'group', 'private'})
+
+# 覆盖层不属于任何配置文件，共用一个无路径、不可修改的名称空间
+_namespace = Namespace('overlay', None, required=False, modifiable=False)
+
+
+class OverlayGroup(PermissionGroup):
+    """
+    临时覆盖层，只存在于内存中。
+
+    检查时排在对应权限组之前，因此其中的描述优先于对应权限组（及其继承的组）。修改只替换本层的版本，不写入配置文件或修改日志，重新加载后仍然保留。
+    """
+
+    def __init__(self, key: OverlayKey, target: str):
+        super().__init__(_namespace, target)
+        self.key = key
+
+    def qualified_name(self):
+        return f'{self.name}[overlay]'
+
+    def expire(self, item: str):
+        self._publish(self.state.without_item(item))
+        _drop_if_empty(self)
+
+
+overlays: Dict[OverlayKey, OverlayGroup] = {}
+"""
+各权限组的覆盖层，键见 overlay_key 。没有覆盖层时检查不做额外的查找。
+"""
+
+
+def overlay_key(namespace: str, name: Union[str, int]) -> OverlayKey:
+    """
+    :param namespace: 名称空间。
+    :param name: 组名。用户和群组的不同写法（如 10001 和 "onebot:10001"）对应同一个键。
+    :return: 覆盖层的键。
+    """
+    if namespace in ('user', 'group'):
+        subject = parse_subject_name(name)
+        if subject is not None:
+            return namespace, subject
+    return namespace, name
+
+
+def get_overlay(namespace: str, name: Union[str, int]) -> Optional[OverlayGroup]:
+    """
+    :param namespace: 名称空间。
+    :param name: 组名。
+    :return: 覆盖层，没有则返回 None 。
+    """
+    return overlays.get(overlay_key(namespace, name))
+
+
+def add(namespace: str, name: Union[str, int], item: str, expires: datetime = None) -> bool:
+    """
+    向覆盖层添加权限描述，同时移除相反的描述。覆盖层不存在时创建。
+
+    :param namespace: 名称空间。
+    :param name: 组名。
+    :param item: 权限描述。
+    :param expires: 到期时间，不带时区的本地时间。为 None 表示一直有效，直到移除或重启。
+    :return: 是否确实更改了，如果已有相同期限的同一描述则返回 False 。
+    :raise ValueError: 权限组不是检查时直接用到的组，其覆盖层不会生效。
+    """
+    key = overlay_key(namespace, name)
+    if not _in_chain(key):
+        raise ValueError(f'Overlay on {namespace}:{name} would have no effect: '
+                         'only user, group and default global groups are checked directly')
+    group = overlays.get(key)
+    if group is None:
+        group = overlays[key] = OverlayGroup(key, f'{namespace}:{name}')
+    state = group.state
+    deadline = expires and expires.timestamp()
+    if _contains(group, item) and state.expiry.get(item) == deadline:
+        return False
+    opposite = item[1:] if item.startswith('-') else '-' + item
+    if _contains(group, opposite):
+        state = state.without_item(opposite)
+    group._publish(state.with_item(item, deadline))
+    if audit.enabled:
+        audit.record_edit(namespace, ['overlay_add', name, item, expires])
+    if deadline is not None:
+        if deadline <= time.time():
+            group.expire(item)
+        else:
+            schedule_expiry(group, item, deadline)
+    return True
+
+
+def remove(namespace: str, name: Union[str, int], item: str) -> bool:
+    """
+    从覆盖层移除权限描述。覆盖层变空时一并移除。
+
+    :param namespace: 名称空间。
+    :param name: 组名。
+    :param item: 权限描述。
+    :return: 是否确实移除了。
+    """
+    group = get_overlay(namespace, name)
+    if group is None or not _contains(group, item):
+        return False
+    group.expire(item)
+    if audit.enabled:
+        audit.record_edit(namespace, ['overlay_remove', name, item])
+    return True
+
+
+def clear(namespace: str = None, name: Union[str, int] = None) -> int:
+    """
+    移除覆盖层。
+
+    :param namespace: 名称空间，为 None 则移除所有覆盖层。
+    :param name: 组名，为 None 则移除名称空间内的所有覆盖层。
+    :return: 移除的覆盖层数量。
+    """
+    if namespace is None:
+        keys = list(overlays)
+    elif name is None:
+        keys = [k for k in overlays if k[0] == namespace]
+    else:
+        keys = [overlay_key(namespace, name)]
+    # 权限组链不再包含被移除的层，签名随之改变，无需清理检查结果缓存
+    return sum(overlays.pop(key, None) is not None for key in keys)
+
+
+def _in_chain(key: OverlayKey) -> bool:
+    namespace, name = key
+    if namespace in ('user', 'group'):
+        return isinstance(name, tuple)
+    return namespace == 'global' and name in CHAIN_GROUPS
+
+
+def _contains(group: PermissionGroup, item: str) -> bool:
+    if item.startswith('-'):
+        return item[1:] in group.state.denies
+    return item in group.state.allows
+
+
+def _drop_if_empty(group: OverlayGroup):
+    state = group.state
+    if not state.allows and not state.denies and overlays.get(group.key) is group:
+        del overlays[group.key]
@@ -0,0 +1,127 @@
+from typing import Dict, FrozenSet, Iterable, Optional, Sequence, Tuple
+
+
+def is_extended_pattern(item: str) -> bool:
+    """
+    是否为扩展通配描述，即含有"**"，或在最后一段以外含有单独的星号。只在末尾含有星号的描述按原有方式匹配。
+
+    :param item: 权限描述（不含"-"前缀）。
+    """
+    if '*' not in item:
+        return False
+    segments = item.split('.')
+    return '**' in segments or '*' in segments[:-1]
+
+
+class _Node:
+    __slots__ = ('children', 'star', 'globstar', 'loop', 'pattern')
+
+    def __init__(self, loop: bool = False):
+        self.children: Dict[str, _Node] = {}
+        self.star: Optional[_Node] = None
+        """
+        经过"*"到达的节点，匹配恰好一段。
+        """
+        self.globstar: Optional[_Node] = None
+        """
+        经过"**"到达的节点，匹配零或多段。
+        """
+        self.loop = loop
+        """
+        是否可以继续消耗任意段而停留在本节点，即是否由"**"到达。
+        """
+        self.pattern: Optional[str] = None
+        """
+        在本节点结束的描述。
+        """
+
+
+_State = FrozenSet[_Node]
+
+
+class PatternTrie:
+    """
+    一组扩展通配描述编译成的前缀树，以段为边，"*"和"**"为通配边。
+
+    匹配时同时推进所有可能的节点，并把 (节点集合, 段) 到下一节点集合的转移缓存起来，相当于按需构造确定自动机。
+    耗时与权限的段数成正比，与描述数量无关。
+    """
+
+    transition_limit = 1024
+
+    def __init__(self, patterns: Iterable[str]):
+        self.root = _Node()
+        for pattern in patterns:
+            self._insert(pattern)
+        self._start = self._closure([self.root])
+        self._transitions: Dict[Tuple[_State, str], _State] = {}
+
+    @classmethod
+    def compile(cls, items: Iterable[str]) -> Optional["PatternTrie"]:
+        """
+        :param items: 权限描述集合（不含"-"前缀）。
+        :return: 其中的扩展通配描述编译成的前缀树，没有扩展通配描述时返回 None 。
+        """
+        patterns = [item for item in items if is_extended_pattern(item)]
+        return cls(patterns) if patterns else None
+
+    def _insert(self, pattern: str):
+        segments = pattern.split('.')
+        if segments[-1] == '*':
+            segments[-1] = '**'  # 末尾的星号匹配本身及所有子权限
+        node = self.root
+        for segment in segments:
+            if segment == '**':
+                if node.globstar is None:
+                    node.globstar = _Node(loop=True)
+                node = node.globstar
+            elif segment == '*':
+                if node.star is None:
+                    node.star = _Node()
+                node = node.star
+            else:
+                node = node.children.setdefault(segment, _Node())
+        if node.pattern is None or len(pattern) < len(node.pattern):
+            node.pattern = pattern
+
+    @staticmethod
+    def _closure(nodes: Iterable[_Node]) -> _State:
+        result = set()
+        for node in nodes:
+            while node is not None and node not in result:
+                result.add(node)
+                node = node.globstar
+        return frozenset(result)
+
+    def _step(self, state: _State, segment: str) -> _State:
+        key = state, segment
+        try:
+            return self._transitions[key]
+        except KeyError:
+            pass
+        following = []
+        for node in state:
+            if node.loop:
+                following.append(node)
+            if (child := node.children.get(segment)) is not None:
+                following.append(child)
+            if node.star is not None:
+                following.append(node.star)
+        result = self._closure(following)
+        if len(self._transitions) >= self.transition_limit:
+            self._transitions.clear()
+        self._transitions[key] = result
+        return result
+
+    def match(self, segments: Sequence[str]) -> Optional[str]:
+        """
+        :param segments: 权限按"."拆分后的各段。
+        :return: 匹配的描述，有多个时返回最长的；没有则返回 None 。
+        """
+        state = self._start
+        for segment in segments:
+            state = self._step(state, segment)
+            if not state:
+                return None
+        patterns = [node.pattern for node in state if node.pattern is not None]
+        return max(patterns, key=lambda p: (len(p), p)) if patterns else None
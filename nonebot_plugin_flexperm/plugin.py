@@ -1,16 +1,25 @@
 import contextlib
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Dict, Union, Tuple
+from typing import Optional, Dict, Union, Tuple, Set
 
 from nonebot.adapters import Bot, Event
 from nonebot.log import logger
 from nonebot.matcher import current_bot, current_event
 from nonebot.permission import Permission
 
-from .check import check, get_permission_group_by_event
-from .core import get, get_namespace, PermissionGroup, decorate_permission, parse_qualified_group_name
+from . import listing, overlay
+from .check import check, explain, get_permission_group_by_event
+from .explain import Explanation
+from .expiry import normalize_expires
+from .core import get, get_namespace, PermissionGroup, PermissionHandle, decorate_permission, \
+    parse_qualified_group_name
 
 plugins: Dict[str, "PluginHandler"] = {}
+registered_permissions: Set[str] = set()
+"""
+通过 PluginHandler.__call__ 创建过检查器的权限。
+"""
 
 _sentinel = object()
 Designator = Union[Event, str, None]
@@ -61,6 +70,18 @@ class PluginHandler:
         self.check_root_ = True
         return self
 
+    def perm(self, perm: str) -> PermissionHandle:
+        """
+        创建权限句柄。会修饰权限名，详见 __call__ 。
+
+        句柄可以代替权限名传给 __call__ 、 has 等接口，不会被再次修饰。在频繁调用的地方使用句柄可以省去每次修饰和拆分权限名的开销。
+
+        :param perm: 权限名。
+        :return: 权限句柄。
+        """
+        [full] = decorate_permission(self.name, [perm])
+        return PermissionHandle(full)
+
     def __call__(self, *perm: str, check_root: bool = _sentinel) -> Permission:
         """
         创建权限检查器。若设置了 check_root ，则除了传入的权限外，还会检查本插件的根权限。
@@ -72,7 +93,9 @@ class PluginHandler:
         - 以"."开头的，在开头添加前一个权限名的修饰结果。若指定的第一个权限名就以"."开头，则添加插件名。
         - 否则，在开头添加 插件名+"." 。
 
-        :param perm: 权限名，若传入多个权限则须同时满足。
+        传入的权限句柄不会被修饰。
+
+        :param perm: 权限名或权限句柄，若传入多个权限则须同时满足。
         :param check_root: 如果传入布尔值，则替代之前 self.check_root() 的设定。
         :return: 权限检查器，可以直接传递给 nonebot 事件响应器。
         """
@@ -81,6 +104,8 @@ class PluginHandler:
             check_root = self.check_root_
         if check_root:
             full.insert(0, self.name)
+        full = [PermissionHandle(x) for x in full]
+        registered_permissions.update(full)
 
         if len(full) == 1:
             single = full[0]
@@ -97,7 +122,7 @@ class PluginHandler:
         """
         检查事件是否具有指定权限。会修饰权限名，详见 __call__ 。不会自动检查根权限，无论是否设置 check_root 。
 
-        :param perm: 权限名，若传入多个权限则须同时满足。
+        :param perm: 权限名或权限句柄，若传入多个权限则须同时满足。
         :param bot: 机器人，默认为当前正在处理事件的机器人。
         :param event: 事件，默认为当前正在处理的事件。
         :return: 检查结果。
@@ -109,8 +134,25 @@ class PluginHandler:
         full = decorate_permission(self.name, perm)
         return all(check(bot, event, px) for px in full)
 
+    def explain(self, perm: str, bot: Bot = None, event: Event = None) -> Explanation:
+        """
+        检查事件是否具有指定权限，并返回检查过程。会修饰权限名，详见 __call__ 。不使用缓存，仅用于诊断。
+
+        :param perm: 权限名或权限句柄。
+        :param bot: 机器人，默认为当前正在处理事件的机器人。
+        :param event: 事件，默认为当前正在处理的事件。
+        :return: 检查过程，转换为字符串即可得到便于阅读的说明。
+        """
+        if bot is None or event is None:
+            bot = current_bot.get()
+        if event is None:
+            event = current_event.get()
+        [full] = decorate_permission(self.name, [perm])
+        return explain(bot, event, full)
+
     def add_permission(self, designator: Designator, perm: str = _sentinel, *,
-                       comment: str = None, create_group: bool = True) -> bool:
+                       comment: str = None, create_group: bool = True,
+                       expires: Union[datetime, timedelta, float, None] = None) -> bool:
         """
         向权限组添加一项权限。会修饰权限名。
 
@@ -120,7 +162,8 @@ class PluginHandler:
         :param perm: 权限名。
         :param comment: 注释。
         :param create_group: 如果权限组不存在，是否自动创建。
-        :return: 是否确实更改了，如果权限组中已有指定"授予"权限描述则返回 False 。
+        :param expires: 到期时间，或从现在起的有效时长（timedelta 或秒数）。为 None 表示长期有效。
+        :return: 是否确实更改了，如果权限组中已有期限相同的"授予"权限描述则返回 False 。已有该描述但期限不同时改为新的期限。
         :raise KeyError: 权限组不存在，并且指定为不自动创建。
         :raise TypeError: 权限组不可修改。
         """
@@ -132,7 +175,7 @@ class PluginHandler:
         with contextlib.suppress(ValueError):
             group_.remove('-' + perm)
         try:
-            group_.add(perm, comment)
+            group_.add(perm, comment, normalize_expires(expires))
             return True
         except ValueError:
             return False
@@ -148,7 +191,7 @@ class PluginHandler:
         :param perm: 权限名。
         :param comment: 注释。
         :param create_group: 如果权限组不存在，是否自动创建。
-        :return: 是否确实更改了，如果权限组中已有指定"撤销"权限描述则返回 False 。
+        :return: 是否确实更改了，如果权限组中已有长期有效的"撤销"权限描述则返回 False 。已有的"撤销"描述有期限时改为长期有效。
         :raise KeyError: 权限组不存在，并且指定为不自动创建。
         :raise TypeError: 权限组不可修改。
         """
@@ -198,7 +241,8 @@ class PluginHandler:
         return modified
 
     def add_item(self, designator: Designator, item: str = _sentinel, *,
-                 comment: str = None, create_group: bool = True) -> bool:
+                 comment: str = None, create_group: bool = True,
+                 expires: Union[datetime, timedelta, float, None] = None) -> bool:
         """
         向权限组添加权限描述。会修饰权限名。
 
@@ -206,7 +250,8 @@ class PluginHandler:
         :param item: 权限描述。
         :param comment: 注释。
         :param create_group: 如果权限组不存在，是否自动创建。
-        :return: 是否确实添加了，如果权限组中已有指定描述则返回 False 。
+        :param expires: 到期时间，或从现在起的有效时长（timedelta 或秒数）。为 None 表示长期有效。
+        :return: 是否确实更改了，如果权限组中已有期限相同的指定描述则返回 False 。已有该描述但期限不同时改为新的期限。
         :raise KeyError: 权限组不存在，并且指定为不自动创建。
         :raise TypeError: 权限组不可修改。
         """
@@ -214,13 +259,9 @@ class PluginHandler:
             designator, item = None, designator
 
         group_ = self._get_or_create_group(designator, create_group, True)
-        if item.startswith('-'):
-            [item] = decorate_permission(self.name, [item[1:]])
-            item = '-' + item
-        else:
-            [item] = decorate_permission(self.name, [item])
+        item = self._decorate_item(item)
         try:
-            group_.add(item, comment)
+            group_.add(item, comment, normalize_expires(expires))
             return True
         except ValueError:
             return False
@@ -243,17 +284,53 @@ class PluginHandler:
         group_ = self._get_or_create_group(designator, allow_missing, False)
         if group_ is None:
             return False
-        if item.startswith('-'):
-            [item] = decorate_permission(self.name, [item[1:]])
-            item = '-' + item
-        else:
-            [item] = decorate_permission(self.name, [item])
+        item = self._decorate_item(item)
         try:
             group_.remove(item)
             return True
         except ValueError:
             return False
 
+    def add_overlay(self, designator: Designator, item: str = _sentinel, *,
+                    expires: Union[datetime, timedelta, float, None] = None) -> bool:
+        """
+        向权限组的临时覆盖层添加权限描述，同时移除相反的描述。会修饰权限名。
+
+        覆盖层只保存在内存中，不修改配置文件，重启后丢失。检查时覆盖层优先于对应权限组，权限组不存在时也可以使用。
+
+        :param designator: 权限组指示符。
+        :param item: 权限描述。
+        :param expires: 到期时间，或从现在起的有效时长（timedelta 或秒数）。为 None 表示一直有效。
+        :return: 是否确实更改了，如果覆盖层中已有相同期限的同一描述则返回 False 。
+        :raise ValueError: 权限组不是用户、群组或 global 名称空间的默认权限组，其覆盖层不会生效。
+        """
+        if item is _sentinel:
+            designator, item = None, designator
+
+        namespace, group_name = self._parse_designator(designator)
+        return overlay.add(namespace, group_name, self._decorate_item(item), normalize_expires(expires))
+
+    def remove_overlay(self, designator: Designator, item: str = _sentinel) -> bool:
+        """
+        从权限组的临时覆盖层移除权限描述。会修饰权限名。
+
+        :param designator: 权限组指示符。
+        :param item: 权限描述。
+        :return: 是否确实移除了，如果覆盖层中没有指定描述则返回 False 。
+        """
+        if item is _sentinel:
+            designator, item = None, designator
+
+        namespace, group_name = self._parse_designator(designator)
+        return overlay.remove(namespace, group_name, self._decorate_item(item))
+
+    def _decorate_item(self, item: str) -> str:
+        if item.startswith('-'):
+            [item] = decorate_permission(self.name, [item[1:]])
+            return '-' + item
+        [item] = decorate_permission(self.name, [item])
+        return item
+
     def add_inheritance(self, designator: Designator, target: Designator = _sentinel, *,
                         comment: str = None, create_group: bool = True) -> bool:
         """
@@ -330,6 +407,30 @@ class PluginHandler:
         namespace, group = cls._parse_designator(designator)
         get_namespace(namespace, False).remove_group(group, force)
 
+    @classmethod
+    def list_groups(cls, namespace: str = 'global', page: int = 1, page_size: int = 20) -> listing.GroupPage:
+        """
+        分页列出名称空间中的权限组。只遍历配置中的组名，不加载权限组。
+
+        :param namespace: 名称空间。
+        :param page: 页码，从 1 开始。
+        :param page_size: 每页数量。
+        :return: 一页权限组，转换为字符串即可得到便于阅读的列表。
+        :raise ValueError: 页码或每页数量小于 1 。
+        """
+        return listing.list_groups(namespace, page, page_size)
+
+    @classmethod
+    def show_group(cls, designator: Designator = None) -> Optional[listing.GroupInfo]:
+        """
+        获取权限组的内容，包括直接包含的权限描述、继承关系、临时覆盖层和实际生效的权限描述。
+
+        :param designator: 权限组指示符。
+        :return: 权限组内容，转换为字符串即可得到便于阅读的说明。若权限组不存在则返回 None 。
+        """
+        namespace, group = cls._parse_designator(designator)
+        return listing.show_group(namespace, group)
+
     @classmethod
     def _parse_designator(cls, designator: Designator, default_namespace: str = 'global'
                           ) -> Tuple[str, Union[str, int]]:
@@ -0,0 +1,161 @@
+import time
+from collections import deque
+from typing import Any, Dict, List, NamedTuple, Sequence
+
+from .config import c
+
+
+class Hook:
+    """
+    性能钩子。通过 add_hook 注册后，每次检查权限、获取权限组、保存名称空间完成时调用相应方法，默认不做任何事。
+
+    没有注册钩子时不会计时，也不会收集下列参数。钩子在调用方的线程中同步执行，应尽快返回。
+    """
+
+    def on_check(self, elapsed: float, perm: str, chain: Sequence[Any], chain_hit: bool,
+                 group_hits: Sequence[bool], result: bool):
+        """
+        :param elapsed: 耗时（秒），包括确定权限组链的时间。
+        :param perm: 权限。
+        :param chain: 依次检查的权限组链。
+        :param chain_hit: 是否命中了检查结果缓存。
+        :param group_hits: 检查前各权限组的缓存中是否已有该权限。
+        :param result: 检查结果。
+        """
+
+    def on_get_group(self, elapsed: float, namespace: Any, name: Any, loaded: bool):
+        """
+        :param elapsed: 耗时（秒），包括加载继承的权限组的时间。
+        :param namespace: 名称空间。
+        :param name: 组名。
+        :param loaded: 是否进行了加载，为 False 表示权限组已在内存中。
+        """
+
+    def on_save(self, elapsed: float, namespace: Any, dirty: bool):
+        """
+        :param elapsed: 耗时（秒）。
+        :param namespace: 名称空间。
+        :param dirty: 保存前是否有修改。
+        """
+
+
+hooks: List[Hook] = []
+"""
+已注册的钩子。
+"""
+
+
+def add_hook(hook: Hook):
+    """
+    注册钩子。
+
+    :param hook: 钩子。
+    """
+    if hook not in hooks:
+        hooks.append(hook)
+
+
+def remove_hook(hook: Hook):
+    """
+    注销钩子。
+
+    :param hook: 钩子。
+    """
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+class SlowSample(NamedTuple):
+    """
+    一次慢操作的记录。
+    """
+
+    time: float
+    """
+    操作完成的时间戳。
+    """
+
+    op: str
+    """
+    操作，"check"、"get_group" 或 "save" 。
+    """
+
+    elapsed: float
+    """
+    耗时（秒）。
+    """
+
+    target: str
+    """
+    检查的权限，或权限组、名称空间名。
+    """
+
+    detail: Dict[str, Any]
+    """
+    权限组链、缓存状态等附加信息。
+    """
+
+    def __str__(self):
+        stamp = time.strftime('%H:%M:%S', time.localtime(self.time))
+        detail = ', '.join(f'{k}={v}' for k, v in self.detail.items())
+        return f'{stamp} {self.op} {self.target} {self.elapsed * 1000:.2f}ms {detail}'
+
+
+def _name(group: Any) -> str:
+    return group.qualified_name() if group.is_valid else '(空)'
+
+
+class SlowSampler(Hook):
+    """
+    记录耗时超过阈值的操作，只保留最近的若干条。
+    """
+
+    def __init__(self, threshold: float, capacity: int):
+        """
+        :param threshold: 阈值（秒）。
+        :param capacity: 最多保留的记录数。
+        """
+        self.threshold = threshold
+        self.samples: "deque[SlowSample]" = deque(maxlen=capacity)
+
+    def _record(self, op: str, elapsed: float, target: str, detail: Dict[str, Any]):
+        self.samples.append(SlowSample(time.time(), op, elapsed, target, detail))
+
+    def on_check(self, elapsed, perm, chain, chain_hit, group_hits, result):
+        if elapsed >= self.threshold:
+            self._record('check', elapsed, str(perm), {
+                'result': result,
+                'chain': [_name(g) for g in chain],
+                'chain_hit': chain_hit,
+                'group_hits': list(group_hits),
+            })
+
+    def on_get_group(self, elapsed, namespace, name, loaded):
+        if elapsed >= self.threshold:
+            self._record('get_group', elapsed, f'{namespace.name}:{name}', {
+                'loaded': loaded,
+                'groups': len(namespace.groups),
+            })
+
+    def on_save(self, elapsed, namespace, dirty):
+        if elapsed >= self.threshold:
+            self._record('save', elapsed, namespace.name, {'dirty': dirty})
+
+    def dump(self, clear: bool = False) -> List[SlowSample]:
+        """
+        :param clear: 是否同时清空记录。
+        :return: 当前保留的记录，从旧到新。
+        """
+        samples = list(self.samples)
+        if clear:
+            self.samples.clear()
+        return samples
+
+
+sampler = SlowSampler(c.flexperm_slow_threshold / 1000, c.flexperm_slow_capacity)
+"""
+内置的慢操作采样器，设置了 flexperm_slow_threshold 时自动注册。
+"""
+
+if c.flexperm_slow_threshold > 0:
+    add_hook(sampler)
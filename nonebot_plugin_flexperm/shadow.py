@@ -0,0 +1,302 @@
+import asyncio
+import contextlib
+import random
+import time
+from datetime import datetime
+from typing import Optional, Sequence, Set, Tuple, Union
+
+from nonebot.log import logger
+
+from .config import c
+from .core import CheckResult, GroupDesc, Namespace, PermissionGroup, PermissionHandle, Registry
+
+
+class ShadowStats:
+    """
+    影子检查的统计数据。
+    """
+
+    def __init__(self):
+        self.checked = 0
+        self.diverged = 0
+        self.skipped = 0
+        """
+        复查前权限组已被修改，因而跳过的次数。
+        """
+
+    def __repr__(self):
+        return f'<ShadowStats checked={self.checked} diverged={self.diverged} skipped={self.skipped}>'
+
+
+stats = ShadowStats()
+
+
+def reference_wildcard(item: str, set_: Set[str]) -> bool:
+    """
+    最直接的通配描述匹配算法，逐项与描述比较，作为各种优化的对照。
+    """
+    if item in set_:
+        return True
+    segments = item.split('.')
+    for pattern in set_:
+        expected = pattern.split('.')
+        if expected[-1] == '*':
+            expected[-1] = '**'
+        if _reference_match(expected, segments):
+            return True
+    return False
+
+
+def _reference_match(pattern: Sequence[str], segments: Sequence[str]) -> bool:
+    if not pattern:
+        return not segments
+    head, rest = pattern[0], pattern[1:]
+    if head == '**':
+        return any(_reference_match(rest, segments[i:]) for i in range(len(segments) + 1))
+    if not segments:
+        return False
+    if head == '*' or head == segments[0]:
+        return _reference_match(rest, segments[1:])
+    return False
+
+
+class _Unverifiable(Exception):
+    pass
+
+
+def reference_group(group: PermissionGroup, perm: str, now: float = None) -> Optional[CheckResult]:
+    """
+    不使用缓存，直接按配置中的原始描述逐层检查权限组对指定权限的说明。
+
+    不读取编译好的 GroupState ，而是自行处理继承、插件预设、自动修饰和到期时间，因此也能发现这些环节的错误。
+    覆盖层没有对应的配置，按其内容检查。
+
+    :param group: 权限组。
+    :param perm: 权限。
+    :param now: 判断是否到期所用的时间戳，默认为 time.time() 。
+    :raise _Unverifiable: 继承的名称空间尚未加载，无法对照。
+    """
+    if group.state is None:
+        return None
+    if now is None:
+        now = time.time()
+    if group.namespace.registry is None:
+        # 覆盖层只存在于内存中
+        if reference_wildcard(perm, group.state.denies):
+            return CheckResult.DENY
+        if reference_wildcard(perm, group.state.allows):
+            return CheckResult.ALLOW
+        return None
+    return _reference_desc(group.namespace.registry, group.namespace.name, group.name, perm, now, ())
+
+
+def _reference_desc(registry: Registry, namespace: str, name: Union[str, int], perm: str, now: float,
+                    path: Tuple[Tuple[str, Union[str, int]], ...]) -> Optional[CheckResult]:
+    if (namespace, name) in path:
+        return None  # 继承成环，正常检查时该继承关系被忽略
+    path += (namespace, name),
+    ns = registry.loaded.get(namespace)
+    if ns is None:
+        raise _Unverifiable(namespace)
+    desc = ns.config.get(name)
+    if not isinstance(desc, dict) or not {'permissions', 'inherits', 'expires'}.issuperset(desc):
+        return None  # 不合法的描述加载为空组
+    permissions = desc.get('permissions', [])
+    inherits = desc.get('inherits', [])
+    if not isinstance(permissions, list) or not isinstance(inherits, list):
+        return None
+
+    expires = desc.get('expires') or {}
+    allows, denies = set(), set()
+    for item in permissions:
+        deadline = expires.get(item)
+        if deadline is not None:
+            if not isinstance(deadline, datetime):
+                deadline = datetime.fromisoformat(str(deadline))  # 快照中为字符串
+            if deadline.timestamp() <= now:
+                continue
+        target = denies if item.startswith('-') else allows
+        if item.startswith('-'):
+            item = item[1:]
+        if ns.auto_decorate:
+            if not item:
+                item = ns.name
+            elif item.startswith('/'):
+                item = item[1:]
+            elif item.startswith('.'):
+                item = ns.name + item
+            else:
+                item = f'{ns.name}.{item}'
+        target.add(item)
+    if reference_wildcard(perm, denies):
+        return CheckResult.DENY
+    if reference_wildcard(perm, allows):
+        return CheckResult.ALLOW
+
+    parents = []
+    for parent in inherits:
+        parent_ns, _, parent_name = parent.partition(':') if ':' in parent else (namespace, '', parent)
+        if parent_ns in ('user', 'group'):
+            with contextlib.suppress(ValueError):
+                parent_name = int(parent_name)
+        parents.append((parent_ns, parent_name))
+    if namespace == 'global' and name in registry.default_groups:
+        parents.extend((pn.name, name) for pn in registry.plugin_namespaces if name in pn.config)
+
+    allowed = False
+    for parent_ns, parent_name in parents:
+        r = _reference_desc(registry, parent_ns, parent_name, perm, now, path)
+        if r == CheckResult.DENY:
+            return r
+        elif r == CheckResult.ALLOW:
+            allowed = True
+    if allowed:
+        return CheckResult.ALLOW
+
+
+def reference_chain(chain: Sequence[PermissionGroup], perm: str, now: float = None) -> bool:
+    """
+    不使用缓存，依次检查权限组链。
+    """
+    for group in chain:
+        r = reference_group(group, perm, now)
+        if r is not None:
+            return r == CheckResult.ALLOW
+    return False
+
+
+MAX_PENDING = 64
+"""
+最多同时等待复查的检查数，超出时放弃新的抽样，避免复查跟不上时积压。
+"""
+
+_pending = 0
+
+
+def sample(chain: Sequence[PermissionGroup], perm: str, result: bool):
+    """
+    按 flexperm_shadow_rate 抽样，在线程池中用对照算法复查一次检查结果，不占用事件循环。
+
+    :param chain: 检查的权限组链。
+    :param perm: 权限。
+    :param result: 检查结果。
+    """
+    global _pending
+    if random.random() >= c.flexperm_shadow_rate:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if _pending >= MAX_PENDING:
+        stats.skipped += 1
+        return
+    states = tuple(group.state for group in chain)
+    _pending += 1
+    future = loop.run_in_executor(None, _verify, chain, states, str(perm), result, time.time())
+    future.add_done_callback(_done)
+
+
+def _done(future: "asyncio.Future[Optional[bool]]"):
+    # 在事件循环中更新统计数据，无需加锁
+    global _pending
+    _pending -= 1
+    try:
+        diverged = future.result()
+    except Exception as e:
+        _ = e
+        logger.exception('Shadow check failed')
+        return
+    if diverged is None:
+        stats.skipped += 1
+        return
+    stats.checked += 1
+    if diverged:
+        stats.diverged += 1
+
+
+def _verify(chain: Sequence[PermissionGroup], states: tuple, perm: str, result: bool, now: float
+            ) -> Optional[bool]:
+    """
+    :return: 是否不一致，复查前后权限组被修改而无法对照时为 None 。
+    """
+    def unchanged():
+        return all(group.state is state for group, state in zip(chain, states))
+
+    if not unchanged():
+        return None
+    try:
+        expected = reference_chain(chain, perm, now)
+    except (_Unverifiable, RuntimeError):
+        # 名称空间未加载，或配置在读取过程中被修改
+        return None
+    if not unchanged():
+        return None
+    if expected != result:
+        logger.error('Shadow check diverged on {}: got {}, expected {}, chain {}',
+                     perm, result, expected, list(chain))
+        return True
+    return False
+
+
+def fuzz(iterations: int = 1000, seed: int = None, groups: int = 12) -> int:
+    """
+    随机生成权限组继承关系和权限，对比正常检查与对照算法的结果。
+
+    :param iterations: 生成的权限组集合数量。
+    :param seed: 随机数种子。
+    :param groups: 每个集合中的权限组数量。
+    :return: 结果不一致的次数，不一致的情况会输出到日志。
+    """
+    from .check import check_chain
+    from .explain import explain_group
+
+    rng = random.Random(seed)
+    words = ['a', 'b', 'c', 'd']
+    diverged = 0
+
+    def random_perm():
+        return '.'.join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+
+    def random_item():
+        item = random_perm()
+        if rng.random() < 0.3:
+            item = item.rsplit('.', 1)[0] + '.*' if '.' in item else '*'
+        if rng.random() < 0.3:
+            segments = item.split('.')
+            segments[rng.randrange(len(segments))] = rng.choice(['*', '**'])
+            item = '.'.join(segments)
+        if rng.random() < 0.3:
+            item = '-' + item
+        return item
+
+    for _ in range(iterations):
+        registry = Registry()
+        ns = Namespace('fuzz', None, required=False, modifiable=False)
+        ns.registry = registry
+        registry.loaded['fuzz'] = ns
+        for i in range(groups):
+            ns.config[f'g{i}'] = GroupDesc.construct(
+                permissions=[random_item() for _ in range(rng.randint(0, 4))],
+                inherits=[f'g{j}' for j in rng.sample(range(i), min(i, rng.randint(0, 3)))],
+            ).dict()
+        all_groups = ns.load_groups()
+        chain = rng.sample(all_groups, min(3, len(all_groups)))
+        for _ in range(20):
+            perm = random_perm()
+            for candidate in (perm, PermissionHandle(perm)):
+                for group in all_groups:
+                    expected = reference_group(group, perm)
+                    explained = explain_group(group, candidate)
+                    got = group.check(candidate), explained and explained.result
+                    if got != (expected, expected):
+                        diverged += 1
+                        logger.error('Fuzz check diverged on {!r} in {}: got {}, expected {}, config {}',
+                                     candidate, group, got, expected, dict(ns.config))
+                expected = reference_chain(chain, perm)
+                got = check_chain(chain, candidate)
+                if got != expected:
+                    diverged += 1
+                    logger.error('Fuzz check diverged on {!r} in chain {}: got {}, expected {}, config {}',
+                                 candidate, chain, got, expected, dict(ns.config))
+    return diverged
@@ -0,0 +1,199 @@
+import contextlib
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, MutableMapping, Set, Tuple, Union
+
+from nonebot.log import logger
+
+from .core import Namespace, get_yaml, parse_subject_name
+from .journal import Record
+
+SHARD_COUNT = 256
+
+
+def shard_of_subject(subject: Tuple[str, str]) -> str:
+    """
+    :param subject: (适配器名, ID) 。
+    :return: 用户或群组所在的分片名，为两位十六进制数。
+    """
+    adapter, native_id = subject
+    return format(zlib.crc32(f'{adapter}:{native_id}'.encode()) % SHARD_COUNT, '02x')
+
+
+def shard_of(name: Union[str, int]) -> str:
+    """
+    :param name: 组名。同一用户或群组的不同写法位于同一分片。
+    :return: 权限组所在的分片名。
+    """
+    subject = parse_subject_name(name)
+    if subject is not None:
+        return shard_of_subject(subject)
+    return format(zlib.crc32(str(name).encode()) % SHARD_COUNT, '02x')
+
+
+class ShardedConfig(MutableMapping):
+    """
+    分片目录中的名称空间配置。每个分片是目录下的一个 YAML 文件，首次访问其中的权限组时才读取。
+
+    遍历会读取全部分片，只应在需要整个名称空间时使用。
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.shards: Dict[str, MutableMapping] = {}
+        self.dirty: Set[str] = set()
+        """
+        有尚未写入文件的修改的分片。
+        """
+
+    def shard(self, shard_id: str) -> MutableMapping:
+        """
+        :param shard_id: 分片名。
+        :return: 分片内容，尚未读取时读取。
+        """
+        data = self.shards.get(shard_id)
+        if data is None:
+            from ruamel.yaml import YAMLError, CommentedMap
+            path = self.directory / f'{shard_id}.yml'
+            data = CommentedMap()
+            if path.is_file():
+                try:
+                    doc = get_yaml().load(path)
+                except (OSError, YAMLError):
+                    logger.exception('Failed to load shard {}', path)
+                    doc = None
+                if isinstance(doc, CommentedMap):
+                    data = doc
+                elif doc is not None:
+                    logger.error('Expect a dict: {}', path)
+            self.shards[shard_id] = data
+        return data
+
+    def __getitem__(self, name: Union[str, int]) -> Any:
+        return self.shard(shard_of(name))[name]
+
+    def __setitem__(self, name: Union[str, int], value: Any):
+        shard_id = shard_of(name)
+        self.shard(shard_id)[name] = value
+        self.dirty.add(shard_id)
+
+    def __delitem__(self, name: Union[str, int]):
+        shard_id = shard_of(name)
+        del self.shard(shard_id)[name]
+        self.dirty.add(shard_id)
+
+    def __iter__(self) -> Iterator[Union[str, int]]:
+        for i in range(SHARD_COUNT):
+            yield from list(self.shard(format(i, '02x')))
+
+    def __len__(self) -> int:
+        return sum(len(self.shard(format(i, '02x'))) for i in range(SHARD_COUNT))
+
+    def load(self, name: Union[str, int], value: Any):
+        """
+        用从硬盘读取的内容替换权限组，不标记分片有修改。
+
+        :param name: 组名。
+        :param value: 权限组描述，为 None 表示已删除。
+        """
+        shard = self.shard(shard_of(name))
+        if value is None:
+            shard.pop(name, None)
+        else:
+            shard[name] = value
+
+    def yaml_add_eol_comment(self, comment: str, name: Union[str, int]):
+        self.shard(shard_of(name)).yaml_add_eol_comment(comment, name)
+
+    def save(self):
+        """
+        把有修改的分片写入文件，空分片删除文件。
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for shard_id in sorted(self.dirty):
+            path = self.directory / f'{shard_id}.yml'
+            data = self.shards[shard_id]
+            if data:
+                get_yaml().dump(data, path)
+            else:
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+        self.dirty.clear()
+
+
+class ShardedNamespace(Namespace):
+    """
+    以目录形式存储的名称空间，权限组按用户或群组分布在各分片文件中。按组名或用户查找时只读取相应的分片，保存时只重写有修改的分片。
+    """
+
+    config: ShardedConfig
+
+    def __init__(self, namespace: str, path: Path):
+        self._shard_subjects: Dict[str, Dict[Tuple[str, str], Union[str, int]]] = {}
+        super().__init__(namespace, path, required=False, modifiable=True)
+
+    @classmethod
+    def open(cls, namespace: str, path: Path) -> "ShardedNamespace":
+        """
+        打开分片目录。如果目录不存在而同名的单文件配置存在，先把单文件配置拆分到分片目录中。
+
+        :param namespace: 名称空间。
+        :param path: 分片目录。
+        """
+        source = path.with_name(f'{path.name}.yml')
+        if not path.exists() and source.is_file():
+            migrate(namespace, source, path)
+        return cls(namespace, path)
+
+    def _load_config(self, path: Path, required: bool) -> ShardedConfig:
+        return ShardedConfig(path)
+
+    def _write(self):
+        self.config.save()
+
+    def _config_signature(self) -> Any:
+        # 分片文件被改写不会改变目录本身，逐个查看分片
+        signature = []
+        for path in sorted(self.path.glob('*.yml')):
+            with contextlib.suppress(FileNotFoundError):
+                st = path.stat()
+                signature.append((path.name, st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(signature)
+
+    def _mark_dirty(self, record: Record):
+        self.dirty = True
+        self.config.dirty.add(shard_of(record[1]))
+
+    def _load_group_config(self, name: Union[str, int], desc: Any):
+        self.config.load(name, desc)
+
+    def _subject_index(self, subject: Tuple[str, str]) -> Dict[Tuple[str, str], Union[str, int]]:
+        shard_id = shard_of_subject(subject)
+        index = self._shard_subjects.get(shard_id)
+        if index is None:
+            index = self._shard_subjects[shard_id] = {}
+            for name in list(self.config.shard(shard_id)):
+                self._index_subject(name)
+        return index
+
+
+def migrate(namespace: str, source: Path, directory: Path):
+    """
+    把单文件配置拆分到分片目录中。原文件（及其修改日志中的修改）写入分片后改名为 <原文件名>.bak 保留。
+
+    :param namespace: 名称空间。
+    :param source: 单文件配置。
+    :param directory: 分片目录。
+    """
+    old = Namespace(namespace, source, required=True, modifiable=True)
+    config = ShardedConfig(directory)
+    comments = getattr(old.config, 'ca', None)
+    for name, desc in old.config.items():
+        config[name] = desc
+        if comments is not None and name in comments.items:
+            config.shard(shard_of(name)).ca.items[name] = comments.items[name]
+    config.save()
+    if old.journal:
+        old.journal.clear()
+    source.rename(source.with_name(source.name + '.bak'))
+    logger.info('Migrated namespace {} into {} shards under {}', namespace, len(config.shards), directory)
@@ -0,0 +1,245 @@
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, Optional, Dict, Iterator, List, Mapping, Tuple, Union
+
+from nonebot.log import logger
+
+from . import core
+from .config import c
+
+_header = struct.Struct('<8sQQ')
+_magic = b'FLEXPER2'
+
+
+def snapshot_path() -> Path:
+    return c.flexperm_snapshot_path or c.flexperm_base / '.snapshot'
+
+
+def _plain(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {k: _plain(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_plain(x) for x in obj]
+    return obj
+
+
+def compile_state() -> Tuple[Dict[str, Any], bytes]:
+    """
+    把当前进程的权限配置编译为快照内容。会加载配置目录下所有名称空间。
+
+    每个权限组描述单独编码，索引中只记录组名及描述在正文中的位置，读取方只需解码索引，用到某个权限组时再解码它的描述。
+
+    :return:
+        [0] 索引。 <br>
+        [1] 正文，即依次排列的各权限组描述。
+    """
+    registry = core.registry
+    for path in sorted(c.flexperm_base.glob('*.yml')):
+        registry.get_namespace(path.stem, False)
+    for name in c.flexperm_sharded:
+        registry.get_namespace(name, False)
+    body = bytearray()
+    namespaces = {}
+    for name, ns in registry.loaded.items():
+        groups = []
+        for k, v in ns.config.items():
+            blob = json.dumps(_plain(v), ensure_ascii=False, separators=(',', ':'), default=str).encode()
+            groups.append([k, len(body), len(blob)])
+            body += blob
+        namespaces[name] = {'decorate': ns.auto_decorate, 'groups': groups}
+    index = {
+        'namespaces': namespaces,
+        'plugins': [ns.name for ns in registry.plugin_namespaces],
+        'defaults': sorted(registry.default_groups),
+    }
+    return index, bytes(body)
+
+
+def read_generation(path: Path) -> int:
+    """
+    :return: 快照文件的版本号，不存在或无效时为 0 。
+    """
+    try:
+        with open(path, 'rb') as f:
+            magic, generation, _ = _header.unpack(f.read(_header.size))
+    except (OSError, struct.error):
+        return 0
+    return generation if magic == _magic else 0
+
+
+_published_revision = -1
+
+
+def _revision() -> int:
+    return sum(ns.revision for ns in core.registry.loaded.values())
+
+
+def publish() -> int:
+    """
+    编译并发布快照。先写入临时文件再替换，读取方不会看到写了一半的快照。
+
+    :return: 新快照的版本号。
+    """
+    global _published_revision
+    _published_revision = _revision()
+    path = snapshot_path()
+    index, body = compile_state()
+    index = json.dumps(index, ensure_ascii=False, separators=(',', ':'), default=str).encode()
+    generation = read_generation(path) + 1
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(_header.pack(_magic, generation, len(index)))
+        f.write(index)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    logger.debug('Published permission snapshot generation {}', generation)
+    return generation
+
+
+def publish_if_changed():
+    """
+    如果上次发布之后有过修改，则重新发布快照。
+    """
+    if _revision() != _published_revision:
+        publish()
+
+
+class MappedConfig(Mapping):
+    """
+    读取方名称空间的配置。权限组描述保留在映射的快照文件中，首次访问时才解码，多个读取方进程共用同一份页缓存。
+    """
+
+    def __init__(self, mm: mmap.mmap, base: int, groups: List[List[Any]]):
+        # 持有映射的引用，发布新版本后旧映射在不再被使用时才会关闭
+        self._mm = mm
+        self._base = base
+        self._index: Dict[Union[str, int], Tuple[int, int]] = {k: (offset, length) for k, offset, length in groups}
+        self._decoded: Dict[Union[str, int], dict] = {}
+
+    def __getitem__(self, key: Union[str, int]) -> dict:
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+        offset, length = self._index[key]
+        start = self._base + offset
+        desc = self._decoded[key] = json.loads(self._mm[start:start + length])
+        return desc
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
+
+    def __iter__(self) -> Iterator[Union[str, int]]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class SnapshotReader:
+    """
+    以只读方式映射快照文件，并在写入方发布新版本时重新映射。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.generation = 0
+        self._mm: Optional[mmap.mmap] = None
+        self._inode = None
+
+    def poll(self) -> bool:
+        """
+        检查是否有新版本快照，有则映射新版本。
+
+        :return: 是否映射了新版本。
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        inode = st.st_ino, st.st_mtime_ns, st.st_size
+        if self._mm is not None and inode == self._inode:
+            return False
+
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, generation, length = _header.unpack_from(mm)
+        if magic != _magic or len(mm) < _header.size + length:
+            logger.error('Invalid permission snapshot {}', self.path)
+            mm.close()
+            return False
+
+        self._inode = inode
+        if generation == self.generation:
+            mm.close()
+            return False
+        # 不关闭旧映射：旧版本的名称空间可能仍在使用，不再被引用后自动关闭
+        self._mm = mm
+        self.generation = generation
+        return True
+
+    def index(self) -> Dict[str, Any]:
+        """
+        :return: 当前映射的快照的索引。
+        """
+        _, _, length = _header.unpack_from(self._mm)
+        return json.loads(self._mm[_header.size:_header.size + length])
+
+    def config(self, groups: List[List[Any]]) -> MappedConfig:
+        """
+        :param groups: 索引中一个名称空间的权限组列表。
+        :return: 按需从当前映射中解码的名称空间配置。
+        """
+        _, _, length = _header.unpack_from(self._mm)
+        return MappedConfig(self._mm, _header.size + length, groups)
+
+
+reader: Optional[SnapshotReader] = None
+
+
+def restore(registry: "core.Registry"):
+    """
+    从快照恢复权限配置。由 core.reload 在读取方模式下调用。
+
+    :param registry: 待填充的空白状态。
+    """
+    global reader
+    if reader is None:
+        reader = SnapshotReader(snapshot_path())
+    reader.poll()
+    if reader.generation == 0:
+        logger.warning('Permission snapshot {} is not available yet', reader.path)
+        return
+
+    state = reader.index()
+    for name, data in state['namespaces'].items():
+        ns = core.Namespace(name, None, required=False, modifiable=False)
+        ns.config = reader.config(data['groups'])
+        ns.auto_decorate = data['decorate']
+        ns.registry = registry
+        registry.loaded[name] = ns
+    registry.plugin_namespaces.extend(registry.loaded[name] for name in state['plugins'])
+    registry.default_groups.update(state['defaults'])
+    logger.debug('Restored permission snapshot generation {}', reader.generation)
+
+
+def refresh():
+    """
+    读取方定期调用，发现新版本快照时重新加载。
+    """
+    if reader is not None and reader.poll():
+        core.reload(True)
+
+
+def start():
+    """
+    启动时由 core 调用（仅读取方），定期检查新版本快照。
+    """
+    core.scheduler.add_job(refresh, 'interval', seconds=c.flexperm_snapshot_interval, coalesce=True,
+                           id='flexperm.snapshot', replace_existing=True)
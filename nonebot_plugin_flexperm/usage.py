@@ -0,0 +1,383 @@
+import contextlib
+import json
+import time
+from collections import Counter, OrderedDict
+from typing import AbstractSet, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from nonebot.log import logger
+
+from . import core
+from .config import c
+from .core import scheduler, CheckResult, GroupDesc, GroupState, Namespace, PermissionGroup, \
+    check_wildcard, decorate_permission, match_wildcard, parse_group_desc, parse_qualified_group_name
+from .pattern import PatternTrie, is_extended_pattern
+
+rules: "Counter[Tuple[str, str]]" = Counter()
+"""
+各权限描述决定检查结果的次数，键为 (权限组限定名, 权限描述) 。
+"""
+
+edges: "Counter[Tuple[str, str]]" = Counter()
+"""
+各继承关系处在决定检查结果的路径上的次数，键为 (继承者限定名, 被继承者限定名) 。
+"""
+
+since: float = 0
+"""
+开始统计的时间戳。
+"""
+
+
+Decided = Optional[Tuple[Tuple[str, str], Tuple[Tuple[str, str], ...]]]
+
+# 以检查结果缓存的键为键，缓存起决定作用的 (权限组限定名, 权限描述) 和途经的继承关系
+_decided: "OrderedDict[Tuple[Tuple[Optional[GroupState], ...], str], Decided]" = OrderedDict()
+
+
+def record(chain: Sequence[PermissionGroup], perm: str):
+    """
+    记录起决定作用的权限描述和继承关系。每次检查后调用。
+
+    同一权限组链签名只在第一次时沿检查走过的路径找出起决定作用的描述，途经的权限组都已缓存了检查结果；之后只累加计数。
+
+    :param chain: 检查的权限组链。
+    :param perm: 权限。
+    """
+    key = tuple(group.state for group in chain), perm
+    try:
+        decided = _decided[key]
+    except KeyError:
+        decided = _decide(chain, perm)
+        if len(_decided) >= max(c.flexperm_chain_cache_size, 128):
+            with contextlib.suppress(KeyError):
+                _decided.popitem(last=False)
+        _decided[key] = decided
+    else:
+        with contextlib.suppress(KeyError):
+            _decided.move_to_end(key)
+    if decided is None:
+        return
+    rule, path = decided
+    rules[rule] += 1
+    for edge in path:
+        edges[edge] += 1
+
+
+def _decide(chain: Sequence[PermissionGroup], perm: str) -> Decided:
+    for group in chain:
+        if group.check(perm) is not None:
+            break
+    else:
+        return None
+
+    path = [group]
+    while True:
+        state = group.state
+        deny_patterns, allow_patterns = state.patterns()
+        if (rule := match_wildcard(perm, state.denies, deny_patterns)) is not None:
+            rule = '-' + rule
+            break
+        if (rule := match_wildcard(perm, state.allows, allow_patterns)) is not None:
+            break
+        # 与 PermissionGroup.check 相同：第一个撤销的组优先，否则取第一个授予的组
+        results = [(inherit, inherit.check(perm)) for inherit in state.inherits]
+        group = next((g for g, r in results if r == CheckResult.DENY), None) \
+            or next((g for g, r in results if r == CheckResult.ALLOW), None)
+        if group is None:
+            return None
+        path.append(group)
+
+    names = [g.qualified_name() for g in path]
+    return (names[-1], rule), tuple(zip(names, names[1:]))
+
+
+def _usage_path():
+    return c.flexperm_base / '.usage.json'
+
+
+def load():
+    """
+    从硬盘读取统计数据。
+    """
+    global since
+    rules.clear()
+    edges.clear()
+    _decided.clear()
+    since = time.time()
+    if not c.flexperm_usage:
+        return
+    try:
+        with open(_usage_path(), encoding='utf-8') as f:
+            data = json.load(f)
+        since = data['since']
+        for group, rule, count in data['rules']:
+            rules[group, rule] = count
+        for parent, child, count in data['edges']:
+            edges[parent, child] = count
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, TypeError, KeyError):
+        logger.exception('Failed to load rule usage')
+
+
+def save():
+    """
+    把统计数据保存到硬盘上。
+    """
+    if not c.flexperm_usage:
+        return
+    try:
+        path = _usage_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'since': since,
+                'rules': [[g, r, n] for (g, r), n in rules.items()],
+                'edges': [[p, ch, n] for (p, ch), n in edges.items()],
+            }, f, ensure_ascii=False)
+    except OSError:
+        logger.exception('Failed to save rule usage')
+
+
+class UsageReport(NamedTuple):
+    """
+    权限配置的使用情况报告。
+    """
+
+    since: float
+    """
+    开始统计的时间戳。
+    """
+
+    dead_rules: List[Tuple[str, str]]
+    """
+    从未决定过检查结果、也不匹配任何已注册权限的权限描述，元素为 (权限组限定名, 权限描述) 。
+    """
+
+    unreachable_groups: List[str]
+    """
+    检查时不会用到的权限组：既不是用户、群组或默认权限组，也不被这些组直接或间接继承。
+    """
+
+    shadowed_rules: List[Tuple[str, str, str]]
+    """
+    被同组中另一项描述完全覆盖、移除后不影响结果的权限描述，元素为 (权限组限定名, 权限描述, 覆盖它的描述) 。
+    """
+
+    unused_inherits: List[Tuple[str, str]]
+    """
+    从未处在决定检查结果的路径上的继承关系，元素为 (继承者限定名, 被继承者限定名) 。仅供参考，不会被清理。
+    """
+
+    def __str__(self):
+        lines = ['自 {} 起统计'.format(time.strftime('%Y-%m-%d %H:%M', time.localtime(self.since)))]
+        for title, items in (('未使用的权限描述', [f'{g} {r}' for g, r in self.dead_rules]),
+                             ('不可达的权限组', self.unreachable_groups),
+                             ('被覆盖的权限描述', [f'{g} {r}（被 {by} 覆盖）' for g, r, by in self.shadowed_rules]),
+                             ('未使用的继承关系', [f'{p} -> {ch}' for p, ch in self.unused_inherits])):
+            lines.append(f'{title}：{len(items)} 项')
+            lines.extend('  ' + x for x in items[:10])
+            if len(items) > 10:
+                lines.append('  ……')
+        return '\n'.join(lines)
+
+
+def covers(a: str, b: str) -> bool:
+    """
+    判断权限描述 a 匹配的权限是否包含 b 匹配的所有权限（均不含"-"前缀）。对扩展通配描述只做保守判断。
+    """
+    if a == b:
+        return True
+    if not a.endswith('*') or is_extended_pattern(a):
+        return False
+    prefix = a.split('.')[:-1]
+    head = b.split('.')[:len(prefix)]
+    return head == prefix and '*' not in head and '**' not in head
+
+
+def find_shadowed(allows: AbstractSet[str], denies: AbstractSet[str]) -> Iterable[Tuple[str, str]]:
+    """
+    找出被同组中另一项描述完全覆盖的权限描述。同组中撤销优先于授予，被撤销描述覆盖的授予描述也不起作用。
+
+    :param allows: 权限组中的授予描述。
+    :param denies: 权限组中的撤销描述（不含"-"前缀）。
+    :return: (被覆盖的描述, 覆盖它的描述) ，撤销描述带有"-"前缀。
+    """
+    for perm in sorted(allows):
+        for other in sorted(denies):
+            if covers(other, perm):
+                yield perm, '-' + other
+                break
+        else:
+            for other in sorted(allows):
+                if other != perm and covers(other, perm):
+                    yield perm, other
+                    break
+    for perm in sorted(denies):
+        for other in sorted(denies):
+            if other != perm and covers(other, perm):
+                yield '-' + perm, '-' + other
+                break
+
+
+def desc_rules(ns: Namespace, desc: GroupDesc, now: float = None) -> Tuple[Set[str], Set[str], Set[str]]:
+    """
+    不构建权限组，直接从权限组描述读取检查时生效的描述。
+
+    :param ns: 所在名称空间。
+    :param desc: 权限组描述。
+    :param now: 当前时间戳，默认为现在。
+    :return: 授予描述、撤销描述（不含"-"前缀）和其中有期限的描述（撤销描述带有"-"前缀）。
+    """
+    if now is None:
+        now = time.time()
+    allows, denies, timed = set(), set(), set()
+    for item in desc.permissions:
+        expires = desc.expires.get(item)
+        if item.startswith('-'):
+            target, prefix = denies, '-'
+            item = item[1:]
+        else:
+            target, prefix = allows, ''
+        if ns.auto_decorate:
+            [item] = decorate_permission(ns.name, [item])
+        if expires is not None:
+            if expires.timestamp() <= now:
+                continue
+            timed.add(prefix + item)
+        target.add(item)
+    return allows, denies, timed
+
+
+def modifiable_namespaces() -> List[Namespace]:
+    """
+    加载权限配置目录下的所有名称空间。
+
+    :return: 其中可修改的名称空间。
+    """
+    registry = core.registry
+    for path in sorted(c.flexperm_base.glob('*.yml')):
+        registry.get_namespace(path.stem, False)
+    for name in c.flexperm_sharded:
+        registry.get_namespace(name, False)
+    return [ns for ns in registry.loaded.values() if ns.modifiable]
+
+
+def _reachable(namespaces: List[Namespace]) -> Set[Tuple[str, str]]:
+    registry = core.registry
+    pending = [('global', name) for name in registry.default_groups]
+    for ns in namespaces:
+        if ns.name in ('user', 'group'):
+            pending.extend((ns.name, name) for name in ns.config)
+    seen = set()
+    while pending:
+        namespace, name = pending.pop()
+        if (namespace, name) in seen:
+            continue
+        seen.add((namespace, name))
+        if namespace == 'global' and name in registry.default_groups:
+            # 与 Namespace._presets 相同，插件预设中的同名权限组注入到默认权限组
+            pending.extend((pn.name, name) for pn in registry.plugin_namespaces if name in pn.config)
+        desc = registry.get_namespace(namespace, False).config.get(name)
+        if desc is None:
+            continue
+        try:
+            inherits = parse_group_desc(desc).inherits
+        except ValueError:
+            continue
+        pending.extend(parse_qualified_group_name(x, namespace) for x in inherits)
+    return seen
+
+
+def report() -> UsageReport:
+    """
+    结合统计数据和通过 PluginHandler 创建过检查器的权限，分析可以清理的权限配置。会读取所有名称空间的配置文件，但不构建权限组。
+
+    :return: 报告。
+    """
+    from .plugin import registered_permissions
+
+    namespaces = modifiable_namespaces()
+    reachable = _reachable(namespaces)
+    registered = list(registered_permissions)
+    now = time.time()
+
+    dead, unreachable, shadowed, inherits = [], [], [], []
+    for ns in namespaces:
+        for name, obj in list(ns.config.items()):
+            try:
+                desc = parse_group_desc(obj)
+            except ValueError:
+                continue
+            allows, denies, timed = desc_rules(ns, desc, now)
+            qn = f'{ns.name}:{name}'
+            if (ns.name, name) not in reachable:
+                unreachable.append(qn)
+                continue
+            for item in sorted(allows | {'-' + x for x in denies}):
+                if rules[qn, item]:
+                    continue
+                perm = item.lstrip('-')
+                patterns = PatternTrie.compile([perm])
+                if not any(check_wildcard(p, {perm}, patterns) for p in registered):
+                    dead.append((qn, item))
+            # 覆盖它的描述到期后被覆盖的描述会重新生效
+            shadowed.extend((qn, item, by) for item, by in find_shadowed(allows, denies) if by not in timed)
+            for parent in desc.inherits:
+                parent_qn = '{}:{}'.format(*parse_qualified_group_name(parent, ns.name))
+                if not edges[qn, parent_qn]:
+                    inherits.append((qn, parent_qn))
+    return UsageReport(since, dead, unreachable, shadowed, inherits)
+
+
+def prune(report_: UsageReport, dead: bool = True, unreachable: bool = True, shadowed: bool = True) -> int:
+    """
+    按报告批量清理权限配置。
+
+    :param report_: 报告。
+    :param dead: 是否移除未使用的权限描述。
+    :param unreachable: 是否移除不可达的权限组。
+    :param shadowed: 是否移除被覆盖的权限描述。
+    :return: 移除的权限描述和权限组总数。
+    """
+    items: Dict[str, Set[str]] = {}
+    if dead:
+        for qn, item in report_.dead_rules:
+            items.setdefault(qn, set()).add(item)
+    covered: Dict[str, Dict[str, str]] = {}
+    if shadowed:
+        for qn, item, by in report_.shadowed_rules:
+            # 覆盖它的描述也要移除时保留
+            if by not in items.get(qn, ()):
+                items.setdefault(qn, set()).add(item)
+                covered.setdefault(qn, {})[item] = by
+
+    count = 0
+    for qn, group_items in items.items():
+        group = core.get(*parse_qualified_group_name(qn))
+        for item in sorted(group_items):
+            # 覆盖它的描述有期限时保留，到期后被覆盖的描述会重新生效
+            if (by := covered.get(qn, {}).get(item)) is not None and by in group.state.expiry:
+                continue
+            try:
+                group.remove(item)
+                count += 1
+            except (ValueError, TypeError, KeyError):
+                pass
+    if unreachable:
+        for qn in report_.unreachable_groups:
+            namespace, name = parse_qualified_group_name(qn)
+            try:
+                core.get_namespace(namespace, False).remove_group(name, True)
+                count += 1
+            except (TypeError, KeyError):
+                pass
+    return count
+
+
+def start():
+    """
+    启动时由 core 调用（仅启用统计时），读取统计数据并定期保存。
+    """
+    load()
+    scheduler.add_job(save, 'interval', minutes=5, coalesce=True, id='flexperm.usage', replace_existing=True)
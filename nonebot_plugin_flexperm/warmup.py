@@ -0,0 +1,147 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Optional, Union, Tuple, List, Sequence
+
+from nonebot.log import logger
+
+from . import core
+from .config import c
+from .core import nonebot_driver, scheduler, NullPermissionGroup, PermissionGroup
+
+ChainKey = Tuple[Optional[Tuple[str, Union[str, int]]], ...]
+"""
+权限组链的记录形式，元素为 (名称空间, 组名) ，不存在的权限组（如没有配置的用户）为 None 。
+"""
+
+recent: "OrderedDict[ChainKey, None]" = OrderedDict()
+"""
+最近检查过的权限组链，按检查时间排列，最近的在最后。
+"""
+
+_task: Optional[asyncio.Task] = None
+
+
+def touch(chain: Sequence[PermissionGroup]):
+    """
+    记录一条检查过的权限组链，覆盖层不计入。仅在设置了 flexperm_warmup_recent 时调用。
+
+    :param chain: 权限组链。
+    """
+    key = tuple((group.namespace.name, group.name) if group.is_valid else None
+                for group in chain if group.namespace is None or group.namespace.name != 'overlay')
+    if key in recent:
+        recent.move_to_end(key)
+    else:
+        recent[key] = None
+        if len(recent) > c.flexperm_warmup_recent:
+            recent.popitem(last=False)
+
+
+def _resolve(key: ChainKey) -> Tuple[PermissionGroup, ...]:
+    return tuple(core.get(*x) if x is not None else NullPermissionGroup() for x in key)
+
+
+def _recent_path():
+    return c.flexperm_base / '.recent.json'
+
+
+def load_recent():
+    """
+    从硬盘读取最近检查过的权限组链。
+    """
+    recent.clear()
+    if not c.flexperm_warmup_recent:
+        return
+    try:
+        with open(_recent_path(), encoding='utf-8') as f:
+            data = json.load(f)
+        for chain in data[-c.flexperm_warmup_recent:]:
+            recent[tuple(tuple(x) if x is not None else None for x in chain)] = None
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, TypeError):
+        logger.exception('Failed to load recent subjects')
+
+
+@nonebot_driver.on_shutdown
+@scheduler.scheduled_job('interval', minutes=5, coalesce=True, id='flexperm.recent')
+def save_recent():
+    """
+    把最近检查过的权限组链保存到硬盘上。
+    """
+    if not c.flexperm_warmup_recent or not recent:
+        return
+    try:
+        path = _recent_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([[list(x) if x is not None else None for x in key] for key in recent], f)
+    except OSError:
+        logger.exception('Failed to save recent subjects')
+
+
+async def warm_up(timeout: float) -> bool:
+    """
+    预先加载常用权限组，并预先计算已注册权限的检查结果。每处理一个权限组或一条权限组链都会让出事件循环。
+
+    最近检查过的权限组链按与实际检查相同的方式计算，结果进入检查结果缓存，重启后这些用户的第一次检查也能命中缓存。
+
+    :param timeout: 最长耗时（秒），超时后放弃剩余工作。
+    :return: 是否在时限内完成。
+    """
+    from .plugin import registered_permissions
+
+    deadline = time.monotonic() + timeout
+    perms = sorted(registered_permissions)
+    registry = core.registry
+    stages: List[Tuple[str, List[Union[str, int]]]] = [('global', list(registry.get_namespace('global', False).config))]
+    stages.extend((ns.name, list(ns.config)) for ns in registry.plugin_namespaces)
+
+    groups = 0
+    for namespace, names in stages:
+        ns = registry.get_namespace(namespace, False)
+        for name in names:
+            if time.monotonic() > deadline:
+                logger.info('Permission warm-up timed out after {} groups', groups)
+                return False
+            for group in ns.load_groups([name]):
+                for perm in perms:
+                    group.check(perm)
+                groups += 1
+            await asyncio.sleep(0)
+
+    from .check import _check_cached
+
+    chains = 0
+    for key in reversed(recent):
+        if time.monotonic() > deadline:
+            logger.info('Permission warm-up timed out after {} groups and {} chains', groups, chains)
+            return False
+        chain = _resolve(key)
+        for perm in perms:
+            _check_cached(chain, perm)
+        chains += 1
+        await asyncio.sleep(0)
+
+    logger.debug('Permission warm-up finished: {} groups, {} chains, {} permissions', groups, chains, len(perms))
+    return True
+
+
+def start():
+    """
+    在后台开始预热，会取消尚未完成的上一次预热。未设置 flexperm_warmup 时不做任何事。
+    """
+    global _task
+    if not c.flexperm_warmup:
+        return
+    if _task is not None:
+        _task.cancel()
+    _task = asyncio.get_running_loop().create_task(warm_up(c.flexperm_warmup_timeout))
+
+
+@nonebot_driver.on_startup
+async def _():
+    load_recent()
+    start()
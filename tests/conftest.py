@@ -0,0 +1,56 @@
+from pathlib import Path
+from typing import Callable
+
+import nonebot
+import pytest
+from nonebot.adapters.onebot.v11 import Adapter, Bot, GroupMessageEvent, Message, PrivateMessageEvent
+
+nonebot.init()
+nonebot.get_driver().register_adapter(Adapter)
+nonebot.require('nonebot_plugin_flexperm')
+
+from nonebot_plugin_flexperm import core  # noqa: E402
+from nonebot_plugin_flexperm.config import c  # noqa: E402
+
+
+@pytest.fixture
+def load(tmp_path: Path, monkeypatch) -> Callable[..., Path]:
+    """
+    写入权限配置文件并重新加载，参数名为名称空间，值为文件内容。
+    """
+    monkeypatch.setattr(c, 'flexperm_base', tmp_path)
+
+    def _load(**files: str) -> Path:
+        for name, content in files.items():
+            (tmp_path / f'{name}.yml').write_text(content, encoding='utf-8')
+        core.reload(True)
+        return tmp_path
+
+    return _load
+
+
+@pytest.fixture
+def bot() -> Bot:
+    return Bot(nonebot.get_adapter(Adapter), '999')
+
+
+@pytest.fixture
+def private_event() -> Callable[[int], PrivateMessageEvent]:
+    def _event(user_id: int) -> PrivateMessageEvent:
+        return PrivateMessageEvent.model_validate(dict(
+            time=0, self_id=999, post_type='message', sub_type='friend', user_id=user_id, message_type='private',
+            message_id=1, message=Message('hi'), original_message=Message('hi'), raw_message='hi', font=0,
+            sender={'user_id': user_id}, to_me=True))
+
+    return _event
+
+
+@pytest.fixture
+def group_event() -> Callable[[int, int], GroupMessageEvent]:
+    def _event(user_id: int, group_id: int) -> GroupMessageEvent:
+        return GroupMessageEvent.model_validate(dict(
+            time=0, self_id=999, post_type='message', sub_type='normal', user_id=user_id, group_id=group_id,
+            message_type='group', message_id=1, message=Message('hi'), original_message=Message('hi'),
+            raw_message='hi', font=0, sender={'user_id': user_id, 'role': 'member'}, to_me=True))
+
+    return _event
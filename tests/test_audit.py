@@ -0,0 +1,52 @@
+import json
+from collections import deque
+
+import pytest
+
+from nonebot_plugin_flexperm import audit, register
+from nonebot_plugin_flexperm.config import c
+
+P = register('test_audit')
+
+
+@pytest.fixture
+def auditing(load, tmp_path, monkeypatch):
+    load()
+    monkeypatch.setattr(c, 'flexperm_audit_path', tmp_path / 'audit.jsonl')
+    monkeypatch.setattr(audit, 'enabled', True)
+    monkeypatch.setattr(audit, 'watching', True)
+    monkeypatch.setattr(audit, '_filter', audit._Filter(['test_audit.watched.*']))
+    monkeypatch.setattr(audit, 'BUFFER_SIZE', 100)
+    monkeypatch.setattr(audit, 'denials', deque(maxlen=100))
+    monkeypatch.setattr(audit, 'edits', deque())
+    monkeypatch.setattr(audit, 'dropped', 0)
+    return tmp_path / 'audit.jsonl'
+
+
+def _read(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_unwatched_denials_are_not_buffered(auditing, bot, private_event):
+    for _ in range(1000):
+        audit.record_denial('test_audit.other', bot, private_event(10001))
+    assert not audit.denials
+    audit.record_denial('test_audit.watched.x', bot, private_event(10001))
+    assert len(audit.denials) == 1
+
+
+def test_denial_flood_keeps_edits(auditing, bot, private_event):
+    audit.record_denial('test_audit.watched.before', bot, private_event(10001))
+    assert P.add_permission('user:10001', 'edited')
+    for i in range(1000):
+        audit.record_denial(f'test_audit.watched.{i}', bot, private_event(10001))
+    assert audit.dropped == 901
+
+    assert audit.flush() == 102
+    records = _read(auditing)
+    # 丢弃的是最旧的检查未通过记录，修改记录都保留，写入的记录按时间排列
+    assert [(r['op'], r['group'], r['args'][:1]) for r in records[:2]] == \
+        [('add_group', 10001, [None]), ('add', 10001, ['test_audit.edited'])]
+    assert [r['perm'] for r in records[2:]] == [f'test_audit.watched.{i}' for i in range(900, 1000)]
+    assert audit.dropped == 0
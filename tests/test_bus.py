@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from nonebot_plugin_flexperm import bus
+from nonebot_plugin_flexperm.bus import Change, SqliteBus
+from nonebot_plugin_flexperm.core import CheckResult, get, get_namespace
+
+USERS = '''
+10001:
+  permissions:
+    - a.b
+10002:
+  permissions:
+    - a.b
+'''
+
+PEER_USERS = '''
+10001:
+  permissions:
+    - -a.b
+10002:
+  permissions:
+    - -a.b
+'''
+
+
+@pytest.fixture
+def peer(tmp_path):
+    """
+    与本实例共享同一数据库的另一实例的通知渠道。
+    """
+    bus.set_bus(SqliteBus(tmp_path / 'bus.db'))
+    other = SqliteBus(tmp_path / 'bus.db')
+    yield other
+    other.close()
+    bus.set_bus(None)
+
+
+def test_sqlite_bus_skips_own_and_earlier_changes(tmp_path):
+    first = SqliteBus(tmp_path / 'bus.db')
+    first.publish([Change(first.origin, 'user', 1)])
+    second = SqliteBus(tmp_path / 'bus.db')
+    first.publish([Change(first.origin, 'user', 'x'), Change(first.origin, 'global', None)])
+    second.publish([Change(second.origin, None, None)])
+    assert second.poll() == [Change(first.origin, 'user', 'x'), Change(first.origin, 'global', None)]
+    assert second.poll() == []
+    assert first.poll() == [Change(second.origin, None, None)]
+    first.close()
+    second.close()
+
+
+def test_apply_only_affected_groups(load, peer):
+    base = load(user=USERS)
+    group1, group2 = get('user', 10001), get('user', 10002)
+    (base / 'user.yml').write_text(PEER_USERS, encoding='utf-8')
+    peer.publish([Change(peer.origin, 'user', 10001)])
+
+    bus.apply_changes()
+    assert group1.check('a.b') == CheckResult.DENY
+    assert group2.check('a.b') == CheckResult.ALLOW
+    assert get('user', 10001) is group1
+
+
+def test_poll_reads_off_the_loop(load, peer):
+    base = load(user=USERS)
+    group = get('user', 10001)
+    (base / 'user.yml').write_text(PEER_USERS, encoding='utf-8')
+    peer.publish([Change(peer.origin, 'user', None)])
+
+    asyncio.run(bus._poll())
+    assert group.check('a.b') == CheckResult.DENY
+    assert get('user', 10002).check('a.b') == CheckResult.DENY
+
+
+def test_keep_unsaved_local_changes(load, peer):
+    base = load(user=USERS)
+    get('user', 10001).add('c.d')
+    (base / 'user.yml').write_text(PEER_USERS, encoding='utf-8')
+    peer.publish([Change(peer.origin, 'user', 10001), Change(peer.origin, 'user', 10002)])
+
+    asyncio.run(bus._poll())
+    assert get('user', 10001).allows == {'a.b', 'c.d'}
+    assert get('user', 10002).check('a.b') == CheckResult.DENY
+    assert get_namespace('user', False).dirty
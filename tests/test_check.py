@@ -0,0 +1,67 @@
+import pytest
+
+from nonebot_plugin_flexperm import profiling
+from nonebot_plugin_flexperm.check import chain_cache, check, iterate_groups, _check_cached
+from nonebot_plugin_flexperm.config import c
+from nonebot_plugin_flexperm.core import get
+
+GLOBAL = '''
+roleA:
+  permissions:
+    - a.*
+'''
+
+USERS = '''
+10001:
+  inherits: [global:roleA]
+'''
+
+
+@pytest.fixture
+def loaded(load):
+    load(user=USERS, **{'global': GLOBAL})
+    chain_cache.clear()
+    yield
+    chain_cache.clear()
+
+
+def test_chain_cache_hits(loaded, bot, private_event):
+    chain = tuple(iterate_groups(bot, private_event(10001)))
+    assert _check_cached(chain, 'a.b') == (True, False)
+    assert _check_cached(chain, 'a.b') == (True, True)
+    assert len(chain_cache) == 1
+
+    # 链上各组版本相同的用户共用缓存
+    other = tuple(iterate_groups(bot, private_event(10002)))
+    assert _check_cached(other, 'x') == (False, False)
+    assert _check_cached(tuple(iterate_groups(bot, private_event(10003))), 'x') == (False, True)
+
+
+def test_edit_invalidates_dependents(loaded, bot, private_event):
+    user, role = get('user', 10001), get('global', 'roleA')
+    chain = tuple(iterate_groups(bot, private_event(10001)))
+    assert _check_cached(chain, 'a.b') == (True, False)
+    state = user.state
+
+    # 修改被继承的组，继承它的组换用新版本，链签名随之改变
+    role.add('-a.b')
+    assert user.state is not state and user.state.allows == state.allows
+    assert _check_cached(chain, 'a.b') == (False, False)
+    assert _check_cached(chain, 'a.c') == (True, False)
+
+    role.remove('-a.b')
+    assert _check_cached(chain, 'a.b') == (True, False)
+
+
+def test_debug_check_keeps_cache_and_hooks(loaded, bot, private_event, monkeypatch):
+    calls = []
+
+    class Hook(profiling.Hook):
+        def on_check(self, elapsed, perm, chain, chain_hit, group_hits, result):
+            calls.append((perm, chain_hit, result))
+
+    monkeypatch.setattr(c, 'flexperm_debug_check', True)
+    monkeypatch.setattr(profiling, 'hooks', [Hook()])
+    for _ in range(2):
+        assert check(bot, private_event(10001), 'a.b')
+    assert calls == [('a.b', False, True), ('a.b', True, True)]
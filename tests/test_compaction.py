@@ -0,0 +1,90 @@
+import pytest
+
+from nonebot_plugin_flexperm import compaction
+from nonebot_plugin_flexperm.check import check
+from nonebot_plugin_flexperm.config import c
+from nonebot_plugin_flexperm.core import get, get_namespace, CheckResult
+
+GLOBAL = '''
+base:
+  permissions:
+    - b.*
+roleA:
+  permissions:
+    - a.x
+  inherits: [base]
+'''
+
+USERS = '''
+10001:
+  permissions:
+    - a.*
+    - a.b
+    - a.*
+  inherits: [global:roleA, global:base]
+10002:
+  permissions: []
+'''
+
+
+@pytest.fixture
+def loaded(load):
+    load(user=USERS, **{'global': GLOBAL})
+
+
+def test_compact_without_building_groups(loaded):
+    report = compaction.compact()
+    assert report[:4] == (1, 1, 1, 1)
+    assert report.load_time is None
+
+    user = get_namespace('user', False)
+    assert not user.groups
+    assert not get_namespace('global', False).groups
+    assert dict(user.config) == {10001: {'permissions': ['a.*'], 'inherits': ['global:roleA']}}
+
+    group = get('user', 10001)
+    for perm, result in (('a.b', CheckResult.ALLOW), ('a.x', CheckResult.ALLOW), ('b.c', CheckResult.ALLOW),
+                         ('c', None)):
+        assert group.check(perm) == result
+
+
+def test_compact_updates_loaded_groups(loaded):
+    group = get('user', 10001)
+    assert len(group.inherits) == 2
+    compaction.compact()
+    assert group.allows == {'a.*'}
+    assert [x.qualified_name() for x in group.inherits] == ['global:roleA']
+    assert get('user', 10001) is group
+
+
+def test_compact_reanalyses_after_concurrent_edit(loaded, monkeypatch):
+    plan = compaction._plan
+
+    def edit_during_analysis(ns, graph, referenced):
+        result = plan(ns, graph, referenced)
+        if ns.name == 'user':
+            # 分析完成后、获取配置锁前，roleA 开始撤销 base 授予的权限，直接继承 base 不再多余
+            monkeypatch.setattr(compaction, '_plan', plan)
+            get('global', 'roleA').add('-b.x')
+        return result
+
+    monkeypatch.setattr(compaction, '_plan', edit_during_analysis)
+    report = compaction.compact()
+    assert report.redundant_inherits == 0
+    assert list(get_namespace('user', False).config[10001]['inherits']) == ['global:roleA', 'global:base']
+
+
+def test_measure_load_time(loaded, monkeypatch):
+    monkeypatch.setattr(c, 'flexperm_compact_measure', True)
+    report = compaction.compact()
+    assert report.load_time is not None and report.load_time[0] > 0
+
+
+def test_keep_empty_group_shadowing_another_spelling(load, bot, private_event):
+    load(user="123:\n  permissions: []\n'onebot:123':\n  permissions: [a.b]\n'onebot:0456':\n  permissions: [a.b]\n"
+              "456:\n  permissions: []\n789:\n  permissions: []\n")
+    before = [check(bot, private_event(x), 'a.b') for x in (123, 456)]
+    report = compaction.compact()
+    assert report.empty_groups == 1
+    assert set(get_namespace('user', False).config) == {123, 'onebot:123', 'onebot:0456', 456}
+    assert [check(bot, private_event(x), 'a.b') for x in (123, 456)] == before
@@ -0,0 +1,20 @@
+from nonebot_plugin_flexperm.core import get_namespace
+
+USERS = '''
+10001:
+  permissions: [a.b]
+10002:
+  permissions: [c.d]
+10003:
+  permissions: bad
+'''
+
+
+def test_load_groups(load):
+    load(user=USERS)
+    ns = get_namespace('user', False)
+    groups = ns.load_groups(x for x in (10001, 10003, 10004))
+    assert [x.allows for x in groups] == [{'a.b'}]
+    assert set(ns.groups) == {10001, 10003}
+
+    assert [x.allows for x in ns.load_groups()] == [{'a.b'}, {'c.d'}]
@@ -0,0 +1,67 @@
+import time
+from datetime import datetime, timedelta
+
+from nonebot_plugin_flexperm import register
+from nonebot_plugin_flexperm.core import get, get_namespace, CheckResult
+from nonebot_plugin_flexperm.expiry import expire_due
+
+P = register('test_expiry')
+
+
+def _deadline(namespace, name, item):
+    return datetime.fromtimestamp(get(namespace, name).state.expiry[item])
+
+
+def test_readd_extends_grant(load):
+    load()
+    assert P.add_permission('user:10001', 'a', expires=60)
+    assert not P.add_permission('user:10001', 'a', expires=_deadline('user', 10001, 'test_expiry.a'))
+    assert P.add_permission('user:10001', 'a', expires=3600)
+
+    group = get('user', 10001)
+    deadline = group.state.expiry['test_expiry.a']
+    assert deadline > time.time() + 3000
+    assert get_namespace('user', False).config[10001]['expires']['test_expiry.a'] == \
+        datetime.fromtimestamp(deadline)
+
+    # 原期限到期时不再移除
+    expire_due(time.time() + 120)
+    assert group.check('test_expiry.a') == CheckResult.ALLOW
+    expire_due(deadline)
+    assert group.check('test_expiry.a') is None
+
+
+def test_readd_makes_grant_permanent(load):
+    load()
+    assert P.add_item('user:10001', 'a', expires=timedelta(minutes=1))
+    assert P.add_item('user:10001', 'a')
+    assert not P.add_item('user:10001', 'a')
+
+    group = get('user', 10001)
+    assert 'test_expiry.a' not in group.state.expiry
+    assert 'expires' not in get_namespace('user', False).config[10001]
+    expire_due(time.time() + 120)
+    assert group.check('test_expiry.a') == CheckResult.ALLOW
+
+
+def test_remove_permission_makes_timed_deny_permanent(load):
+    load()
+    assert P.add_item('user:10001', '-a', expires=60)
+    assert P.remove_permission('user:10001', 'a')
+    assert not P.remove_permission('user:10001', 'a')
+    expire_due(time.time() + 120)
+    assert get('user', 10001).check('test_expiry.a') == CheckResult.DENY
+
+
+def test_readd_survives_journal_replay(load, monkeypatch):
+    from nonebot_plugin_flexperm.config import c
+    from nonebot_plugin_flexperm.core import reload
+
+    monkeypatch.setattr(c, 'flexperm_journal', True)
+    load()
+    assert P.add_permission('user:10001', 'a', expires=60)
+    assert P.add_permission('user:10001', 'a')
+    reload(True)
+    group = get('user', 10001)
+    assert 'test_expiry.a' not in group.state.expiry
+    assert group.check('test_expiry.a') == CheckResult.ALLOW
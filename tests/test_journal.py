@@ -0,0 +1,103 @@
+import threading
+from datetime import datetime
+
+import pytest
+from ruamel.yaml import CommentedMap, CommentedSeq
+
+from nonebot_plugin_flexperm.config import c
+from nonebot_plugin_flexperm.core import get, get_namespace, reload
+from nonebot_plugin_flexperm.journal import Journal, apply_record
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def _config(**groups) -> CommentedMap:
+    config = CommentedMap()
+    for name, desc in groups.items():
+        config[name] = CommentedMap((k, CommentedSeq(v)) for k, v in desc.items())
+    return config
+
+
+def test_add_with_expires_and_remove():
+    config = _config(g={'permissions': []})
+    apply_record(config, ['add', 'g', 'a.b', None, '2099-01-01T00:00:00'])
+    assert config['g']['permissions'] == ['a.b']
+    assert config['g']['expires'] == {'a.b': datetime(2099, 1, 1)}
+
+    # 重复应用不产生额外影响，不带到期时间时取消到期
+    apply_record(config, ['add', 'g', 'a.b', None])
+    assert config['g']['permissions'] == ['a.b']
+    assert 'expires' not in config['g']
+
+    apply_record(config, ['add', 'g', 'c.d', None, datetime(2099, 1, 1)])
+    apply_record(config, ['remove', 'g', 'c.d'])
+    assert config['g']['permissions'] == ['a.b']
+    assert 'expires' not in config['g']
+
+
+def test_remove_inherit_first_matching_spelling():
+    config = _config(g={'inherits': ['global:x', 'x', 'global:x']})
+    apply_record(config, ['remove_inherit', 'g', ['x', 'global:x']])
+    assert config['g']['inherits'] == ['global:x', 'global:x']
+    apply_record(config, ['remove_inherit', 'missing', ['x']])
+
+
+def test_compact_and_remove_group():
+    config = _config(g={'permissions': ['a', 'b', 'a'], 'inherits': []}, h={'permissions': []})
+    apply_record(config, ['compact', 'g'])
+    assert dict(config['g']) == {'permissions': ['a', 'b']}
+    # 都为空时保留
+    apply_record(config, ['compact', 'h'])
+    assert dict(config['h']) == {'permissions': []}
+
+    apply_record(config, ['remove_group', 'h'])
+    apply_record(config, ['remove_group', 'h'])
+    assert list(config) == ['g']
+
+    with pytest.raises(ValueError):
+        apply_record(config, ['unknown', 'g'])
+
+
+def test_replay_after_crash(load, monkeypatch):
+    monkeypatch.setattr(c, 'flexperm_journal', True)
+    base = load(user='10001:\n  permissions: [a.b]\n')
+    group = get('user', 10001)
+    group.add('c.d')
+    group.remove('a.b')
+    get_namespace('user', False).add_group(10002)
+    # 没有保存就退出，最后一条记录只写了一半
+    with open(base / 'user.journal', 'a', encoding='utf-8') as f:
+        f.write('["add", 10002, "e.f"')
+    assert (base / 'user.yml').read_text(encoding='utf-8') == '10001:\n  permissions: [a.b]\n'
+
+    reload(True)
+    assert get('user', 10001).allows == {'c.d'}
+    assert 10002 in get_namespace('user', False).config
+    assert not get('user', 10002).allows
+
+
+def test_lock_is_reentrant(tmp_path):
+    journal = Journal(tmp_path / 'x.journal', False)
+    acquired = threading.Event()
+
+    def other_thread():
+        with journal.lock():
+            acquired.set()
+
+    with journal.lock():
+        with journal.lock():
+            thread = threading.Thread(target=other_thread)
+            thread.start()
+        # 内层退出后仍持有锁
+        assert not acquired.wait(0.05)
+    thread.join(1)
+    assert acquired.is_set()
+
+    if fcntl is not None:
+        # 文件锁已释放
+        with open(tmp_path / 'x.journal.lock', 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(f, fcntl.LOCK_UN)
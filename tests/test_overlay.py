@@ -0,0 +1,41 @@
+import pytest
+
+from nonebot_plugin_flexperm import register, overlay
+from nonebot_plugin_flexperm.check import check
+
+P = register('test_overlay')
+
+GLOBAL = '''
+moderator:
+  permissions:
+    - test_overlay.kick
+'''
+
+USERS = '''
+10001:
+  inherits: [global:moderator]
+'''
+
+
+@pytest.fixture
+def loaded(load):
+    load(user=USERS, **{'global': GLOBAL})
+    yield
+    overlay.clear()
+
+
+def test_overlay_on_chain_groups(loaded, bot, private_event, group_event):
+    assert P.add_overlay('user:10001', '-kick')
+    assert not check(bot, private_event(10001), 'test_overlay.kick')
+    assert P.add_overlay('global:anyone', 'say')
+    assert check(bot, private_event(10002), 'test_overlay.say')
+    assert P.add_overlay('group:20001', 'say2')
+    assert check(bot, group_event(10002, 20001), 'test_overlay.say2')
+
+
+@pytest.mark.parametrize('designator', ['global:moderator', 'global:nonexistent', 'test_overlay:anyone'])
+def test_overlay_on_other_groups_is_rejected(loaded, bot, private_event, designator):
+    with pytest.raises(ValueError):
+        P.add_overlay(designator, '-kick')
+    assert not overlay.overlays
+    assert check(bot, private_event(10001), 'test_overlay.kick')
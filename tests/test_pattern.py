@@ -0,0 +1,70 @@
+import pytest
+
+from nonebot_plugin_flexperm.pattern import PatternTrie, is_extended_pattern
+
+
+@pytest.mark.parametrize('item, expected', [
+    ('a.b', False), ('a.*', False), ('*', False), ('a.*.c', True), ('a.**', True), ('**.c', True), ('a.b*', False),
+])
+def test_is_extended_pattern(item, expected):
+    assert is_extended_pattern(item) == expected
+
+
+def _match(trie: PatternTrie, perm: str):
+    return trie.match(perm.split('.'))
+
+
+def test_star_matches_one_segment():
+    trie = PatternTrie(['a.*.c'])
+    assert _match(trie, 'a.b.c') == 'a.*.c'
+    assert _match(trie, 'a.c') is None
+    assert _match(trie, 'a.b.b.c') is None
+    assert _match(trie, 'a.b.c.d') is None
+
+
+def test_globstar_matches_any_segments():
+    trie = PatternTrie(['a.**.c'])
+    for perm in ('a.c', 'a.b.c', 'a.b.b.c'):
+        assert _match(trie, perm) == 'a.**.c'
+    assert _match(trie, 'a.b') is None
+    assert _match(trie, 'a.c.d') is None
+
+
+def test_trailing_star_matches_like_globstar():
+    star, globstar = PatternTrie(['a.*.*']), PatternTrie(['a.*.**'])
+    for perm in ('a', 'a.b', 'a.b.c', 'a.b.c.d', 'x.b.c'):
+        assert (_match(star, perm) is None) == (_match(globstar, perm) is None)
+    assert _match(star, 'a.b') == 'a.*.*'
+    assert _match(star, 'a.b.c.d') == 'a.*.*'
+
+
+def test_longest_pattern_wins():
+    trie = PatternTrie(['**.c', 'a.*.c', 'a.**'])
+    assert _match(trie, 'a.b.c') == 'a.*.c'
+    assert _match(trie, 'x.c') == '**.c'
+    assert _match(trie, 'a.x') == 'a.**'
+
+
+def test_transition_cache():
+    trie = PatternTrie(['a.**.c'])
+    assert _match(trie, 'a.b.c') == 'a.**.c'
+    transitions = dict(trie._transitions)
+    assert len(transitions) == 3
+    # 相同的 (状态, 段) 复用缓存的转移
+    assert _match(trie, 'a.b.c') == 'a.**.c'
+    assert trie._transitions == transitions
+    assert _match(trie, 'a.d.c') == 'a.**.c'
+    assert len(trie._transitions) == 4
+
+    # 超过上限时清空重来，结果不变
+    trie.transition_limit = 2
+    for perm in ('a.x.c', 'a.y.c', 'a.z.c'):
+        assert _match(trie, perm) == 'a.**.c'
+        assert len(trie._transitions) <= 2
+
+
+def test_compile_skips_plain_items():
+    assert PatternTrie.compile(['a.b', 'a.*']) is None
+    trie = PatternTrie.compile(['a.b', 'a.*.c'])
+    assert _match(trie, 'a.b') is None
+    assert _match(trie, 'a.x.c') == 'a.*.c'
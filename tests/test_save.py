@@ -0,0 +1,55 @@
+import threading
+import time
+
+from nonebot_plugin_flexperm import register
+from nonebot_plugin_flexperm.core import get_namespace, get_yaml
+
+P = register('test_save')
+
+
+class _YieldingLock:
+    """
+    保存线程释放配置锁后让出一段时间，使等待中的修改恰好发生在释放之后。
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.saver = None
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+        if threading.current_thread() is self.saver:
+            time.sleep(0.05)
+
+
+def test_edit_during_write_is_not_lost(load, monkeypatch):
+    base = load(user='10001:\n  permissions: []\n')
+    ns = get_namespace('user', False)
+    assert P.add_permission('user:10001', 'first')
+
+    lock = _YieldingLock()
+    monkeypatch.setattr(ns, 'lock', lock)
+    write = ns._write
+    edit = threading.Thread(target=P.add_permission, args=('user:10001', 'second'))
+
+    def write_then_edit():
+        write()
+        # 修改在写入之后发生，会等待保存释放配置锁
+        edit.start()
+        time.sleep(0.05)
+
+    monkeypatch.setattr(ns, '_write', write_then_edit)
+    lock.saver = threading.Thread(target=ns.save)
+    lock.saver.start()
+    lock.saver.join()
+    edit.join()
+    monkeypatch.setattr(ns, '_write', write)
+
+    assert ns.dirty
+    assert ns._unnotified == {10001}
+    ns.save()
+    assert not ns.dirty
+    assert get_yaml().load(base / 'user.yml')[10001]['permissions'] == ['test_save.first', 'test_save.second']
@@ -0,0 +1,71 @@
+import zlib
+
+import pytest
+
+from nonebot_plugin_flexperm.config import c
+from nonebot_plugin_flexperm.core import CheckResult, get, get_namespace, reload
+from nonebot_plugin_flexperm.sharding import ShardedNamespace, shard_of, shard_of_subject
+
+USERS = '''
+10001:
+  permissions:
+    - a.b  # 管理员
+10002:
+  permissions:
+    - c.d
+'''
+
+
+@pytest.fixture
+def sharded(load, monkeypatch):
+    monkeypatch.setattr(c, 'flexperm_sharded', ['user'])
+    return load(user=USERS)
+
+
+def test_crc_routing():
+    expected = format(zlib.crc32(b'onebot:10001') % 256, '02x')
+    assert shard_of_subject(('onebot', '10001')) == expected
+    # 同一用户的不同写法位于同一分片
+    assert shard_of(10001) == shard_of('onebot:10001') == expected
+    assert shard_of(('not', 'a subject')) == format(zlib.crc32(b"('not', 'a subject')") % 256, '02x')
+
+
+def test_migrate_from_single_file(sharded):
+    ns = get_namespace('user', False)
+    assert isinstance(ns, ShardedNamespace)
+    assert not (sharded / 'user.yml').exists()
+    assert (sharded / 'user.yml.bak').is_file()
+    files = {p.name for p in (sharded / 'user').iterdir()}
+    assert files == {f'{shard_of(10001)}.yml', f'{shard_of(10002)}.yml'}
+    assert '管理员' in (sharded / 'user' / f'{shard_of(10001)}.yml').read_text(encoding='utf-8')
+
+
+def test_lazy_loading(sharded):
+    ns = get_namespace('user', False)
+    assert not ns.config.shards
+    assert get('user', 10001).check('a.b') == CheckResult.ALLOW
+    assert set(ns.config.shards) == {shard_of(10001)}
+
+
+def test_save_round_trip(sharded):
+    ns = get_namespace('user', False)
+    other = sharded / 'user' / f'{shard_of(10002)}.yml'
+    mtime = other.stat().st_mtime_ns
+    get('user', 10001).add('e.f')
+    assert ns.config.dirty == {shard_of(10001)}
+    ns.save()
+    assert not ns.config.dirty
+    assert other.stat().st_mtime_ns == mtime
+
+    reload(True)
+    assert get('user', 10001).allows == {'a.b', 'e.f'}
+    assert get('user', 10002).allows == {'c.d'}
+
+
+def test_refresh_does_not_dirty_shards(sharded):
+    group = get('user', 10001)
+    (sharded / 'user' / f'{shard_of(10001)}.yml').write_text('10001:\n  permissions: [-a.b]\n', encoding='utf-8')
+    ns = get_namespace('user', False)
+    ns.refresh([10001])
+    assert group.check('a.b') == CheckResult.DENY
+    assert not ns.config.dirty and not ns.dirty
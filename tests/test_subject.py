@@ -0,0 +1,34 @@
+import pytest
+
+from nonebot_plugin_flexperm.check import check
+from nonebot_plugin_flexperm.core import get_namespace, get_subject, CheckResult
+
+
+@pytest.mark.parametrize('native_id', ['123', '0123', '+123', ' 123'])
+def test_numeric_id_matches_int_key(load, native_id):
+    load(user='123:\n  permissions: [a.b]\n')
+    assert get_namespace('user', False).subject_key('onebot', native_id) == 123
+    assert get_subject('user', 'onebot', native_id).check('a.b') == CheckResult.ALLOW
+
+
+def test_int_key_preferred_over_prefixed(load):
+    load(user='123:\n  permissions: [a.b]\nonebot:0123:\n  permissions: [-a.b]\n')
+    assert get_namespace('user', False).subject_key('onebot', '0123') == 123
+
+
+def test_prefixed_key_for_non_canonical_id(load):
+    load(user='onebot:0123:\n  permissions: [a.b]\n')
+    assert get_namespace('user', False).subject_key('onebot', '0123') == 'onebot:0123'
+    assert get_namespace('user', False).subject_key('onebot', '123') is None
+
+
+def test_other_adapter_not_converted(load):
+    load(user='123:\n  permissions: [a.b]\n')
+    assert get_namespace('user', False).subject_key('other', '0123') is None
+
+
+def test_event_with_non_canonical_id(load, bot, private_event):
+    load(user='123:\n  permissions: [a.b]\n')
+    event = private_event(123)
+    event.user_id = '0123'
+    assert check(bot, event, 'a.b')
@@ -0,0 +1,80 @@
+import pytest
+
+from nonebot_plugin_flexperm import plugin, usage
+from nonebot_plugin_flexperm.check import check
+from nonebot_plugin_flexperm.config import c
+from nonebot_plugin_flexperm.core import get, get_namespace
+
+USERS = '''
+10001:
+  permissions:
+    - a.*
+  inherits: [global:mods]
+10002:
+  permissions:
+    - b.*
+    - b.x
+  expires:
+    b.*: 2099-01-01 00:00:00
+'''
+
+GLOBAL = '''
+mods:
+  permissions:
+    - mod.*
+'''
+
+
+@pytest.fixture
+def counting(load, monkeypatch):
+    monkeypatch.setattr(c, 'flexperm_usage', True)
+    load(user=USERS, **{'global': GLOBAL})
+    usage.load()
+    yield
+    usage.load()
+
+
+def test_counts_every_check(counting, bot, private_event):
+    for _ in range(3):
+        assert check(bot, private_event(10001), 'a.b')
+        assert check(bot, private_event(10001), 'mod.kick')
+    assert usage.rules['user:10001', 'a.*'] == 3
+    assert usage.rules['global:mods', 'mod.*'] == 3
+    assert usage.edges['user:10001', 'global:mods'] == 3
+
+    # 修改后链签名改变，重新查找起决定作用的描述
+    get('user', 10001).add('-mod.kick')
+    assert not check(bot, private_event(10001), 'mod.kick')
+    assert usage.rules['user:10001', '-mod.kick'] == 1
+    assert usage.edges['user:10001', 'global:mods'] == 3
+
+
+def test_report_does_not_build_groups(counting):
+    report = usage.report()
+    assert ('user:10001', 'global:mods') in report.unused_inherits
+    assert not get_namespace('user', False).groups
+
+
+def test_timed_coverer_is_kept(counting):
+    assert not usage.report().shadowed_rules
+
+    # 报告来自别处（如旧的报告）时，清理也不移除
+    stale = usage.UsageReport(0, [], [], [('user:10002', 'b.x', 'b.*')], [])
+    assert usage.prune(stale, dead=False, unreachable=False) == 0
+    assert 'b.x' in get('user', 10002).allows
+
+
+def test_groups_inherited_by_presets_are_reachable(load, monkeypatch, tmp_path, bot, private_event):
+    monkeypatch.setattr(c, 'flexperm_usage', True)
+    preset = tmp_path / 'preset.yml'
+    preset.write_text('anyone:\n  inherits: [global:helpers]\n', encoding='utf-8')
+    monkeypatch.setitem(plugin.plugins, 'test_usage_preset', plugin.PluginHandler('test_usage_preset').preset(preset))
+    load(**{'global': 'helpers:\n  permissions:\n    - help.*\norphan: {}\n'})
+    assert check(bot, private_event(10001), 'help.me')
+
+    report = usage.report()
+    assert report.unreachable_groups == ['global:orphan']
+    usage.prune(report, dead=False, shadowed=False)
+    assert 'helpers' in get_namespace('global', False).config
+    assert check(bot, private_event(10001), 'help.me')
+    usage.load()
@@ -0,0 +1,64 @@
+"""
+测量插件的导入耗时和启动耗时。每轮在新的子进程中进行，以排除模块缓存的影响。
+
+用法：python tools/bench_startup.py [轮数] [权限配置目录]
+
+未指定权限配置目录时使用临时空目录。
+"""
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHILD = r'''
+import asyncio, json, sys, time
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+import nonebot
+# 不启动任何服务器的驱动器，启动钩子运行完毕后立即退出
+nonebot.init(driver='~none', flexperm_base=sys.argv[2])
+t1 = time.perf_counter()
+nonebot.require('nonebot_plugin_flexperm')
+t2 = time.perf_counter()
+lazy = 'ruamel.yaml' not in sys.modules
+driver = nonebot.get_driver()
+times = {}
+
+
+# 最后注册，启动钩子按注册顺序运行，运行到这里时其他钩子都已完成
+@driver.on_startup
+async def _():
+    times['startup'] = time.perf_counter() - t2
+    # 启动完成后再退出，启动过程中退出会跳过关闭钩子
+    asyncio.get_running_loop().call_soon(driver.exit)
+
+nonebot.run()
+print(json.dumps({'nonebot': t1 - t0, 'import': t2 - t1, 'startup': times['startup'], 'lazy_yaml': lazy}))
+'''
+
+
+def run_once(base: str) -> dict:
+    out = subprocess.run([sys.executable, '-c', CHILD, str(ROOT), base],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        base = sys.argv[2] if len(sys.argv) > 2 else tmp
+        results = [run_once(base) for _ in range(rounds)]
+
+    for key in ('nonebot', 'import', 'startup'):
+        values = [r[key] * 1000 for r in results]
+        print(f'{key:8} median {statistics.median(values):8.2f} ms   min {min(values):8.2f} ms   '
+              f'max {max(values):8.2f} ms')
+    print('ruamel.yaml deferred until startup:', all(r['lazy_yaml'] for r in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""
+离线对比正常权限检查与对照算法的结果。
+
+用法：python tools/fuzz_check.py [轮数] [随机数种子]
+"""
+import sys
+from pathlib import Path
+
+import nonebot
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    nonebot.init()
+    nonebot.require('nonebot_plugin_flexperm')
+    from nonebot_plugin_flexperm.shadow import fuzz
+
+    diverged = fuzz(iterations, seed)
+    print(f'{iterations} rounds, {diverged} divergences')
+    sys.exit(1 if diverged else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+测量保存、重新加载和首次加载权限组时事件循环被阻塞的时长。
+
+使用 none 驱动器和一个不连接任何服务的假适配器运行 NoneBot ，在持续并发处理模拟事件的同时依次触发：
+
+- save：修改若干用户后，由定时任务执行 save_all ，与每 5 分钟的自动保存相同。
+- reload：在协程中直接调用 reload ，与 /flexperm.reload 命令相同。
+- first-load：重新加载后的第一个事件，会在权限检查中读取 user 名称空间的配置文件。
+- cold-group：已读取的名称空间中尚未构建的权限组，在权限检查中逐个构建。
+
+另有一个每毫秒醒来一次的协程测量事件循环延迟，最后输出整体延迟分布和各操作期间的最大阻塞时长。
+
+用法：python tools/loop_stall.py [用户数] [轮数] [配置项=值 ...]
+
+配置项会传给 nonebot.init ，值按 JSON 解析，失败时作为字符串，如 flexperm_journal=true 。
+"""
+import asyncio
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import nonebot  # noqa: E402
+from nonebot.adapters import Adapter, Bot, Event  # noqa: E402
+
+TICK = 0.001
+EVENT_RATE = 200
+HOT_USERS = 200
+COLD_GROUPS = 50
+
+
+class FakeAdapter(Adapter):
+    @classmethod
+    def get_name(cls) -> str:
+        return 'Fake'
+
+    async def _call_api(self, bot, api, **data):
+        return None
+
+
+class FakeBot(Bot):
+    async def send(self, event, message, **kwargs):
+        return None
+
+
+class FakeEvent(Event):
+    user_id: str
+    group_id: Optional[str] = None
+
+    def get_type(self) -> str:
+        return 'notice'
+
+    def get_event_name(self) -> str:
+        return 'notice.fake'
+
+    def get_event_description(self) -> str:
+        return f'{self.user_id}@{self.group_id}'
+
+    def get_message(self):
+        raise ValueError('Event has no message!')
+
+    def get_user_id(self) -> str:
+        return self.user_id
+
+    def get_session_id(self) -> str:
+        return f'{self.group_id}_{self.user_id}' if self.group_id else self.user_id
+
+    def is_tome(self) -> bool:
+        return False
+
+
+def write_config(base: Path, users: int):
+    base.mkdir(parents=True, exist_ok=True)
+    (base / 'global.yml').write_text('anyone:\n  permissions:\n    - stall.use\n'
+                                     'group:\n  permissions: []\nprivate:\n  permissions: []\n'
+                                     'group_admin:\n  permissions: []\ngroup_owner:\n  inherits: [group_admin]\n'
+                                     'superuser:\n  permissions: ["*"]\n'
+                                     'moderator:\n  permissions:\n    - stall.*\n    - -stall.secret\n',
+                                     encoding='utf-8')
+    lines = []
+    for i in range(users):
+        lines.append(f'fake:{100000 + i}:\n  permissions:\n    - stall.item{i % 97}\n    - -stall.deny{i % 13}\n'
+                     + ('  inherits: [global:moderator]\n' if i % 7 == 0 else ''))
+    (base / 'user.yml').write_text(''.join(lines), encoding='utf-8')
+    (base / 'group.yml').write_text(''.join(f'fake:{i}:\n  permissions:\n    - stall.g{i % 11}\n'
+                                            for i in range(max(users // 10, 1))), encoding='utf-8')
+
+
+class Monitor:
+    """
+    测量事件循环延迟：每次睡眠 TICK 秒，实际多睡的时间即为这段时间内事件循环被阻塞的时长。
+    """
+
+    def __init__(self):
+        self.samples: List[Tuple[float, float]] = []
+        self.running = True
+
+    async def run(self):
+        while self.running:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            end = time.perf_counter()
+            self.samples.append((end, end - start - TICK))
+
+    def max_in(self, start: float, end: float) -> float:
+        # 阻塞结束后监测协程才会醒来，因此把窗口稍向后延伸
+        return max((lag for t, lag in self.samples if start <= t <= end + 0.05), default=0)
+
+
+def parse_extra(args: List[str]) -> Dict[str, Union[str, int, float, bool, list]]:
+    extra = {}
+    for arg in args:
+        key, _, value = arg.partition('=')
+        try:
+            extra[key] = json.loads(value)
+        except ValueError:
+            extra[key] = value
+    return extra
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    extra = parse_extra(sys.argv[3:])
+
+    tmp = tempfile.TemporaryDirectory()
+    base = Path(tmp.name)
+    write_config(base, users)
+
+    nonebot.init(driver='~none', log_level='WARNING', flexperm_base=base, **extra)
+    driver = nonebot.get_driver()
+    driver.register_adapter(FakeAdapter)
+    nonebot.require('nonebot_plugin_flexperm')
+
+    from nonebot.message import handle_event
+    from nonebot_plugin_flexperm import register, core
+    from nonebot_plugin_flexperm.adapters import AdapterHandler
+
+    class FakeHandler(AdapterHandler):
+        adapter = 'Fake'
+
+        def is_private_chat(self, event):
+            return event.group_id is None
+
+        def get_group_id(self, event):
+            return event.group_id
+
+        def get_group_role(self, event):
+            return None
+
+    P = register('stall')
+    matcher = nonebot.on_notice(permission=P('use'), block=True)
+
+    @matcher.handle()
+    async def _():
+        pass
+
+    bot = FakeBot(driver._adapters['Fake'], 'stall')
+    monitor = Monitor()
+    windows: Dict[str, List[Tuple[float, float]]] = {}
+    latencies: List[float] = []
+    rng = random.Random(0)
+
+    def event_for(index: int) -> FakeEvent:
+        group = str(rng.randrange(max(users // 10, 1))) if rng.random() < 0.5 else None
+        return FakeEvent(user_id=str(100000 + index), group_id=group)
+
+    async def dispatch(event: FakeEvent):
+        start = time.perf_counter()
+        await handle_event(bot, event)
+        latencies.append(time.perf_counter() - start)
+
+    async def stream():
+        # 持续并发地产生事件，只涉及少量常用用户
+        tasks = set()
+        while monitor.running:
+            task = asyncio.create_task(dispatch(event_for(rng.randrange(HOT_USERS))))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            await asyncio.sleep(1 / EVENT_RATE)
+
+    async def timed(name: str, coro):
+        start = time.perf_counter()
+        await coro
+        windows.setdefault(name, []).append((start, time.perf_counter()))
+
+    async def scheduled_save():
+        from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+        from nonebot_plugin_apscheduler import scheduler
+
+        done = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def listener(event):
+            if event.job_id == 'flexperm.save':
+                loop.call_soon_threadsafe(done.set)
+
+        scheduler.add_listener(listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+        try:
+            scheduler.get_job('flexperm.save').modify(next_run_time=datetime.now())
+            await done.wait()
+        finally:
+            scheduler.remove_listener(listener)
+
+    async def reload():
+        core.reload(True)
+
+    async def workload():
+        monitor_task = asyncio.create_task(monitor.run())
+        stream_task = asyncio.create_task(stream())
+        # 预热常用用户
+        for i in range(HOT_USERS):
+            await dispatch(event_for(i))
+        await asyncio.sleep(1)
+        baseline = len(monitor.samples)
+        next_cold = HOT_USERS
+        for _ in range(rounds):
+            for i in rng.sample(range(users), 50):
+                P.add_permission(f'user:fake:{100000 + i}', f'edited{rng.randrange(1000)}')
+            await timed('save', scheduled_save())
+            await asyncio.sleep(0.5)
+            await timed('reload', reload())
+            await timed('first-load', dispatch(event_for(0)))
+            await asyncio.sleep(0.5)
+            cold = [event_for(i) for i in range(next_cold, min(next_cold + COLD_GROUPS, users))]
+            next_cold += COLD_GROUPS
+            await timed('cold-group', asyncio.gather(*(dispatch(e) for e in cold)))
+            await asyncio.sleep(0.5)
+        monitor.running = False
+        await asyncio.gather(monitor_task, stream_task)
+        report(users, rounds, extra, monitor, baseline, windows, latencies)
+        driver.exit()
+
+    @driver.on_startup
+    async def _():
+        # 在本插件的启动钩子（读取配置）之后运行
+        asyncio.get_running_loop().create_task(workload())
+
+    nonebot.run()
+    tmp.cleanup()
+
+
+def report(users: int, rounds: int, extra: dict, monitor: Monitor, baseline: int,
+           windows: Dict[str, List[Tuple[float, float]]], latencies: List[float]):
+    lags = [lag * 1000 for _, lag in monitor.samples[baseline:]]
+    print(f'users {users}, rounds {rounds}, config {extra or "{}"}')
+    print(f'loop lag     p50 {percentile(lags, .5):8.2f} ms   p90 {percentile(lags, .9):8.2f} ms   '
+          f'p99 {percentile(lags, .99):8.2f} ms   max {max(lags, default=0):8.2f} ms')
+    ms = [x * 1000 for x in latencies]
+    print(f'event        p50 {percentile(ms, .5):8.2f} ms   p99 {percentile(ms, .99):8.2f} ms   '
+          f'({len(ms)} events)')
+    for name in ('save', 'reload', 'first-load', 'cold-group'):
+        spans = windows.get(name, [])
+        durations = [(end - start) * 1000 for start, end in spans]
+        stalls = [monitor.max_in(start, end) * 1000 for start, end in spans]
+        if not spans:
+            continue
+        print(f'{name:12} duration median {statistics.median(durations):8.2f} ms   '
+              f'max stall median {statistics.median(stalls):8.2f} ms   worst {max(stalls):8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()